@@ -1,20 +1,67 @@
 import dash_bootstrap_components as dbc
-from dash import html, dcc, Dash, Output, Input
+import functools
+import json
+from datetime import datetime, timedelta
+from flask import Response, request
+from dash import html, dcc, Dash, Output, Input, State, callback_context
+from dash.exceptions import PreventUpdate
+from plotly.io.json import to_json_plotly
 from helpers.data_processing import (
     EnergyDataDay,
     EnergyDataHour,
     EnergyDataMinute,
+    EnergyDataMinuteSince,
     EnergyDataMonth,
+    EnergyRangeData,
     GasDataDay,
     GasDataHour,
     GasDataMonth,
+    GasRangeData,
+    GasSummaryData,
+    LiveData,
+    SummaryData,
+    YoulessData,
+    create_cache,
+    for_device,
+    ingest_version,
+    summary_for,
 )
-from helpers.charts import MonitoringLayout
-from config import DEBUG_MODE, GAS_ENABLED
+from helpers.charts import (
+    CURRENT_MAX_POINTS,
+    EXPLORER_CUSTOM,
+    ExplorerLayout,
+    MonitoringLayout,
+    explorer_range,
+    extend_current,
+    plot_live,
+    plot_range,
+)
+from helpers.archive import Archive
+from helpers.export import EXPORT_FORMATS, export, parse_range
+from helpers.metrics import CONTENT_TYPE, REGISTRY
+from helpers.devices import ALL_DEVICES, DEVICE_LIST
+from helpers.storage import TIME_FORMAT
+from config import ARCHIVE_PATH, DB_PATH, DEBUG_MODE, SAMPLER_ENABLED
+
+GAS_DEVICES = [device for device in DEVICE_LIST if device.gas_enabled]
 
 nav_items = [dbc.NavLink("Electricity", href="/", active="exact")]
-if GAS_ENABLED:
+if GAS_DEVICES:
     nav_items.append(dbc.NavLink("Gas", href="/gas", active="exact"))
+nav_items.append(dbc.NavLink("Explorer", href="/explorer", active="exact"))
+RANGE_DATA = {'Electricity': (EnergyRangeData, DEVICE_LIST)}
+if GAS_DEVICES:
+    RANGE_DATA['Gas'] = (GasRangeData, GAS_DEVICES)
+
+# Only shown with more than one device
+device_select = dcc.Dropdown(
+    id="device",
+    options=[{'label': 'All devices', 'value': ALL_DEVICES}]
+    + [{'label': device.label, 'value': device.name} for device in DEVICE_LIST],
+    value=DEVICE_LIST[0].name,
+    clearable=False,
+    style={} if len(DEVICE_LIST) > 1 else {'display': 'none'},
+)
 nav = dbc.Container(
     [
         dbc.NavbarSimple(
@@ -23,58 +70,236 @@ nav = dbc.Container(
             brand_href="#",
             color="primary",
             dark=True,
-        )
+        ),
+        html.Br(),
+        device_select,
     ]
 )
 
 
 content = html.Div(id="page-content")
 
-app = Dash(external_stylesheets=[dbc.themes.FLATLY])
+# The components of the pages only exist once a page is rendered
+app = Dash(external_stylesheets=[dbc.themes.FLATLY], suppress_callback_exceptions=True)
 app.title = 'Energy usage monitoring'
 app.layout = dbc.Container([dcc.Location(id="url"), nav, html.Br(), content])
 
 
-@app.callback(Output("page-content", "children"), [Input("url", "pathname")])
-def render_page_content(pathname):
-    if pathname == "/":
-        energy_layout = MonitoringLayout(
-            data_minute=EnergyDataMinute,
-            data_hour=EnergyDataHour,
-            data_day=EnergyDataDay,
-            data_month=EnergyDataMonth,
+@app.server.route('/metrics')
+def metrics():
+    return REGISTRY.render(), 200, {'Content-Type': CONTENT_TYPE}
+
+
+@app.server.route('/export/<table_name>')
+def export_table(table_name):
+    # e.g. /export/youless_minute?start=2022-01-01&end=2022-02-01&format=parquet&aggregate=hour
+    export_format = request.args.get('format', 'csv')
+    try:
+        start, end = parse_range(request.args.get('start'), request.args.get('end'))
+        stream = export(
+            DB_PATH,
+            table_name,
+            start,
+            end,
+            export_format,
+            request.args.get('aggregate'),
+            Archive(ARCHIVE_PATH),
         )
+    except ValueError as e:
+        return str(e), 400
+    except ImportError:
+        return 'The Parquet export needs pyarrow', 501
+    return Response(
+        stream,
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename={table_name}.{export_format}'
+        },
+    )
 
-        return energy_layout.render(
+
+def not_found(message):
+    # dbc.Jumbotron was removed in dash-bootstrap-components 1.0
+    return html.Div(
+        [
+            html.H1("404: Not found", className="text-danger"),
+            html.Hr(),
+            html.P(message),
+        ],
+        className="p-5 bg-light rounded-3",
+    )
+
+
+def monitoring_layout(page: dict):
+    # Layout of the electricity or gas page, None if the device has no gas
+    pathname, device = page['pathname'], page['device']
+    if pathname == "/":
+        return MonitoringLayout(
+            data_minute=for_device(EnergyDataMinute, device),
+            data_hour=for_device(EnergyDataHour, device),
+            data_day=for_device(EnergyDataDay, device),
+            data_month=for_device(EnergyDataMonth, device),
             title='Energy Monitoring',
             summary_stats_suffix=' kWh',
             last_24h_unit='Wh',
             last_30d_unit='kWh',
             last_year_unit='kWh',
+            live=SAMPLER_ENABLED,
+            data_summary=summary_for(SummaryData, device),
         )
-    elif pathname == "/gas":
-        gas_layout = MonitoringLayout(
-            data_minute=None,
-            data_hour=GasDataHour,
-            data_day=GasDataDay,
-            data_month=GasDataMonth,
-        )
+    if device != ALL_DEVICES and device not in [d.name for d in GAS_DEVICES]:
+        return None
+    return MonitoringLayout(
+        data_minute=None,
+        data_hour=for_device(GasDataHour, device, GAS_DEVICES),
+        data_day=for_device(GasDataDay, device, GAS_DEVICES),
+        data_month=for_device(GasDataMonth, device, GAS_DEVICES),
+        title='Gas Monitoring',
+        summary_stats_suffix=' m³',
+        last_24h_unit='L',
+        last_30d_unit='m³',
+        last_year_unit='m³',
+        data_summary=summary_for(GasSummaryData, device, GAS_DEVICES),
+    )
 
-        return gas_layout.render(
-            title='Gas Monitoring',
-            summary_stats_suffix=' m³',
-            last_24h_unit='L',
-            last_30d_unit='m³',
-            last_year_unit='m³',
-        )
+
+@app.callback(
+    Output("page-content", "children"),
+    [Input("url", "pathname"), Input("device", "value")],
+)
+def render_page_content(pathname, device):
+    if pathname in ("/", "/gas"):
+        page = {'pathname': pathname, 'device': device}
+        layout = monitoring_layout(page)
+        if layout is None:
+            return not_found("No gas data is collected for this device")
+        return layout.render(page)
+    elif pathname == "/explorer":
+        return ExplorerLayout(sources=list(RANGE_DATA)).render(title='Explorer')
     # If the user tries to reach a different page, return a 404 message
-    return dbc.Jumbotron(
-        [
-            html.H1("404: Not found", className="text-danger"),
-            html.Hr(),
-            html.P(f"The pathname {pathname} was not recognised..."),
-        ]
+    return not_found(f"The pathname {pathname} was not recognised...")
+
+
+# Outputs of the monitoring page callbacks, shared by the worker processes
+FIGURE_CACHE = create_cache('figures')
+
+
+def shared_output(callback):
+    """
+    Keep the JSON of a callback's output until the logger stores new data or
+    the minute changes (the queries are relative to it), so only one worker
+    builds it.
+    """
+
+    @functools.wraps(callback)
+    def wrapper(*args):
+        version = ingest_version()
+        if version is None:
+            return callback(*args)
+        key = (
+            callback.__name__,
+            json.dumps(args, sort_keys=True),
+            YoulessData.now().isoformat(),
+        )
+        output, _ = FIGURE_CACHE.get_or_compute(
+            key, version, lambda: to_json_plotly(callback(*args))
+        )
+        return json.loads(output)
+
+    return wrapper
+
+
+# Every part of a monitoring page has its own callback, which only runs the
+# queries of that part
+@app.callback(Output("summary", "children"), Input("monitoring-page", "data"))
+@shared_output
+def update_summary(page):
+    return monitoring_layout(page).render_summary()
+
+
+@app.callback(Output("last-365-days", "figure"), Input("monitoring-page", "data"))
+@shared_output
+def update_last_year(page):
+    return monitoring_layout(page).plot_year()
+
+
+@app.callback(
+    Output("history-tab", "children"),
+    Input("history-tabs", "active_tab"),
+    State("monitoring-page", "data"),
+)
+@shared_output
+def render_history_tab(tab_id, page):
+    return monitoring_layout(page).render_tab(tab_id)
+
+
+@app.callback(
+    Output("current", "extendData"),
+    Output("current-last-time", "data"),
+    Input("current-interval", "n_intervals"),
+    State("current-last-time", "data"),
+    State("device", "value"),
+    prevent_initial_call=True,
+)
+def update_current(n_intervals, last_time, device):
+    if not last_time:
+        raise PreventUpdate
+    # A client which was asleep for long only needs the last 12 hours
+    after = max(
+        datetime.strptime(last_time, TIME_FORMAT),
+        datetime.now() - timedelta(minutes=CURRENT_MAX_POINTS),
+    )
+    df = for_device(EnergyDataMinuteSince, device)(after).data
+    if df is None or df.empty:
+        raise PreventUpdate
+    return extend_current(df), df['time'].max()
+
+
+@app.callback(
+    Output("live", "figure"),
+    Input("live-interval", "n_intervals"),
+    State("device", "value"),
+)
+def update_live(n_intervals, device):
+    devices = (
+        DEVICE_LIST
+        if device == ALL_DEVICES
+        else [d for d in DEVICE_LIST if d.name == device]
     )
+    return plot_live({d.label: LiveData(device=d).data for d in devices})
+
+
+@app.callback(
+    Output("explorer-preset", "value"),
+    Input("explorer-range", "start_date"),
+    Input("explorer-range", "end_date"),
+    prevent_initial_call=True,
+)
+def pick_custom_range(start_date, end_date):
+    return EXPLORER_CUSTOM
+
+
+@app.callback(
+    Output("explorer-graph", "figure"),
+    Input("explorer-preset", "value"),
+    Input("explorer-range", "start_date"),
+    Input("explorer-range", "end_date"),
+    Input("explorer-source", "value"),
+    Input("device", "value"),
+)
+def update_explorer(preset, start_date, end_date, source, device):
+    triggered = callback_context.triggered[0]['prop_id']
+    if preset != EXPLORER_CUSTOM and triggered.startswith('explorer-range'):
+        # pick_custom_range switches the preset, which triggers this again
+        raise PreventUpdate
+    start, end = explorer_range(preset, start_date, end_date, datetime.now())
+    data_class, devices = RANGE_DATA[source]
+    if device != ALL_DEVICES and device not in [d.name for d in devices]:
+        raise PreventUpdate
+    data = for_device(data_class, device, devices)(start, end)
+    if data.data is None:
+        raise PreventUpdate
+    return plot_range(data.data, data.resolution, source)
 
 
 if __name__ == '__main__':
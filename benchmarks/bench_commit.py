@@ -0,0 +1,171 @@
+"""
+Commit latency of the logger while the dashboard reads the same database.
+
+    python -m benchmarks.bench_commit [--years 1] [--runs 20] [--readers 2]
+                                      [--format text|compact]
+
+Stores one batch per scraper `--runs` times while `--readers` processes run
+dashboard queries in a loop. Once the way the logger used to: a connection
+and a commit per scraper in the rollback journal mode. Then with one WAL
+connection and a single transaction per run. Prints the median and worst
+time of a run, the number of reads and the longest a read had to wait.
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3 as sql
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks.generate_db import ENERGY_TABLES, GAS_TABLES, generate
+from benchmarks.simulator import align, report_unit, synthetic_values
+from helpers import storage
+
+# Values per scraper in one run: a few pages of minutes, the rest one page
+BATCH_VALUES = {60: 120, 3600: 24, 86400: 12}
+READ_QUERIES = [
+    'SELECT time, energy_consumption FROM youless_minute WHERE time >= ?',
+    'SELECT time, energy_consumption FROM youless_hour WHERE time >= ?',
+    'SELECT SUM(energy_consumption) FROM youless_day WHERE time >= ?',
+]
+
+
+def read_loop(db_path: str, since: str, stop, reads, slowest):
+    # Like the dashboard: a new connection per query
+    while not stop.is_set():
+        for query in READ_QUERIES:
+            start = time.perf_counter()
+            con = sql.connect(db_path)
+            con.execute(query, (since,)).fetchall()
+            con.close()
+            elapsed = time.perf_counter() - start
+            with reads.get_lock():
+                reads.value += 1
+                slowest.value = max(slowest.value, elapsed)
+
+
+def batches(end: datetime, run: int) -> list:
+    tables = ENERGY_TABLES + GAS_TABLES
+    result = []
+    for table_name, path, dt, granularity in tables:
+        n = BATCH_VALUES[dt]
+        # Every run overlaps the previous one by half and adds new values
+        last = align(end, dt) + (run + 1) * (n // 2) * dt
+        times = last - np.arange(n)[::-1] * dt
+        values = synthetic_values(times, path, dt)
+        result.append((table_name, granularity, times, values, report_unit(path, dt)))
+    return result
+
+
+def store(con: sql.Connection, table_name, granularity, times, values, unit):
+    # The steps of YoulessBaseLogger.store_batch
+    storage.ensure_table(con, table_name, storage.storage_format(con))
+    storage.update_rollup(con, table_name, granularity, times, values)
+    inserted, updated = storage.upsert(con, table_name, times, values, unit)
+    if inserted or updated:
+        storage.bump_version(con, table_name)
+    storage.raise_meta(
+        con,
+        table_name,
+        'high_water_mark',
+        storage.format_times(times.max(keepdims=True))[0],
+    )
+
+
+def run_legacy(db_path: str, run_batches: list):
+    for batch in run_batches:
+        with sql.connect(db_path) as con:
+            store(con, *batch)
+            con.commit()
+        con.close()
+
+
+def run_shared(con: sql.Connection, run_batches: list):
+    con.execute('BEGIN IMMEDIATE')
+    for batch in run_batches:
+        store(con, *batch)
+    con.commit()
+
+
+def measure(db_path: str, mode: str, runs: int, readers: int, end: datetime):
+    if mode == 'legacy':
+        with sql.connect(db_path) as con:
+            con.execute('PRAGMA journal_mode = DELETE')
+        con.close()
+        shared = None
+    else:
+        shared = storage.connect(db_path)
+
+    stop = multiprocessing.Event()
+    reads = multiprocessing.Value('i', 0)
+    slowest = multiprocessing.Value('d', 0.0)
+    since = (end - timedelta(hours=12)).strftime(storage.TIME_FORMAT)
+    processes = [
+        multiprocessing.Process(
+            target=read_loop, args=(db_path, since, stop, reads, slowest)
+        )
+        for _ in range(readers)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(0.2)
+
+    timings = []
+    for run in range(runs):
+        run_batches = batches(end, run)
+        start = time.perf_counter()
+        if shared is None:
+            run_legacy(db_path, run_batches)
+        else:
+            run_shared(shared, run_batches)
+        timings.append(time.perf_counter() - start)
+
+    stop.set()
+    for process in processes:
+        process.join()
+    if shared is not None:
+        shared.close()
+    return timings, reads.value, slowest.value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument(
+        '--format',
+        choices=[storage.TEXT_FORMAT, storage.COMPACT_FORMAT],
+        default=storage.TEXT_FORMAT,
+    )
+    args = parser.parse_args()
+
+    end = datetime.now().replace(second=0, microsecond=0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = os.path.join(tmp_dir, 'source.db')
+        generate(source, args.years, args.format, end=end)
+
+        print(
+            f'{"mode":8} {"median ms":>10} {"max ms":>10} {"reads":>8}'
+            f' {"max read ms":>12}'
+        )
+        for mode in ('legacy', 'shared'):
+            db_path = os.path.join(tmp_dir, f'{mode}.db')
+            shutil.copy(source, db_path)
+            timings, reads, slowest = measure(
+                db_path, mode, args.runs, args.readers, end
+            )
+            print(
+                f'{mode:8} {statistics.median(timings) * 1000:>10.2f}'
+                f' {max(timings) * 1000:>10.2f} {reads:>8} {slowest * 1000:>12.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Throughput of `logger.py import` for a large CSV export of minutes.
+
+    python -m benchmarks.bench_import [--rows 1000000] [--format text|compact]
+                                      [--store]
+
+Imports the file into an empty database and a second time into the filled
+one, where every row is known already. With --store the rows are also stored
+the way the scrapers do, one page at a time, for comparison. Prints the rows
+per minute of each.
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+import numpy as np
+
+import logger
+from benchmarks.simulator import synthetic_values
+from helpers import storage
+from helpers.export import COLUMNS
+
+TABLE = 'youless_minute'
+START = datetime(2015, 1, 1)
+# Values of one scraped page of minutes
+PAGE_SIZE = 30
+
+
+def _columns(count: int) -> tuple:
+    times = np.datetime64(START, 's') + np.arange(count) * 60
+    return times, synthetic_values(times, 'V', 60)
+
+
+def write_csv(path: str, count: int):
+    times, values = _columns(count)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(COLUMNS)
+        writer.writerows(
+            zip(storage.format_times(times), values.tolist(), ['Watt'] * count)
+        )
+
+
+def _timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def _store(count: int):
+    times, values = _columns(count)
+    scraper = logger.YoulessEnergyMinute()
+    for offset in range(0, count, PAGE_SIZE):
+        scraper.store_data(
+            times[offset : offset + PAGE_SIZE],
+            values[offset : offset + PAGE_SIZE],
+            'Watt',
+        )
+
+
+def measure(count: int, storage_format: str, store: bool) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'minute.csv')
+        write_csv(csv_path, count)
+        for name in ('import', 'reimport', 'store'):
+            if name == 'store' and not store:
+                continue
+            db_path = os.path.join(
+                tmp_dir, 'stored.db' if name == 'store' else 'youless.db'
+            )
+            with patch('logger.DB_PATH', db_path), patch(
+                'logger.ARCHIVE_PATH', os.path.join(tmp_dir, 'archive')
+            ), patch('logger.STORAGE_FORMAT', storage_format):
+                if name == 'store':
+                    results[name] = _timed(_store, count)
+                else:
+                    results[name] = _timed(logger.import_data, csv_path, TABLE)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument(
+        '--format',
+        choices=[storage.TEXT_FORMAT, storage.COMPACT_FORMAT],
+        default=storage.TEXT_FORMAT,
+    )
+    parser.add_argument('--store', action='store_true')
+    args = parser.parse_args()
+
+    print(f'{"":<10} {"seconds":>10} {"rows/min":>12}')
+    for name, elapsed in measure(args.rows, args.format, args.store).items():
+        print(f'{name:<10} {elapsed:>10.2f} {args.rows / elapsed * 60:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+End-to-end timings of the logger and the dashboard per stage.
+
+    python -m benchmarks.bench_pipeline [--years 2] [--runs 3] [--latency 0.0]
+                                        [--format text|compact] [--json FILE]
+
+Generates a synthetic database, serves the device simulator and then
+measures fetching, converting and storing every report, each dashboard
+query (with a cold query cache) and every part of `MonitoringLayout`. The
+median of every stage is printed, --json writes them to a file to compare
+releases.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.generate_db import generate
+from benchmarks.simulator import YoulessSimulator
+from helpers import storage
+
+
+class Timings:
+    def __init__(self):
+        self.results = defaultdict(list)
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        yield
+        self.results[stage].append(time.perf_counter() - start)
+
+    def medians(self) -> dict:
+        return {
+            stage: statistics.median(values) for stage, values in self.results.items()
+        }
+
+
+def bench_logger(timings: Timings):
+    import logger
+
+    for scraper in logger.create_scrapers():
+        name = scraper.table_name
+        pages = list(range(1, scraper.report_pages + 1))
+        with timings.measure(f'fetch {name}'):
+            data = scraper.fetch_pages(pages)
+        with timings.measure(f'convert {name}'):
+            columns = [logger.YoulessBaseLogger.convert_columns(page) for page in data]
+        times = np.concatenate([c[0] for c in columns])
+        values = np.concatenate([c[1] for c in columns])
+        unit = columns[0][2]
+        with timings.measure(f'store {name}'):
+            scraper.store_data(times, values, unit)
+
+
+def bench_dashboard(timings: Timings):
+    from helpers import data_processing
+    from helpers.charts import MonitoringLayout
+
+    queries = [
+        data_processing.EnergyDataMinute,
+        data_processing.EnergyDataHour,
+        data_processing.EnergyDataDay,
+        data_processing.EnergyDataMonth,
+        data_processing.GasDataHour,
+        data_processing.GasDataDay,
+        data_processing.GasDataMonth,
+    ]
+    data_processing.QUERY_CACHE.clear()
+    for query in queries:
+        with timings.measure(f'query {query.__name__}'):
+            query()
+
+    # Same layout as the electricity page of app.py, data comes from the cache
+    layout = MonitoringLayout(
+        *queries[:4],
+        title='Energy Monitoring',
+        summary_stats_suffix=' kWh',
+        last_24h_unit='Wh',
+        last_30d_unit='kWh',
+        last_year_unit='kWh',
+    )
+    with timings.measure('render MonitoringLayout'):
+        layout.render({'pathname': '/', 'device': ''})
+    for tab_id, label in layout.tabs:
+        with timings.measure(f'render tab {label}'):
+            layout.render_tab(tab_id)
+    # The summary computed from the queries and as stored by the logger,
+    # both with a cold cache
+    data_processing.QUERY_CACHE.clear()
+    with timings.measure('render summary (queries)'):
+        layout.render_summary()
+    layout.data_summary = data_processing.SummaryData
+    data_processing.QUERY_CACHE.clear()
+    with timings.measure('render summary (stored)'):
+        layout.render_summary()
+    with timings.measure('render last year'):
+        layout.plot_year()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument(
+        '--format',
+        choices=[storage.TEXT_FORMAT, storage.COMPACT_FORMAT],
+        default=storage.TEXT_FORMAT,
+    )
+    parser.add_argument('--json', help='write the median timings to this file')
+    args = parser.parse_args()
+
+    now = datetime.now().replace(second=0, microsecond=0)
+    timings = Timings()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'youless.db')
+        with timings.measure('generate database'):
+            generate(db_path, args.years, args.format, end=now)
+
+        with YoulessSimulator(
+            latency=args.latency, values_per_page=30, now=now
+        ) as device:
+            config_path = os.path.join(tmp_dir, 'config.json')
+            with open(config_path, 'w') as f:
+                json.dump(
+                    {
+                        'db_path': db_path,
+                        'debug_mode': False,
+                        'gas_enabled': True,
+                        'host': device.url,
+                        'storage_format': args.format,
+                    },
+                    f,
+                )
+            # The config is read on import
+            os.environ['YOULESS_CONFIG'] = config_path
+            for _ in range(args.runs):
+                bench_logger(timings)
+                bench_dashboard(timings)
+
+    results = timings.medians()
+    for stage, seconds in results.items():
+        print(f'{stage:40} {seconds * 1000:10.2f} ms')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(
+                {
+                    'python': sys.version.split()[0],
+                    'years': args.years,
+                    'format': args.format,
+                    'latency': args.latency,
+                    'median_seconds': results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Wall time and peak RSS of one full `python logger.py` run against a local
+stand-in Youless device and an empty database.
+
+    python -m benchmarks.bench_startup [--runs 5] [--max-seconds 3] [--max-rss-mb 60]
+
+Exits with status 1 when the median wall time or the peak RSS exceeds the
+given limits, so it can be used to catch startup regressions.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.simulator import YoulessSimulator
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def run(command: list, env: dict) -> tuple:
+    # Returns wall time in seconds and peak RSS in MB of the finished process
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        cwd=REPOSITORY_PATH,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError('{} failed'.format(' '.join(command)))
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def measure_logger(device_url: str, runs: int) -> list:
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_path = os.path.join(tmp_dir, 'config.json')
+            with open(config_path, 'w') as f:
+                json.dump(
+                    {
+                        'db_path': os.path.join(tmp_dir, 'youless.db'),
+                        'debug_mode': False,
+                        'gas_enabled': True,
+                        'host': device_url,
+                    },
+                    f,
+                )
+            env = {**os.environ, 'YOULESS_CONFIG': config_path}
+            results.append(run([sys.executable, 'logger.py'], env))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    parser.add_argument(
+        '--compare-pandas',
+        action='store_true',
+        help='also measure a bare `import pandas` for reference',
+    )
+    args = parser.parse_args()
+
+    with YoulessSimulator() as device:
+        results = measure_logger(device.url, args.runs)
+    wall = statistics.median(r[0] for r in results)
+    rss = max(r[1] for r in results)
+    print(f'logger.py        median wall {wall:6.3f} s   peak RSS {rss:7.1f} MB')
+
+    if args.compare_pandas:
+        results = [
+            run([sys.executable, '-c', 'import pandas'], dict(os.environ))
+            for _ in range(args.runs)
+        ]
+        print(
+            f'import pandas    median wall {statistics.median(r[0] for r in results):6.3f} s'
+            f'   peak RSS {max(r[1] for r in results):7.1f} MB'
+        )
+
+    failed = (args.max_seconds is not None and wall > args.max_seconds) or (
+        args.max_rss_mb is not None and rss > args.max_rss_mb
+    )
+    if failed:
+        print('Startup regression: limits exceeded')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
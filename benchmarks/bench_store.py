@@ -0,0 +1,118 @@
+"""
+Merge time of one logger batch into youless tables of increasing size.
+
+    python -m benchmarks.bench_store [--sizes 10000 100000 1000000] [--legacy]
+                                     [--format text|compact]
+
+The indexed UPSERT should stay flat while the table grows. With --legacy the
+previous tmp-table UPDATE/INSERT merge is measured as well (slow on big tables).
+"""
+
+import argparse
+import os
+import sqlite3 as sql
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from helpers import storage
+
+TABLE = 'youless_minute'
+BATCH_SIZE = 600
+START = datetime(2015, 1, 1)
+
+
+def _rows(start: int, count: int) -> list:
+    return [
+        (
+            (START + timedelta(minutes=i)).strftime(storage.TIME_FORMAT),
+            float(i % 1000),
+            'Watt',
+        )
+        for i in range(start, start + count)
+    ]
+
+
+def _columns(start: int, count: int) -> tuple:
+    times = np.datetime64(START, 's') + np.arange(start, start + count) * 60
+    return times, np.arange(start, start + count) % 1000.0, 'Watt'
+
+
+def _seed(con: sql.Connection, size: int, storage_format: str):
+    if storage_format is None:
+        # Table as created by the legacy logger, without a key on time
+        con.execute(
+            f'CREATE TABLE {TABLE} (time TIMESTAMP, energy_consumption REAL, unit TEXT)'
+        )
+        con.executemany(f'INSERT INTO {TABLE} VALUES (?, ?, ?)', _rows(0, size))
+    else:
+        storage.ensure_table(con, TABLE, storage_format)
+        storage.upsert(con, TABLE, *_columns(0, size))
+    con.commit()
+
+
+def _legacy_merge(con: sql.Connection, rows: list):
+    con.execute('DROP TABLE IF EXISTS tmp')
+    con.execute('CREATE TABLE tmp (time TIMESTAMP, energy_consumption REAL, unit TEXT)')
+    con.executemany('INSERT INTO tmp VALUES (?, ?, ?)', rows)
+    con.execute(f'''
+        UPDATE {TABLE} AS old
+        SET energy_consumption = (
+            SELECT energy_consumption FROM tmp WHERE time = old.time LIMIT 1
+        )
+        WHERE EXISTS (SELECT energy_consumption FROM tmp WHERE time = old.time)
+        ''')
+    con.execute(f'''
+        INSERT INTO {TABLE} (time, energy_consumption, unit)
+        SELECT time, energy_consumption, unit FROM tmp AS new
+        WHERE NOT EXISTS (SELECT 1 FROM {TABLE} old WHERE old.time = new.time)
+        ''')
+    con.commit()
+
+
+def measure(size: int, storage_format: str = None) -> float:
+    # Without a storage format the legacy merge is measured
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        con = sql.connect(os.path.join(tmp_dir, 'youless.db'))
+        _seed(con, size, storage_format)
+        # Half of the batch overlaps the newest stored rows, like a real run
+        first = size - BATCH_SIZE // 2
+        start = time.perf_counter()
+        if storage_format is None:
+            _legacy_merge(con, _rows(first, BATCH_SIZE))
+        else:
+            with con:
+                storage.upsert(con, TABLE, *_columns(first, BATCH_SIZE))
+        elapsed = time.perf_counter() - start
+        con.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument('--legacy', action='store_true')
+    parser.add_argument(
+        '--format',
+        choices=[storage.TEXT_FORMAT, storage.COMPACT_FORMAT],
+        default=storage.TEXT_FORMAT,
+    )
+    args = parser.parse_args()
+
+    print(
+        f'{"rows":>10} {"upsert ms":>10}'
+        + (f' {"legacy ms":>10}' if args.legacy else '')
+    )
+    for size in args.sizes:
+        line = f'{size:>10} {measure(size, args.format) * 1000:>10.2f}'
+        if args.legacy:
+            line += f' {measure(size) * 1000:>10.2f}'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Synthetic youless database with several years of logged data.
+
+    python -m benchmarks.generate_db youless.db [--years 3] [--format text|compact]
+                                                [--no-gas]
+
+The values follow the same daily pattern as the device simulator, so the
+dashboard shows realistic charts. Rollups are built as the logger would.
+"""
+
+import argparse
+import os
+import sqlite3 as sql
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks.simulator import align, report_unit, synthetic_values
+from helpers import storage
+
+# (table name, device path, seconds per value, rollup granularity)
+ENERGY_TABLES = [
+    ('youless_minute', 'V', 60, 'minute'),
+    ('youless_hour', 'V', 3600, 'hour'),
+    ('youless_day', 'V', 86400, 'day'),
+]
+GAS_TABLES = [
+    ('youless_hour_gas', 'W', 3600, 'hour'),
+    ('youless_day_gas', 'W', 86400, 'day'),
+]
+CHUNK_SIZE = 100000
+
+
+def generate(
+    db_path: str,
+    years: float = 3,
+    storage_format: str = storage.TEXT_FORMAT,
+    gas: bool = True,
+    end: datetime = None,
+) -> dict:
+    """
+    Fill the youless tables with `years` of data up to `end` (defaults to the
+    current minute). Returns the number of rows per table.
+    """
+    end = end or datetime.now().replace(second=0, microsecond=0)
+    start = end - timedelta(days=round(years * 365))
+    rows = {}
+    with sql.connect(db_path) as con:
+        for table_name, path, dt, granularity in ENERGY_TABLES + (
+            GAS_TABLES if gas else []
+        ):
+            storage.ensure_table(con, table_name, storage_format)
+            first = align(start, dt)
+            count = int((align(end, dt) - first).astype(np.int64)) // dt + 1
+            for offset in range(0, count, CHUNK_SIZE):
+                steps = np.arange(offset, min(offset + CHUNK_SIZE, count))
+                times = first + steps * dt
+                values = synthetic_values(times, path, dt)
+                storage.upsert(con, table_name, times, values, report_unit(path, dt))
+            storage.rebuild_rollup(con, table_name, granularity)
+            storage.bump_version(con, table_name)
+            con.commit()
+            rows[table_name] = count
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('db_path')
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument(
+        '--format',
+        choices=[storage.TEXT_FORMAT, storage.COMPACT_FORMAT],
+        default=storage.TEXT_FORMAT,
+    )
+    parser.add_argument('--no-gas', action='store_true')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db_path):
+        parser.error(f'{args.db_path} already exists')
+    start = time.perf_counter()
+    rows = generate(args.db_path, args.years, args.format, gas=not args.no_gas)
+    for table_name, count in rows.items():
+        print(f'{table_name:18} {count:>10} rows')
+    size = os.path.getsize(args.db_path) / 2**20
+    print(f'{size:.1f} MB written in {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Local stand-in for the JSON API of a Youless device.
+
+    python -m benchmarks.simulator [--port 8080] [--latency 0.2] [--gap-ratio 0.01]
+
+Serves `/V` (electricity) and `/W` (gas) reports with the `h` (minutes),
+`d` (hours) and `m` (days) paging of the device and the live reading of
+`/a`. Point the `host` config
+option to the printed address to run the logger against it.
+"""
+
+import argparse
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+def synthetic_values(times: np.ndarray, path: str, dt: int) -> np.ndarray:
+    """
+    Deterministic consumption per interval of `dt` seconds: Watt for the
+    minute and hour reports of `V`, kWh for its day report and m3 for `W`.
+    The same timestamp always gets the same value.
+    """
+    seconds = times.astype('M8[s]').astype(np.int64)
+    hour = (seconds % 86400) / 3600
+    # Low at night, peaks in the morning and the evening
+    daily = 1.2 + np.sin((hour - 7) / 12 * np.pi) + 0.6 * np.sin(hour / 24 * np.pi)
+    noise = (seconds // 60 % 100003 * 7919 % 1000) / 1000
+    if path == 'W':
+        return np.round((0.05 + 0.1 * daily * noise) * dt / 3600, 3)
+    watt = np.round(150 + 250 * daily + 400 * noise)
+    if dt >= 86400:
+        return np.round(watt * 24 / 1000, 3)
+    return watt
+
+
+def report_unit(path: str, dt: int) -> str:
+    # Unit of the values of `synthetic_values`
+    if path == 'W':
+        return 'm3'
+    return 'kWh' if dt >= 86400 else 'Watt'
+
+
+def align(time, dt: int) -> np.datetime64:
+    # Start of the interval of `dt` seconds holding `time`: the full minute,
+    # hour or midnight, in the local time the device reports
+    time = np.datetime64(time, 's')
+    return time - time.astype(np.int64) % dt
+
+
+def gaps(times: np.ndarray, ratio: float) -> np.ndarray:
+    # Deterministic mask of the values the device reports as missing ('*')
+    seconds = times.astype('M8[s]').astype(np.int64)
+    return (seconds // 60 % 99991 * 104729 % 10000) < ratio * 10000
+
+
+def format_value(value: float) -> str:
+    # The device uses comma decimals and pads values with a space
+    if float(value).is_integer():
+        return ' {:d}'.format(int(value))
+    return ' {:.3f}'.format(value).replace('.', ',')
+
+
+class YoulessSimulator:
+    """
+    Minimal stand-in for the Youless JSON API, served on localhost.
+    Every request sleeps `latency` seconds to mimic a slow device and
+    `gap_ratio` of the values are reported as missing. `now` is the time of
+    the newest value, or a callable returning it. `failing_pages` maps a page
+    number to how many requests of it are answered with a 503 first (inf for
+    all of them).
+    """
+
+    PAGE_PARAMS = {'h': 60, 'd': 3600, 'm': 86400}
+
+    def __init__(
+        self,
+        latency=0.0,
+        values_per_page=24,
+        now=None,
+        gap_ratio=0.0,
+        failing_pages=None,
+        host='127.0.0.1',
+        port=0,
+    ):
+        self.latency = latency
+        self.values_per_page = values_per_page
+        self.now = now or datetime(2022, 4, 10, 12, 0, 0)
+        self.gap_ratio = gap_ratio
+        self.failing_pages = dict(failing_pages or {})
+        self.address = (host, port)
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/'
+
+    def page(self, path: str, param: str, page: int) -> dict:
+        dt = self.PAGE_PARAMS[param]
+        n = self.values_per_page
+        now = self.now() if callable(self.now) else self.now
+        last = align(now, dt) - dt * n * (page - 1)
+        first = last - dt * (n - 1)
+        times = first + np.arange(n) * dt
+        values = [format_value(v) for v in synthetic_values(times, path, dt)]
+        for i in np.flatnonzero(gaps(times, self.gap_ratio)):
+            values[i] = '*'
+        return {
+            'un': report_unit(path, dt),
+            'tm': str(first),
+            'dt': dt,
+            'val': values,
+        }
+
+    def fails(self, page: int) -> bool:
+        with self._lock:
+            if self.failing_pages.get(page, 0) <= 0:
+                return False
+            self.failing_pages[page] -= 1
+            return True
+
+    def live(self) -> dict:
+        # Current power in Watt and the meter reading in kWh, like `/a?f=j`
+        now = np.datetime64(datetime.now(), 's')
+        power = synthetic_values(np.array([now]), 'V', 60)[0]
+        seconds = now.astype(np.int64)
+        return {
+            'cnt': format_value(round(seconds / 3600 * 0.4, 3)),
+            'pwr': int(power) + int(seconds % 7),
+            'lvl': 0,
+            'dev': '',
+            'det': '',
+            'con': 'OK',
+            'sts': '',
+            'raw': 0,
+        }
+
+    def _handler(self):
+        device = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                with device._lock:
+                    device.requests.append((url.path, query))
+                if device.latency:
+                    time.sleep(device.latency)
+                path = url.path.strip('/')
+                if path == 'a':
+                    data = device.live()
+                else:
+                    param = next(p for p in device.PAGE_PARAMS if p in query)
+                    page = int(query[param][0])
+                    if device.fails(page):
+                        self.send_error(503)
+                        return
+                    data = device.page(path, param, page)
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(self.address, self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--gap-ratio', type=float, default=0.0)
+    parser.add_argument('--values-per-page', type=int, default=30)
+    args = parser.parse_args()
+
+    simulator = YoulessSimulator(
+        latency=args.latency,
+        values_per_page=args.values_per_page,
+        now=lambda: datetime.now().replace(second=0, microsecond=0),
+        gap_ratio=args.gap_ratio,
+        port=args.port,
+    )
+    with simulator as device:
+        print(f'Serving a simulated Youless device on {device.url}')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,48 @@ import os
 import json
 
 repository_path = os.path.dirname(os.path.realpath(__file__))
-config_path = os.path.join(repository_path, 'config.json')
+config_path = os.environ.get(
+    'YOULESS_CONFIG', os.path.join(repository_path, 'config.json')
+)
 with open(config_path, 'r') as j:
     CONFIG = json.loads(j.read())
 
 DB_PATH = CONFIG['db_path']
 DEBUG_MODE = CONFIG['debug_mode']
 GAS_ENABLED = CONFIG.get('gas_enabled')
+FETCH_WORKERS = CONFIG.get('fetch_workers', 4)
+FETCH_OVERLAP = CONFIG.get('fetch_overlap', 600)
+DAEMON_INTERVALS = CONFIG.get('daemon_intervals', {})
+HOST = CONFIG.get('host', 'http://192.168.1.14/')
+QUERY_CACHE_MAX_MB = CONFIG.get('query_cache_max_mb', 64)
+CACHE_PATH = CONFIG.get('cache_path')
+STORAGE_FORMAT = CONFIG.get('storage_format', 'text')
+RETENTION_DAYS = CONFIG.get('retention_days', {})
+# The dashboard reads its last 365 days and 12 months from the day tables
+# and up to a day from the others, without the archive
+MIN_RETENTION_DAYS = {'youless_day': 366, 'youless_day_gas': 366}
+for table_name, days in RETENTION_DAYS.items():
+    if days < MIN_RETENTION_DAYS.get(table_name, 1):
+        raise ValueError(
+            'retention_days of {} is {}, the dashboard needs at least {}'.format(
+                table_name, days, MIN_RETENTION_DAYS.get(table_name, 1)
+            )
+        )
+ARCHIVE_PATH = CONFIG.get(
+    'archive_path', os.path.join(os.path.dirname(DB_PATH), 'archive')
+)
+METRICS_PATH = CONFIG.get('metrics_path')
+CHART_WIDTH_PX = CONFIG.get('chart_width_px', 1280)
+DEVICES = CONFIG.get('devices', [])
+FETCH_TIMEOUT = CONFIG.get('fetch_timeout', 10)
+FETCH_RETRIES = CONFIG.get('fetch_retries', 2)
+FETCH_BACKOFF = CONFIG.get('fetch_backoff', 0.5)
+RUN_TIMEOUT = CONFIG.get('run_timeout', 50)
+BREAKER_FAILURES = CONFIG.get('breaker_failures', 5)
+BREAKER_SECONDS = CONFIG.get('breaker_seconds', 10 * 60)
+LOCK_PATH = CONFIG.get('lock_path', DB_PATH + '.lock')
+DEVICE_WORKERS = CONFIG.get('device_workers', 8)
+SAMPLER_ENABLED = CONFIG.get('sampler_enabled', False)
+SAMPLER_INTERVAL = CONFIG.get('sampler_interval', 5)
+SAMPLER_FLUSH_SECONDS = CONFIG.get('sampler_flush_seconds', 60)
+SAMPLER_BUFFER_SECONDS = CONFIG.get('sampler_buffer_seconds', 60 * 60)
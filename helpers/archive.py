@@ -0,0 +1,287 @@
+import json
+import os
+import numpy as np
+import sqlite3 as sql
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from helpers import storage
+
+MANIFEST_FILE = 'manifest.json'
+# Meta key of the end of the archived range of a table. The rows before it
+# are in the archive and were counted in the rollup when they were stored.
+ARCHIVED_UNTIL = 'archived_until'
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+class Archive:
+    """
+    Data removed from the live tables, stored as one compressed NumPy file
+    per table and month. Times are INTEGER seconds of the local time (like the
+    compact storage format). `manifest.json` lists every file with its range.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.path, MANIFEST_FILE)
+
+    def manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_atomic(self, path: str, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def months(self, table_name: str) -> dict:
+        return self.manifest().get(table_name, {})
+
+    def read_month(self, table_name: str, month: str) -> tuple:
+        entry = self.months(table_name)[month]
+        with np.load(os.path.join(self.path, entry['file'])) as data:
+            return data['time'], data['value'], str(data['unit'])
+
+    def write_month(
+        self,
+        table_name: str,
+        month: str,
+        times: np.ndarray,
+        values: np.ndarray,
+        unit: str,
+    ):
+        # Rows already archived for the same timestamps are replaced
+        if month in self.months(table_name):
+            old_times, old_values, _ = self.read_month(table_name, month)
+            times = np.concatenate([times, old_times])
+            values = np.concatenate([values, old_values])
+        times, first = np.unique(times, return_index=True)
+        values = values[first]
+
+        file_name = os.path.join(table_name, f'{month}.npz')
+        self._write_atomic(
+            os.path.join(self.path, file_name),
+            lambda f: np.savez_compressed(f, time=times, value=values, unit=unit),
+        )
+        manifest = self.manifest()
+        manifest.setdefault(table_name, {})[month] = {
+            'file': file_name,
+            'start': storage.format_times(times[:1].astype('M8[s]'))[0],
+            'end': storage.format_times(times[-1:].astype('M8[s]'))[0],
+            'rows': len(times),
+            'unit': unit,
+        }
+        self._write_atomic(
+            self.manifest_path,
+            lambda f: f.write(json.dumps(manifest, indent=2, sort_keys=True).encode()),
+        )
+
+    def read_range(self, table_name: str, start: datetime, end: datetime) -> tuple:
+        """
+        Archived (times, values, unit) of the table within [start, end), times
+        as datetime64 values.
+        """
+        times, values, unit = [], [], None
+        first, last = start.strftime('%Y-%m'), end.strftime('%Y-%m')
+        for month in sorted(self.months(table_name)):
+            if not first <= month <= last:
+                continue
+            month_times, month_values, unit = self.read_month(table_name, month)
+            month_times = month_times.astype('M8[s]')
+            mask = (month_times >= np.datetime64(start, 's')) & (
+                month_times < np.datetime64(end, 's')
+            )
+            times.append(month_times[mask])
+            values.append(month_values[mask])
+        if not times:
+            return np.array([], dtype='M8[s]'), np.array([]), unit
+        return np.concatenate(times), np.concatenate(values), unit
+
+    def add_to_rollup(self, con: sql.Connection, table_name: str, granularity: str):
+        """
+        Archived values still count for the historical averages. Rows which
+        are in the table as well (e.g. after an interrupted archive run) are
+        counted with the table only.
+        """
+        fmt = storage.storage_format(con)
+        for month in self.months(table_name):
+            times, values, _ = self.read_month(table_name, month)
+            if not len(times):
+                continue
+            times = times.astype('M8[s]')
+            keys = storage.encode_times(fmt, times)
+            stored = set(
+                time
+                for time, in con.execute(
+                    f'SELECT time FROM {table_name} WHERE time BETWEEN ? AND ?',
+                    (keys[0], keys[-1]),
+                )
+            )
+            keep = np.array([key not in stored for key in keys], dtype=bool)
+            storage.add_to_rollup(
+                con,
+                table_name,
+                granularity,
+                times[keep],
+                values[keep],
+                np.ones(keep.sum()),
+            )
+
+
+def _table_unit(con: sql.Connection, fmt: str, table_name: str, start) -> str:
+    if fmt == storage.COMPACT_FORMAT:
+        return storage.get_meta(con, table_name, 'unit')
+    row = con.execute(
+        f'SELECT unit FROM {table_name} WHERE time >= ? ORDER BY time LIMIT 1',
+        (start,),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def unarchived(
+    con: sql.Connection, table_name: str, times: np.ndarray, values: np.ndarray
+) -> tuple:
+    """
+    The (times, values) of a batch after the archived range of the table.
+    The older ones are final, storing them again (e.g. on a full rescan)
+    would count them in the rollup a second time.
+    """
+    until = storage.get_meta(con, table_name, ARCHIVED_UNTIL)
+    if until is None:
+        return times, values
+    keep = times >= np.datetime64(datetime.strptime(until, storage.TIME_FORMAT), 's')
+    return times[keep], values[keep]
+
+
+def _archived_end(archive: Archive, table_name: str):
+    # Midnight after the newest archived row, whole days are archived
+    ends = [entry['end'] for entry in archive.months(table_name).values()]
+    if not ends:
+        return None
+    newest = datetime.strptime(max(ends), storage.TIME_FORMAT)
+    return newest.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+
+
+def retention_cutoff(retention_days: int, now: datetime = None) -> datetime:
+    now = now or datetime.now()
+    return now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(
+        days=retention_days
+    )
+
+
+def archive_due(
+    con: sql.Connection, table_name: str, retention_days: int, now: datetime = None
+) -> bool:
+    # Whether the table still has rows older than its retention
+    if not storage.table_exists(con, table_name):
+        return False
+    oldest = storage.min_time(con, table_name)
+    return oldest is not None and datetime.strptime(
+        oldest, storage.TIME_FORMAT
+    ) < retention_cutoff(retention_days, now)
+
+
+@contextmanager
+def _committed(con: sql.Connection):
+    with con:
+        yield con
+
+
+def archive_table(
+    con: sql.Connection,
+    archive: Archive,
+    table_name: str,
+    retention_days: int,
+    now: datetime = None,
+    max_months: int = None,
+    transaction=None,
+) -> int:
+    """
+    Move the rows older than `retention_days` (whole days) from the table to
+    the archive, at most `max_months` months per call. `con` is only read
+    from. Rows are deleted per day, each day in a short transaction of its
+    own from `transaction()` (committing `con` by default), so the logger is
+    never blocked for long. Returns the number of archived rows.
+    """
+    if not storage.table_exists(con, table_name):
+        return 0
+    transaction = transaction or (lambda: _committed(con))
+    fmt = storage.storage_format(con)
+    if storage.get_meta(con, table_name, ARCHIVED_UNTIL) is None:
+        end = _archived_end(archive, table_name)
+        if end is not None:
+            # Archived before the end of the range was recorded
+            with transaction() as write_con:
+                storage.raise_meta(
+                    write_con,
+                    table_name,
+                    ARCHIVED_UNTIL,
+                    end.strftime(storage.TIME_FORMAT),
+                )
+    cutoff = retention_cutoff(retention_days, now)
+    oldest = storage.min_time(con, table_name)
+    if oldest is None:
+        return 0
+
+    archived, months = 0, 0
+    start = month_start(datetime.strptime(oldest, storage.TIME_FORMAT))
+    while start < cutoff and (max_months is None or months < max_months):
+        end = min(next_month(start), cutoff)
+        bounds = (storage.encode_time(fmt, start), storage.encode_time(fmt, end))
+        rows = con.execute(
+            f'''
+            SELECT {storage.raw_column_sql(fmt)}
+            FROM {table_name}
+            WHERE time >= ? AND time < ?
+            ORDER BY time
+            ''',
+            bounds,
+        ).fetchall()
+        if rows:
+            times, values = (np.array(column) for column in zip(*rows))
+            unit = _table_unit(con, fmt, table_name, bounds[0])
+            archive.write_month(
+                table_name,
+                start.strftime('%Y-%m'),
+                times.astype(np.int64),
+                values.astype(float),
+                unit,
+            )
+            day = start
+            while day < end:
+                next_day = min(day + timedelta(days=1), end)
+                with transaction() as write_con:
+                    write_con.execute(
+                        f'DELETE FROM {table_name} WHERE time >= ? AND time < ?',
+                        (
+                            storage.encode_time(fmt, day),
+                            storage.encode_time(fmt, next_day),
+                        ),
+                    )
+                    storage.raise_meta(
+                        write_con,
+                        table_name,
+                        ARCHIVED_UNTIL,
+                        next_day.strftime(storage.TIME_FORMAT),
+                    )
+                day = next_day
+            with transaction() as write_con:
+                storage.bump_version(write_con, table_name)
+            archived += len(rows)
+            months += 1
+        start = end
+    return archived
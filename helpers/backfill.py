@@ -0,0 +1,68 @@
+import csv
+import itertools
+import numpy as np
+import sqlite3 as sql
+from helpers import storage
+from helpers.export import COLUMNS
+
+# Rows per chunk, a chunk takes a few MB
+CHUNK_SIZE = 100000
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def is_sqlite(path: str) -> bool:
+    if path == '-':
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def csv_chunks(f, chunk_size: int = CHUNK_SIZE):
+    """
+    (times, values, units) of a CSV file with the columns of an export, in
+    chunks of at most `chunk_size` rows. Raises a ValueError for other files.
+    """
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    if tuple(header) != COLUMNS:
+        raise ValueError(
+            'Expected the columns {}, found {}'.format(
+                ', '.join(COLUMNS), ', '.join(header)
+            )
+        )
+    while True:
+        rows = list(itertools.islice(reader, chunk_size))
+        if not rows:
+            break
+        times, values, units = zip(*rows)
+        yield np.array(times, dtype='M8[s]'), np.array(values, dtype=float), units
+
+
+def sqlite_chunks(con: sql.Connection, table_name: str, chunk_size: int = CHUNK_SIZE):
+    # (times, values, units) of a table of another youless database
+    fmt = storage.storage_format(con)
+    columns = storage.raw_column_sql(fmt)
+    if fmt == storage.TEXT_FORMAT:
+        columns += ', unit'
+    else:
+        unit = storage.get_meta(con, table_name, 'unit')
+    cur = con.execute(f'''
+        SELECT {columns}
+        FROM {table_name}
+        WHERE energy_consumption IS NOT NULL
+        ''')
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        if fmt == storage.TEXT_FORMAT:
+            times, values, units = zip(*rows)
+        else:
+            (times, values), units = zip(*rows), unit
+        yield (
+            np.array(times, dtype=np.int64).astype('M8[s]'),
+            np.array(values, dtype=float),
+            units,
+        )
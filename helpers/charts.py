@@ -1,15 +1,42 @@
+from datetime import datetime, timedelta
 from dash import html, dcc
+import numpy as np
 import pandas as pd
 import dash_bootstrap_components as dbc
 from helpers.data_processing import YoulessData
+from helpers.summary import FIGURES
+from helpers.metrics import REGISTRY
+from config import CHART_WIDTH_PX, SAMPLER_INTERVAL
 import plotly.graph_objects as go
 
+FIGURE_SECONDS = REGISTRY.histogram(
+    'youless_figure_seconds', 'Time to build a dashboard figure', ('figure',)
+)
+RENDER_SECONDS = REGISTRY.histogram(
+    'youless_render_seconds', 'Time to render a dashboard page', ('layout',)
+)
+
+# The Current chart shows the last 12 hours and polls for new minutes
+CURRENT_MAX_POINTS = 60 * 12
+CURRENT_REFRESH_SECONDS = 60
+# More points per trace than pixels (times two, for a minimum and a maximum)
+# cannot be seen and only make the figures slow to send and draw
+POINTS_PER_PIXEL = 2
+
 
 class MonitoringLayout:
+    """
+    Page with the summary cards, the history tabs and the last 12 months.
+    `render` only returns the empty components. Each part is filled by its
+    own callback in app.py, running only the query of that part, and a tab
+    is built once it is selected.
+    """
+
     data_minute = None
     data_hour = None
     data_day = None
     data_month = None
+    data_summary = None
 
     def __init__(
         self,
@@ -17,111 +44,134 @@ class MonitoringLayout:
         data_hour: YoulessData,
         data_day: YoulessData,
         data_month: YoulessData,
+        title: str,
+        summary_stats_suffix: str,
+        last_24h_unit: str,
+        last_30d_unit: str,
+        last_year_unit: str,
+        live: bool = False,
+        data_summary: YoulessData = None,
     ):
-        # In case we do not collect the minute data (e.g. for gas) we need to set it to None
-        self.data_minute = data_minute().data if data_minute else pd.DataFrame()
-        self.data_hour = data_hour().data
-        self.data_day = data_day().data
-        self.data_month = data_month().data
-
-    def render(
-        self, title, summary_stats_suffix, last_24h_unit, last_30d_unit, last_year_unit
-    ):
-        summary = [
-            html.H2(children='Summary'),
-            dashboard_summary_numbers(
-                hour_data=self.data_hour,
-                day_data=self.data_day,
-                month_data=self.data_month,
-                unit_suffix=summary_stats_suffix,
-            ),
-        ]
-        history_tabs = [
-            dbc.Tab(
-                label='24 Hours',
-                children=[
-                    dcc.Graph(
-                        id='last-24-hours',
-                        figure=plot_bar_with_avg_line(
-                            df=self.data_hour,
-                            title='Consumption per hour',
-                            unit=last_24h_unit,
-                        ),
-                        config={'displayModeBar': False},
-                    ),
-                ],
-            ),
-            dbc.Tab(
-                label='30 Days',
-                children=[
-                    dcc.Graph(
-                        id='last-30-days',
-                        figure=plot_bar_with_avg_line(
-                            df=self.data_day.head(30),
-                            title='Consumption last 30 days',
-                            unit=last_30d_unit,
-                        ),
-                        config={'displayModeBar': False},
-                    ),
-                ],
-            ),
-        ]
-        if not self.data_minute.empty:
-            history_tabs.insert(
-                0,
-                dbc.Tab(
-                    label='Current',
-                    children=[
-                        dcc.Graph(
-                            id='current',
-                            figure=plot_current(self.data_minute),
-                            config={'displayModeBar': False},
-                        ),
-                    ],
-                ),
-            )
+        # Query classes, called when a part is rendered. In case we do not
+        # collect the minute data (e.g. for gas) it is None.
+        self.data_minute = data_minute
+        self.data_hour = data_hour
+        self.data_day = data_day
+        self.data_month = data_month
+        # Figures stored by the logger, the summary is computed from the
+        # other queries while they are missing
+        self.data_summary = data_summary
+        self.title = title
+        self.summary_stats_suffix = summary_stats_suffix
+        self.last_24h_unit = last_24h_unit
+        self.last_30d_unit = last_30d_unit
+        self.last_year_unit = last_year_unit
+        # The Live tab is filled by a callback polling the sampler
+        self.live = live
 
-        history = [
-            html.H2(children='History'),
-            dbc.Row([dbc.Col([dbc.Card(dbc.CardBody(dbc.Tabs(history_tabs)))])]),
-        ]
-
-        history_year = [
-            dbc.Row(
-                [
-                    dbc.Col(
-                        [
-                            dbc.Card(
-                                dbc.CardBody(
-                                    dcc.Graph(
-                                        id='last-365-days',
-                                        figure=plot_last_year(
-                                            self.data_month,
-                                            title='Consumption last 12 months',
-                                            unit=last_year_unit,
-                                        ),
-                                        config={'displayModeBar': False},
-                                    )
-                                )
-                            )
-                        ]
-                    )
-                ]
-            )
-        ]
+    @property
+    def tabs(self) -> list:
+        # (tab id, label) of the history tabs, the first one is selected
+        tabs = []
+        if self.live:
+            tabs.append(('live', 'Live'))
+        if self.data_minute:
+            tabs.append(('current', 'Current'))
+        return tabs + [('last-24-hours', '24 Hours'), ('last-30-days', '30 Days')]
 
+    @RENDER_SECONDS.timed(layout='MonitoringLayout')
+    def render(self, page: dict):
+        """
+        Components of the page. `page` is kept in the `monitoring-page` store,
+        the callbacks create the layout from it again.
+        """
+        tabs = dbc.Tabs(
+            [dbc.Tab(label=label, tab_id=tab_id) for tab_id, label in self.tabs],
+            id='history-tabs',
+            active_tab=self.tabs[0][0],
+        )
+        history_year = dcc.Graph(id='last-365-days', config={'displayModeBar': False})
         return dbc.Container(
             [
-                html.H1(children=title),
-                *summary,
+                dcc.Store(id='monitoring-page', data=page),
+                html.H1(children=self.title),
+                html.H2(children='Summary'),
+                html.Div(id='summary'),
                 html.Br(),
-                *history,
+                html.H2(children='History'),
+                dbc.Row(
+                    [
+                        dbc.Col(
+                            [dbc.Card(dbc.CardBody([tabs, html.Div(id='history-tab')]))]
+                        )
+                    ]
+                ),
                 html.Br(),
-                *history_year,
+                dbc.Row([dbc.Col([dbc.Card(dbc.CardBody(history_year))])]),
             ],
             fluid=True,
         )
 
+    @RENDER_SECONDS.timed(layout='summary')
+    def render_summary(self):
+        stored = self.data_summary() if self.data_summary else None
+        if stored is not None and stored.complete:
+            figures = stored.figures
+        else:
+            figures = summary_figures(
+                hour_data=self.data_hour().data,
+                day_data=self.data_day().data,
+                month_data=self.data_month().data,
+            )
+        return dashboard_summary_numbers(figures, unit_suffix=self.summary_stats_suffix)
+
+    def plot_year(self):
+        return plot_last_year(
+            self.data_month().data,
+            title='Consumption last 12 months',
+            unit=self.last_year_unit,
+        )
+
+    @RENDER_SECONDS.timed(layout='history tab')
+    def render_tab(self, tab_id: str) -> list:
+        if tab_id == 'live':
+            # Filled and refreshed by the live callback
+            return [
+                dcc.Graph(id='live', config={'displayModeBar': False}),
+                dcc.Interval(id='live-interval', interval=SAMPLER_INTERVAL * 1000),
+            ]
+        if tab_id == 'current':
+            data_minute = self.data_minute().data
+            if data_minute is None or data_minute.empty:
+                return [html.P('No minutes stored yet')]
+            return [
+                dcc.Graph(
+                    id='current',
+                    figure=plot_current(data_minute),
+                    config={'displayModeBar': False},
+                ),
+                # Newest minute shown, the client only asks for newer ones
+                dcc.Store(id='current-last-time', data=data_minute['time'].max()),
+                dcc.Interval(
+                    id='current-interval', interval=CURRENT_REFRESH_SECONDS * 1000
+                ),
+            ]
+        if tab_id == 'last-24-hours':
+            figure = plot_bar_with_avg_line(
+                df=self.data_hour().data,
+                title='Consumption per hour',
+                unit=self.last_24h_unit,
+            )
+        elif tab_id == 'last-30-days':
+            figure = plot_bar_with_avg_line(
+                df=self.data_day().data.head(30),
+                title='Consumption last 30 days',
+                unit=self.last_30d_unit,
+            )
+        else:
+            raise ValueError(f'Unknown tab {tab_id!r}')
+        return [dcc.Graph(id=tab_id, figure=figure, config={'displayModeBar': False})]
+
 
 TEMPLATE = 'simple_white'
 GLOBAL_LAYOUT = {
@@ -136,7 +186,187 @@ GLOBAL_LAYOUT = {
 }
 
 
+# Label and hours of the quick ranges of the explorer
+EXPLORER_PRESETS = [
+    ('1 hour', 1),
+    ('24 hours', 24),
+    ('7 days', 7 * 24),
+    ('30 days', 30 * 24),
+    ('1 year', 365 * 24),
+    ('5 years', 5 * 365 * 24),
+]
+EXPLORER_CUSTOM = 'custom'
+
+
+class ExplorerLayout:
+    """
+    Page with a chart of any date range. The data comes from the table with
+    a suitable resolution, see `EnergyRangeData`.
+    """
+
+    def __init__(self, sources: list):
+        self.sources = sources
+
+    def render(self, title):
+        today = datetime.now().date()
+        controls = dbc.Row(
+            [
+                dbc.Col(
+                    dcc.RadioItems(
+                        id='explorer-preset',
+                        options=[
+                            {'label': label, 'value': hours}
+                            for label, hours in EXPLORER_PRESETS
+                        ]
+                        + [{'label': 'Custom', 'value': EXPLORER_CUSTOM}],
+                        value=7 * 24,
+                        labelStyle={'display': 'inline-block'},
+                        inputStyle={'margin-left': '10px', 'margin-right': '4px'},
+                    ),
+                    md=6,
+                ),
+                dbc.Col(
+                    dcc.DatePickerRange(
+                        id='explorer-range',
+                        start_date=today - timedelta(days=7),
+                        end_date=today,
+                        display_format='YYYY-MM-DD',
+                    ),
+                    md=4,
+                ),
+                dbc.Col(
+                    dcc.Dropdown(
+                        id='explorer-source',
+                        options=[{'label': s, 'value': s} for s in self.sources],
+                        value=self.sources[0],
+                        clearable=False,
+                    ),
+                    md=2,
+                ),
+            ]
+        )
+        return dbc.Container(
+            [
+                html.H1(children=title),
+                controls,
+                html.Br(),
+                dbc.Card(
+                    dbc.CardBody(
+                        dcc.Graph(id='explorer-graph', config={'displayModeBar': False})
+                    )
+                ),
+            ],
+            fluid=True,
+        )
+
+
+def explorer_range(preset, start_date: str, end_date: str, now: datetime) -> tuple:
+    """
+    (start, end) of the explorer: the last `preset` hours, or the picked
+    dates with the end date included.
+    """
+    if preset != EXPLORER_CUSTOM:
+        return now - timedelta(hours=preset), now
+    start = datetime.fromisoformat(start_date[:10])
+    end = datetime.fromisoformat(end_date[:10]) + timedelta(days=1)
+    return start, max(end, start + timedelta(days=1))
+
+
+def max_points_for_width(width_px: int = None) -> int:
+    return int((width_px or CHART_WIDTH_PX) * POINTS_PER_PIXEL)
+
+
+def current_max_points() -> int:
+    # Points of the Current chart, for the figure and its live updates alike
+    return min(CURRENT_MAX_POINTS, max_points_for_width())
+
+
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the minimum and the maximum of `max_points // 2` equally sized
+    buckets, in their original order. Every peak survives.
+    """
+    n = len(y)
+    buckets = max_points // 2
+    if n <= max_points or buckets < 1:
+        return np.arange(n)
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    sizes = np.diff(edges)
+    bucket = np.repeat(np.arange(buckets), sizes)
+    indices = []
+    for reduce in (np.minimum, np.maximum):
+        # First position per bucket holding the bucket's extreme value
+        extreme = np.repeat(reduce.reduceat(y, edges[:-1]), sizes)
+        positions = np.flatnonzero(y == extreme)
+        _, first = np.unique(bucket[positions], return_index=True)
+        indices.append(positions[first])
+    return np.unique(np.concatenate(indices))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: keeps the first and last point and per
+    bucket the point spanning the largest triangle with the point kept
+    before and the average of the next bucket.
+    """
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    starts, ends = edges[:-1], edges[1:]
+    # Averages of the bucket after each bucket, the last one is the end point
+    cumulative_x = np.concatenate([[0], np.cumsum(x)])
+    cumulative_y = np.concatenate([[0], np.cumsum(y)])
+    next_starts = np.append(starts[1:], n - 1)
+    next_ends = np.append(ends[1:], n)
+    counts = next_ends - next_starts
+    avg_x = (cumulative_x[next_ends] - cumulative_x[next_starts]) / counts
+    avg_y = (cumulative_y[next_ends] - cumulative_y[next_starts]) / counts
+
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    previous = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        bucket_x, bucket_y = x[start:end], y[start:end]
+        area = np.abs(
+            (x[previous] - avg_x[i]) * (bucket_y - y[previous])
+            - (x[previous] - bucket_x) * (avg_y[i] - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        indices[i + 1] = previous
+    return indices
+
+
+def downsample(
+    df: pd.DataFrame,
+    max_points: int = None,
+    column: str = 'energy_consumption',
+    method: str = 'minmax',
+) -> pd.DataFrame:
+    """
+    Rows of a frame sorted by time, reduced to at most `max_points` (by
+    default enough for the chart width). `minmax` keeps every peak, `lttb`
+    keeps the visual shape with fewer points.
+    """
+    max_points = max_points or max_points_for_width()
+    if len(df) <= max_points:
+        return df
+    y = df[column].to_numpy(dtype=float)
+    if method == 'minmax':
+        indices = minmax_indices(y, max_points)
+    elif method == 'lttb':
+        x = pd.to_datetime(df['time']).to_numpy().astype('M8[s]').astype(np.int64)
+        indices = lttb_indices(x, y, max_points)
+    else:
+        raise ValueError(f'Unknown downsampling method {method}')
+    return df.iloc[indices]
+
+
+@FIGURE_SECONDS.timed(figure='plot_bar_with_avg_line')
 def plot_bar_with_avg_line(df: pd.DataFrame, title: str, unit: str):
+    df = downsample(df)
     plots = [
         go.Bar(
             x=df['time'],
@@ -157,9 +387,11 @@ def plot_bar_with_avg_line(df: pd.DataFrame, title: str, unit: str):
     return fig
 
 
+@FIGURE_SECONDS.timed(figure='plot_current')
 def plot_current(df_minute):
-    df = df_minute.copy()
-    df = df.sort_values('time', ascending=False).head(60 * 12)
+    # Ascending, so live updates can be appended to the end
+    df = df_minute.sort_values('time').tail(CURRENT_MAX_POINTS)
+    df = downsample(df, current_max_points())
 
     plots = [
         go.Bar(
@@ -185,6 +417,56 @@ def plot_current(df_minute):
     return fig
 
 
+def extend_current(df_minute: pd.DataFrame) -> tuple:
+    """
+    `extendData` of the Current chart for the new minutes. Older points are
+    dropped to keep as many points as the figure was drawn with.
+    """
+    df = df_minute.sort_values('time')
+    values = df['energy_consumption'].tolist()
+    return (
+        {'x': [df['time'].tolist()], 'y': [values], 'marker.color': [values]},
+        [0],
+        current_max_points(),
+    )
+
+
+@FIGURE_SECONDS.timed(figure='plot_live')
+def plot_live(frames: dict):
+    # One line per device, the samples of several devices are not aligned
+    plots = [
+        go.Scatter(x=df['time'], y=df['energy_consumption'], name=label, mode='lines')
+        for label, df in frames.items()
+        if df is not None
+    ]
+    fig = go.Figure(
+        data=plots, layout=go.Layout(title=go.layout.Title(text="Live power"))
+    )
+    fig.update_yaxes(title_text='Watt')
+    fig.update_layout(template=TEMPLATE, **GLOBAL_LAYOUT)
+    return fig
+
+
+@FIGURE_SECONDS.timed(figure='plot_range')
+def plot_range(df: pd.DataFrame, resolution: str, title: str):
+    df = downsample(df)
+    unit = df['unit'].iloc[0] if len(df) else ''
+    if resolution in ('day', 'month'):
+        trace = go.Bar(x=df['time'], y=df['energy_consumption'], name='Value')
+    else:
+        trace = go.Scatter(
+            x=df['time'], y=df['energy_consumption'], name='Value', mode='lines'
+        )
+    fig = go.Figure(
+        data=[trace],
+        layout=go.Layout(title=go.layout.Title(text=f'{title} per {resolution}')),
+    )
+    fig.update_yaxes(title_text=unit)
+    fig.update_layout(template=TEMPLATE, **GLOBAL_LAYOUT)
+    return fig
+
+
+@FIGURE_SECONDS.timed(figure='plot_last_year')
 def plot_last_year(df_month, title, unit):
     df = df_month.copy()
     df = df.sort_values('time').tail(12)
@@ -217,7 +499,7 @@ def plot_indicator_trace(title, value, reference=0, mode='number+delta', **kwarg
             'decreasing': {'color': 'green'},
             'increasing': {'color': 'red'},
         },
-        **kwargs
+        **kwargs,
     )
 
 
@@ -229,36 +511,37 @@ def _indicator_card(**kwargs):
     return dbc.Card(dbc.CardBody(dcc.Graph(figure=fig)))
 
 
-def dashboard_summary_numbers(hour_data, day_data, month_data, unit_suffix):
+def summary_figures(hour_data, day_data, month_data) -> dict:
+    # The figures of the summary cards from the dashboard queries, for pages
+    # the logger did not store a summary for yet
     tmp = (
         hour_data.sort_values('time', ascending=False)
         .head(24)[['energy_consumption', 'avg_energy_consumption']]
         .sum()
     )
-    # In kwh
-    last_24h = round(tmp['energy_consumption'] / 1000, 2)
-    last_24h_avg = round(tmp['avg_energy_consumption'] / 1000, 2)
-
-    tmp = (
-        day_data.sort_values('time', ascending=False)
-        .head(30)[['energy_consumption']]
-        .sum()
-    )
-    last_30d = round(tmp['energy_consumption'], 2)
+    figures = {
+        # In kwh
+        'last_24h': tmp['energy_consumption'] / 1000,
+        'last_24h_avg': tmp['avg_energy_consumption'] / 1000,
+    }
+    days = day_data.sort_values('time', ascending=False)['energy_consumption']
+    figures['last_30d'] = days.head(30).sum()
     # We use the average per month of the last year
-    tmp = (
+    figures['month_avg'] = (
         month_data.sort_values(['year', 'month'], ascending=False)
-        .head(12)[['energy_consumption']]
+        .head(12)['energy_consumption']
         .mean()
     )
-    month_avg = round(tmp['energy_consumption'], 2)
+    figures['last_365d'] = days.head(365).sum()
+    return figures
 
-    tmp = (
-        day_data.sort_values('time', ascending=False)
-        .head(365)[['energy_consumption']]
-        .sum()
+
+@FIGURE_SECONDS.timed(figure='dashboard_summary_numbers')
+def dashboard_summary_numbers(figures: dict, unit_suffix):
+    last_24h, last_24h_avg, last_30d, month_avg, last_365d = (
+        round(figures[figure], 2) if figures[figure] is not None else float('nan')
+        for figure in FIGURES
     )
-    last_365d = round(tmp['energy_consumption'], 2)
 
     card_1 = _indicator_card(
         title='Last 24h',
@@ -1,71 +1,455 @@
+import fcntl
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import numpy as np
 import pandas as pd
 import sqlite3 as sql
-from config import DB_PATH
+from collections import OrderedDict
+from contextlib import closing
+from datetime import datetime, timedelta
+from functools import partial
+from config import (
+    ARCHIVE_PATH,
+    CACHE_PATH,
+    DB_PATH,
+    QUERY_CACHE_MAX_MB,
+    SAMPLER_BUFFER_SECONDS,
+)
+from helpers import storage
+from helpers.archive import Archive
+from helpers.devices import ALL_DEVICES, DEVICE_LIST, Device
+from helpers.metrics import REGISTRY
+from helpers.ringbuffer import RingBuffer
+from helpers.summary import FIGURES
+
+# Marks a cache miss, None is a valid cached result
+_MISSING = object()
+
+
+class QueryCache:
+    """
+    LRU cache for query results. Every entry remembers the ingest versions of
+    the tables it was computed from and is only used while they are unchanged.
+    Cached DataFrames are shared, so they have to be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sizeof(data) -> int:
+        if data is None:
+            return 0
+        if isinstance(data, (str, bytes)):
+            return len(data)
+        return int(data.memory_usage(index=True, deep=True).sum())
+
+    def get(self, key, version, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, data):
+        size = self._sizeof(data)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[2]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (version, data, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get_or_compute(self, key, version, compute) -> tuple:
+        # (data, whether it came from the cache)
+        data = self.get(key, version, _MISSING)
+        if data is not _MISSING:
+            return data, True
+        data = compute()
+        self.put(key, version, data)
+        return data, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+
+class SharedCache:
+    """
+    Cache shared by the worker processes of the dashboard, one pickle file per
+    entry in a directory (e.g. on /dev/shm). Like in QueryCache the entries
+    carry the ingest versions of their tables, so data stored by the logger
+    invalidates them for all workers. The entries used by a process are kept
+    in its own QueryCache as well. While one process computes an entry, the
+    others wait for it instead of running the same query.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = QueryCache(max_bytes)
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key) -> str:
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def _read(self, key, version):
+        path = self._file(key) + '.pkl'
+        try:
+            with open(path, 'rb') as f:
+                stored_key, stored_version, data = pickle.load(f)
+            # Recently used entries are evicted last
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MISSING
+        if stored_key != key or stored_version != version:
+            return _MISSING
+        return data
+
+    def get(self, key, version, default=None):
+        data = self._local.get(key, version, _MISSING)
+        if data is _MISSING:
+            data = self._read(key, version)
+            if data is not _MISSING:
+                self._local.put(key, version, data)
+        if data is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return data
+
+    def put(self, key, version, data):
+        self._local.put(key, version, data)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, version, data), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._file(key) + '.pkl')
+        self._evict()
+
+    def get_or_compute(self, key, version, compute) -> tuple:
+        data = self.get(key, version, _MISSING)
+        if data is not _MISSING:
+            return data, True
+        with open(self._file(key) + '.lock', 'wb') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another worker may have stored it while we waited
+            data = self._read(key, version)
+            if data is not _MISSING:
+                self._local.put(key, version, data)
+                return data, True
+            data = compute()
+            self.put(key, version, data)
+        return data, False
+
+    def _files(self) -> list:
+        # (modification time, size, path) of the stored entries
+        return [
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.path)
+            if entry.name.endswith('.pkl')
+        ]
+
+    def _evict(self):
+        files = sorted(self._files())
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_bytes:
+                break
+            for suffix in ('.pkl', '.lock'):
+                try:
+                    os.remove(path[: -len('.pkl')] + suffix)
+                except FileNotFoundError:
+                    pass
+            size -= file_size
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            os.remove(entry.path)
+        self._local.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        files = self._files()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(files),
+            'bytes': sum(file_size for _, file_size, _ in files),
+        }
+
+
+def create_cache(name: str, max_mb: float = QUERY_CACHE_MAX_MB):
+    # Shared by all processes when a cache directory is configured
+    max_bytes = int(max_mb * 1024 * 1024)
+    if CACHE_PATH:
+        return SharedCache(os.path.join(CACHE_PATH, name), max_bytes)
+    return QueryCache(max_bytes)
+
+
+QUERY_CACHE = create_cache('queries')
+
+QUERY_SECONDS = REGISTRY.histogram(
+    'youless_query_seconds', 'Time to run a dashboard query', ('query',)
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    'youless_query_cache_requests_total',
+    'Query cache lookups by result (hit or miss)',
+    ('query', 'result'),
+)
+CACHE_ENTRIES = REGISTRY.gauge('youless_query_cache_entries', 'Cached query results')
+CACHE_BYTES = REGISTRY.gauge('youless_query_cache_bytes', 'Memory used by the cache')
+
+
+def _collect_cache_stats():
+    stats = QUERY_CACHE.stats()
+    CACHE_ENTRIES.set(stats['entries'])
+    CACHE_BYTES.set(stats['bytes'])
+
+
+REGISTRY.add_collector(_collect_cache_stats)
+
+
+def ingest_version():
+    # Changes whenever the logger stores data, None before it stored any
+    try:
+        con = storage.connect_readonly(DB_PATH)
+    except sql.OperationalError:
+        return None
+    with closing(con):
+        return storage.ingest_version(con)
 
 
 class YoulessData:
     data = None
-    # Table names dictionary. Can be used for query formatting
+    # Table names dictionary. Can be used for query formatting. For every
+    # table `{<key>_columns}` selects time, energy_consumption and unit in
+    # the text format, whatever storage format the database uses.
     table_names = {}
     query = None
+    cache = QUERY_CACHE
 
-    def __init__(self):
+    def __init__(self, device: Device = None):
+        if device is not None:
+            self.table_names = {
+                key: device.table(table_name)
+                for key, table_name in self.table_names.items()
+            }
         self.load_data()
 
+    @staticmethod
+    def now() -> datetime:
+        # Truncated to the minute, so the parameters stay stable for the cache
+        return datetime.now().replace(second=0, microsecond=0)
+
+    def params(self) -> dict:
+        # Bound query parameters. The table names are available as well,
+        # datetime values are encoded like the time column
+        return dict(self.table_names)
+
+    def prepare(self, con: sql.Connection) -> tuple:
+        fmt = storage.storage_format(con)
+        columns = {
+            f'{key}_columns': storage.column_sql(fmt, table_name)
+            for key, table_name in self.table_names.items()
+        }
+        query = self.query.format(
+            **self.table_names, **columns, rollup_table=storage.ROLLUP_TABLE
+        )
+        params = {
+            key: (
+                storage.encode_time(fmt, value)
+                if isinstance(value, datetime)
+                else value
+            )
+            for key, value in self.params().items()
+        }
+        return query, params
+
     def load_data(self):
-        with sql.connect(DB_PATH) as con:
-            query = self.query.format(**self.table_names)
-            try:
-                data = pd.read_sql(query, con)
-            except pd.io.sql.DatabaseError:
-                data = None
-            self.data = data
+        try:
+            con = storage.connect_readonly(DB_PATH)
+        except sql.OperationalError:
+            # Nothing stored yet
+            self.data = None
+            return
+        with closing(con):
+            query, params = self.prepare(con)
+            key = (query, tuple(sorted(params.items())))
+            version = storage.get_versions(con, sorted(set(self.table_names.values())))
+            name = type(self).__name__
+
+            def run():
+                try:
+                    with QUERY_SECONDS.time(query=name):
+                        return pd.read_sql(query, con, params=params)
+                except pd.io.sql.DatabaseError:
+                    return None
+
+            if version is None:
+                self.data = run()
+                return
+            self.data, hit = self.cache.get_or_compute(key, version, run)
+            CACHE_REQUESTS.inc(query=name, result='hit' if hit else 'miss')
 
 
 class EnergyDataMinute(YoulessData):
     table_names = {'minute_table': 'youless_minute'}
+    hours = 12
     query = '''
-    WITH minute_data AS (
+    WITH minute_rows AS (
+        SELECT {minute_table_columns}
+        FROM {minute_table}
+        WHERE time >= :since
+    ), minute_data AS (
         SELECT 
             *,
             strftime('%H', time) AS hour,
             strftime('%M', time) AS minute,
             strftime('%Y-%m-%d', time) AS date,
-			Cast((JulianDay(CURRENT_TIMESTAMP) - JulianDay(time)) * 24 As Integer) AS hour_diff
-        FROM {minute_table}
-    ), average AS (
-        SELECT 
-            AVG(energy_consumption) AS avg_energy_consumption,
-            strftime('%H', time) AS hour,
-            strftime('%M', time) AS minute
-        FROM {minute_table}
-        GROUP BY hour, minute
+            strftime('%H:%M', time) AS bucket,
+			Cast((JulianDay(:now) - JulianDay(time)) * 24 As Integer) AS hour_diff
+        FROM minute_rows
     )
 
+    -- One lookup of the rollup's primary key per minute
     SELECT 
-        * 
+        minute_data.*,
+        total / count AS avg_energy_consumption
     FROM minute_data
-    LEFT JOIN average USING(hour, minute)
-    WHERE  hour_diff <= 12
+    LEFT JOIN {rollup_table}
+        ON table_name = :minute_table AND {rollup_table}.bucket = minute_data.bucket
+    '''
+
+    def params(self) -> dict:
+        now = self.now()
+        return {
+            **super().params(),
+            'now': now.strftime(storage.TIME_FORMAT),
+            'since': now - timedelta(hours=self.hours),
+        }
+
+
+class EnergyDataMinuteSince(YoulessData):
+    """
+    Minute rows newer than `after`, for the live updates of the Current chart.
+    """
+
+    table_names = {'minute_table': 'youless_minute'}
+    query = '''
+        SELECT {minute_table_columns}
+        FROM {minute_table}
+        WHERE time > :after
+        ORDER BY time
+    '''
+
+    def __init__(self, after: datetime, device: Device = None):
+        self.after = after
+        super().__init__(device)
+
+    def params(self) -> dict:
+        return {**super().params(), 'after': self.after}
+
+
+class LiveData(YoulessData):
+    """
+    Power samples of the last `seconds`, read from the ring buffer of a
+    running sampler. Without one they come from the live table.
+    """
+
+    table_names = {'live_table': storage.LIVE_TABLE}
+    query = '''
+        SELECT {live_table_columns}
+        FROM {live_table}
+        WHERE time >= :since
+        ORDER BY time
     '''
 
+    def __init__(
+        self,
+        seconds: float = SAMPLER_BUFFER_SECONDS,
+        device: Device = None,
+        buffer_name: str = None,
+    ):
+        self.since = datetime.now().replace(microsecond=0) - timedelta(seconds=seconds)
+        self.buffer_name = buffer_name
+        super().__init__(device)
+
+    def params(self) -> dict:
+        return {**super().params(), 'since': self.since}
+
+    def load_data(self):
+        try:
+            buffer = RingBuffer.attach(
+                self.buffer_name or self.table_names['live_table']
+            )
+        except FileNotFoundError:
+            super().load_data()
+            return
+        try:
+            times, values, _ = buffer.read()
+        finally:
+            buffer.close()
+        times = times.astype('M8[s]')
+        mask = times >= np.datetime64(self.since, 's')
+        self.data = pd.DataFrame(
+            {
+                'time': storage.format_times(times[mask]),
+                'energy_consumption': values[mask],
+                'unit': 'Watt',
+            }
+        )
+
 
 class EnergyDataHour(YoulessData):
     table_names = {'hour_table': 'youless_hour'}
     query = '''
-    WITH data AS (
+    WITH hour_rows AS (
+        SELECT {hour_table_columns}
+        FROM {hour_table}
+        WHERE time >= :since
+    ), data AS (
         SELECT 
             *,
             strftime('%H', time) AS hour,
             strftime('%w', time) AS week_day,
             strftime('%Y-%m-%d', time) AS date
-        FROM {hour_table}
+        FROM hour_rows
     ), average AS (
         SELECT 
-            AVG(energy_consumption) AS avg_energy_consumption,
-            strftime('%H', time) AS hour
-        FROM {hour_table}
-        GROUP BY hour
+            total / count AS avg_energy_consumption,
+            bucket AS hour
+        FROM {rollup_table}
+        WHERE table_name = :hour_table
     )
 
     SELECT 
@@ -76,30 +460,42 @@ class EnergyDataHour(YoulessData):
     LIMIT 24
     '''
 
+    def params(self) -> dict:
+        # The current hour and the 23 before
+        since = self.now().replace(minute=0) - timedelta(hours=23)
+        return {**super().params(), 'since': since}
+
 
 class EnergyDataDay(YoulessData):
     table_names = {'day_table': 'youless_day', 'hour_table': 'youless_hour'}
     query = '''
-    WITH data AS (
+    WITH day_rows AS (
+        SELECT {day_table_columns}
+        FROM {day_table}
+        WHERE time >= :since
+    ), today_rows AS (
+        SELECT {hour_table_columns}
+        FROM {hour_table}
+        WHERE time >= :today
+    ), data AS (
         SELECT 
             *,
             strftime('%w', time) AS week_day
-        FROM {day_table}
+        FROM day_rows
     ), todays_energy AS (
         SELECT 
             strftime('%Y-%m-%d 00:00:00', time) AS time,
             SUM(energy_consumption)/1000 AS energy_consumption,
             'kWh' AS unit,
             strftime('%w', time) AS week_day
-        FROM {hour_table}
-        WHERE strftime('%Y-%m-%d', time) = CURRENT_DATE
+        FROM today_rows
         GROUP BY 1, week_day, unit
     ), average AS (
         SELECT 
-            AVG(energy_consumption) AS avg_energy_consumption,
-            strftime('%w', time) AS week_day
-        FROM {day_table}
-        GROUP BY week_day
+            total / count AS avg_energy_consumption,
+            bucket AS week_day
+        FROM {rollup_table}
+        WHERE table_name = :day_table
     ), current_day_added AS (
         -- Current day needs to be filled with the hour data
         SELECT * FROM data
@@ -115,19 +511,40 @@ class EnergyDataDay(YoulessData):
     LIMIT 365
     '''
 
+    def params(self) -> dict:
+        today = self.now().replace(hour=0, minute=0)
+        return {
+            **super().params(),
+            'today': today,
+            'since': today - timedelta(days=364),
+        }
+
 
 class EnergyDataMonth(YoulessData):
     table_names = {'day_table': 'youless_day'}
+    months = 12
     query = '''
+    WITH day_rows AS (
+        SELECT {day_table_columns}
+        FROM {day_table}
+        WHERE time >= :since
+    )
+
     SELECT 
         SUM(energy_consumption) AS energy_consumption,
         strftime('%Y-%m-01 00:00:00', time) AS time,
         strftime('%m', time) AS month,
         strftime('%Y', time) AS year
-    FROM {day_table}
+    FROM day_rows
     GROUP BY year, month
     '''
 
+    def params(self) -> dict:
+        # First day of the oldest month, the current month included
+        now = self.now()
+        year, month = divmod(now.year * 12 + now.month - self.months, 12)
+        return {**super().params(), 'since': datetime(year, month + 1, 1)}
+
 
 class GasDataHour(EnergyDataHour):
     table_names = {'hour_table': 'youless_hour_gas'}
@@ -141,6 +558,245 @@ class GasDataMonth(EnergyDataMonth):
     table_names = {'day_table': 'youless_day_gas'}
 
 
+class SummaryData(YoulessData):
+    """
+    Figures of the summary cards as stored by the logger, one primary key
+    lookup per device. The figures of several devices are summed. `complete`
+    tells whether the logger stored them for every device.
+    """
+
+    table_names = {'summary_table': storage.SUMMARY_TABLE}
+    source = 'youless_hour'
+
+    def __init__(self, devices: list = None):
+        devices = DEVICE_LIST if devices is None else devices
+        self.sources = [device.table(self.source) for device in devices]
+        placeholders = ', '.join(f':source_{i}' for i in range(len(self.sources)))
+        figures = ', '.join(f'SUM({figure}) AS {figure}' for figure in FIGURES)
+        self.query = f'''
+            SELECT COUNT(*) AS devices, {figures}
+            FROM {{summary_table}}
+            WHERE source IN ({placeholders})
+        '''
+        super().__init__()
+
+    def params(self) -> dict:
+        sources = {f'source_{i}': source for i, source in enumerate(self.sources)}
+        return {**super().params(), **sources}
+
+    @property
+    def complete(self) -> bool:
+        return self.data is not None and self.data['devices'][0] == len(self.sources)
+
+    @property
+    def figures(self) -> dict:
+        return {figure: self.data[figure][0] for figure in FIGURES}
+
+
+class GasSummaryData(SummaryData):
+    source = 'youless_hour_gas'
+
+
+class HistoryData(YoulessData):
+    """
+    All rows of one table between `start` and `end`, including the rows which
+    were moved to the archive. Rows still in the database win.
+    """
+
+    query = '''
+        SELECT {table_columns}
+        FROM {table}
+        WHERE time >= :start AND time < :end
+        ORDER BY time
+    '''
+
+    def __init__(
+        self,
+        table_name: str,
+        start: datetime,
+        end: datetime,
+        archive_path: str = ARCHIVE_PATH,
+    ):
+        self.table_names = {'table': table_name}
+        self.start = start
+        self.end = end
+        self.archive = Archive(archive_path)
+        super().__init__()
+
+    def params(self) -> dict:
+        return {**super().params(), 'start': self.start, 'end': self.end}
+
+    def load_data(self):
+        super().load_data()
+        times, values, unit = self.archive.read_range(
+            self.table_names['table'], self.start, self.end
+        )
+        if not len(times):
+            return
+        archived = pd.DataFrame(
+            {
+                'time': storage.format_times(times),
+                'energy_consumption': values,
+                'unit': unit,
+            }
+        )
+        data = archived if self.data is None else pd.concat([archived, self.data])
+        self.data = (
+            data.drop_duplicates('time', keep='last')
+            .sort_values('time')
+            .reset_index(drop=True)
+        )
+
+
+class EnergyRangeData(HistoryData):
+    """
+    Consumption between `start` and `end` from the coarsest resolution which
+    still has `min_points` values in the range, so any range costs about the
+    same. Months are summed from the day table and its archive.
+    """
+
+    # (resolution, table, seconds per value), coarsest first
+    resolutions = [
+        ('month', 'youless_day', 30 * 24 * 60 * 60),
+        ('day', 'youless_day', 24 * 60 * 60),
+        ('hour', 'youless_hour', 60 * 60),
+        ('minute', 'youless_minute', 60),
+    ]
+    min_points = 60
+    month_query = '''
+        SELECT
+            strftime('%Y-%m-01 00:00:00', time) AS time,
+            SUM(energy_consumption) AS energy_consumption,
+            MAX(unit) AS unit
+        FROM (
+            SELECT {table_columns}
+            FROM {table}
+            WHERE time >= :start AND time < :end
+        )
+        GROUP BY 1
+        ORDER BY 1
+    '''
+
+    def __init__(
+        self,
+        start: datetime,
+        end: datetime,
+        min_points: int = None,
+        archive_path: str = ARCHIVE_PATH,
+        device: Device = None,
+    ):
+        self.resolution, table_name = self.choose_resolution(
+            start, end, min_points or self.min_points
+        )
+        if device is not None:
+            table_name = device.table(table_name)
+        if self.resolution == 'month':
+            self.query = self.month_query
+        super().__init__(table_name, start, end, archive_path)
+
+    @classmethod
+    def choose_resolution(cls, start: datetime, end: datetime, min_points: int):
+        seconds = (end - start).total_seconds()
+        for resolution, table_name, step in cls.resolutions:
+            if seconds / step >= min_points:
+                break
+        return resolution, table_name
+
+    def params(self) -> dict:
+        return {**super().params(), 'start': self.table_start}
+
+    def load_data(self):
+        self.table_start = self.start
+        if self.resolution != 'month':
+            super().load_data()
+            return
+        times, values, unit = self.archive.read_range(
+            self.table_names['table'], self.start, self.end
+        )
+        if len(times):
+            # Rows up to the last archived day are only left in the table when
+            # archiving was interrupted, they are in the archive already
+            last = times.max().astype(datetime)
+            self.table_start = max(self.start, last + timedelta(seconds=1))
+        YoulessData.load_data(self)
+        if not len(times):
+            return
+        keys, inverse = np.unique(times.astype('M8[M]'), return_inverse=True)
+        archived = pd.DataFrame(
+            {
+                'time': storage.format_times(keys.astype('M8[s]')),
+                'energy_consumption': np.bincount(inverse, weights=values),
+                'unit': unit,
+            }
+        )
+        self.data = sum_frames([archived, self.data], ('energy_consumption',))
+
+
+class GasRangeData(EnergyRangeData):
+    resolutions = [
+        ('month', 'youless_day_gas', 30 * 24 * 60 * 60),
+        ('day', 'youless_day_gas', 24 * 60 * 60),
+        ('hour', 'youless_hour_gas', 60 * 60),
+    ]
+
+
+def sum_frames(frames: list, columns: tuple) -> pd.DataFrame:
+    """
+    Frames of several devices summed per time. Only the given columns are
+    summed, the others are taken from the first frame having the time.
+    """
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return None
+    data = pd.concat(frames, ignore_index=True)
+    aggregations = {
+        column: 'sum' if column in columns else 'first'
+        for column in data.columns
+        if column != 'time'
+    }
+    ascending = frames[0]['time'].is_monotonic_increasing
+    return (
+        data.groupby('time', as_index=False)
+        .agg(aggregations)
+        .sort_values('time', ascending=ascending)
+        .reset_index(drop=True)
+    )
+
+
+class CombinedData:
+    """
+    Sum of a query over several devices. Takes the same arguments as the
+    query class.
+    """
+
+    sum_columns = ('energy_consumption', 'avg_energy_consumption')
+
+    def __init__(self, data_class, devices: list, *args, **kwargs):
+        parts = [data_class(*args, device=device, **kwargs) for device in devices]
+        self.resolution = getattr(parts[0], 'resolution', None)
+        self.data = sum_frames([part.data for part in parts], self.sum_columns)
+
+
+def for_device(data_class, device_name: str, devices: list = None):
+    """
+    Callable creating the query for the named device, or for the sum of all
+    devices with `ALL_DEVICES`.
+    """
+    devices = DEVICE_LIST if devices is None else devices
+    if device_name == ALL_DEVICES:
+        return partial(CombinedData, data_class, devices)
+    device = next(device for device in devices if device.name == device_name)
+    return partial(data_class, device=device)
+
+
+def summary_for(data_class, device_name: str, devices: list = None):
+    # Like `for_device`, the summary query sums the devices itself
+    devices = DEVICE_LIST if devices is None else devices
+    if device_name != ALL_DEVICES:
+        devices = [device for device in devices if device.name == device_name]
+    return partial(data_class, devices)
+
+
 def load_data():
     energy_minute = EnergyDataMinute()
     df_m = energy_minute.data
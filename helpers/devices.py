@@ -0,0 +1,57 @@
+import re
+from config import DEVICES, FETCH_TIMEOUT, GAS_ENABLED, HOST
+
+DEVICE_NAME_PATTERN = re.compile(r'^[a-z0-9_]*$')
+# Dashboard choice which sums the values of all devices
+ALL_DEVICES = '*'
+
+
+class Device:
+    """
+    One Youless unit. Its data is stored in the youless tables with the
+    device name as suffix, e.g. `youless_minute__garage`. The device without
+    a name uses the plain table names of a single device setup.
+    """
+
+    def __init__(
+        self,
+        name: str = '',
+        host: str = HOST,
+        gas_enabled: bool = False,
+        timeout: float = FETCH_TIMEOUT,
+    ):
+        if not DEVICE_NAME_PATTERN.match(name):
+            raise ValueError(
+                f'Invalid device name {name!r}, use lowercase letters, digits and _'
+            )
+        self.name = name
+        self.host = host if host.endswith('/') else host + '/'
+        self.gas_enabled = bool(gas_enabled)
+        self.timeout = timeout
+
+    def __repr__(self) -> str:
+        return f'Device({self.name!r}, {self.host!r})'
+
+    @property
+    def label(self) -> str:
+        return self.name or 'default'
+
+    def table(self, table_name: str) -> str:
+        return f'{table_name}__{self.name}' if self.name else table_name
+
+
+def load_devices(config: list = None) -> list:
+    """
+    Devices of the `devices` config option. Without it there is one device
+    with the `host` and `gas_enabled` options.
+    """
+    if not config:
+        return [Device(host=HOST, gas_enabled=GAS_ENABLED)]
+    devices = [Device(**device) for device in config]
+    names = [device.name for device in devices]
+    if len(set(names)) != len(names):
+        raise ValueError('Device names have to be unique')
+    return devices
+
+
+DEVICE_LIST = load_devices(DEVICES)
@@ -0,0 +1,251 @@
+import csv
+import io
+import numpy as np
+import sqlite3 as sql
+from contextlib import closing
+from datetime import datetime, timedelta
+from helpers import storage
+from helpers.archive import Archive, next_month
+
+CSV_FORMAT = 'csv'
+PARQUET_FORMAT = 'parquet'
+EXPORT_FORMATS = {
+    CSV_FORMAT: 'text/csv',
+    PARQUET_FORMAT: 'application/vnd.apache.parquet',
+}
+# strftime format of the time buckets and the matching NumPy unit
+AGGREGATIONS = {
+    'hour': ('%Y-%m-%d %H:00:00', 'M8[h]'),
+    'day': ('%Y-%m-%d 00:00:00', 'M8[D]'),
+}
+# Power is averaged when aggregating, amounts (kWh, m3) are summed
+RATE_UNITS = ('Watt',)
+COLUMNS = ('time', 'energy_consumption', 'unit')
+CHUNK_SIZE = 10000
+# Range of an export without start or end
+FIRST_TIME = datetime(1970, 1, 1)
+LAST_TIME = datetime(9999, 1, 1)
+
+
+def parse_range(start: str = None, end: str = None) -> tuple:
+    # ISO dates or times, e.g. 2022-04-10 or 2022-04-10T12:00
+    return (
+        datetime.fromisoformat(start) if start else FIRST_TIME,
+        datetime.fromisoformat(end) if end else LAST_TIME,
+    )
+
+
+def export_query(storage_format: str, table_name: str, aggregate: str = None) -> str:
+    rows = f'''
+        SELECT {storage.column_sql(storage_format, table_name)}
+        FROM {table_name}
+        WHERE time >= :start AND time < :end
+    '''
+    if aggregate is None:
+        return rows + ' ORDER BY time'
+    bucket = AGGREGATIONS[aggregate][0]
+    rates = ', '.join(f"'{unit}'" for unit in RATE_UNITS)
+    return f'''
+        SELECT
+            strftime('{bucket}', time) AS time,
+            CASE WHEN MAX(unit) IN ({rates})
+                THEN AVG(energy_consumption)
+                ELSE SUM(energy_consumption)
+            END AS energy_consumption,
+            MAX(unit) AS unit
+        FROM ({rows})
+        GROUP BY 1
+        ORDER BY 1
+    '''
+
+
+def aggregate_values(
+    times: np.ndarray, values: np.ndarray, unit: str, aggregate: str
+) -> tuple:
+    # The aggregation of export_query, for archived values
+    buckets = times.astype(AGGREGATIONS[aggregate][1])
+    keys, inverse = np.unique(buckets, return_inverse=True)
+    totals = np.bincount(inverse, weights=values)
+    if unit in RATE_UNITS:
+        totals = totals / np.bincount(inverse)
+    return keys.astype('M8[s]'), totals
+
+
+def _archived_chunks(
+    archive: Archive, table_name: str, start: datetime, end: datetime, aggregate
+):
+    # One month at a time, buckets never span two months
+    first, last = start.strftime('%Y-%m'), end.strftime('%Y-%m')
+    for month in sorted(archive.months(table_name)):
+        if not first <= month <= last:
+            continue
+        month_start = datetime.strptime(month, '%Y-%m')
+        times, values, unit = archive.read_range(
+            table_name, max(start, month_start), min(end, next_month(month_start))
+        )
+        if not len(times):
+            continue
+        if aggregate is not None:
+            times, values = aggregate_values(times, values, unit, aggregate)
+        yield list(
+            zip(storage.format_times(times), values.tolist(), [unit] * len(times))
+        )
+
+
+def export_rows(
+    con: sql.Connection,
+    table_name: str,
+    start: datetime,
+    end: datetime,
+    aggregate: str = None,
+    archive: Archive = None,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """
+    Rows (time, energy_consumption, unit) of the table within [start, end),
+    oldest first, in lists of at most `chunk_size` rows. Archived months come
+    first. The rows are read from a cursor, so the memory use does not depend
+    on the range.
+    """
+    if archive is not None:
+        last = None
+        for chunk in _archived_chunks(archive, table_name, start, end, aggregate):
+            for offset in range(0, len(chunk), chunk_size):
+                yield chunk[offset : offset + chunk_size]
+            last = chunk[-1][0]
+        if last is not None:
+            # Rows moved to the archive are not in the table anymore, unless
+            # archiving was interrupted before deleting them
+            last = datetime.strptime(last, storage.TIME_FORMAT)
+            step = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+            start = max(start, last + step.get(aggregate, timedelta(seconds=1)))
+    fmt = storage.storage_format(con)
+    cur = con.execute(
+        export_query(fmt, table_name, aggregate),
+        {
+            'start': storage.encode_time(fmt, start),
+            'end': storage.encode_time(fmt, end),
+        },
+    )
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def csv_chunks(chunks):
+    # Encoded CSV text, the header first
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _Sink(io.RawIOBase):
+    # Write-only file which hands out what was written since the last call
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_chunks(chunks):
+    """
+    A Parquet file with one row group per chunk. Needs pyarrow, which is
+    imported on first use.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ('time', pa.timestamp('s')),
+            ('energy_consumption', pa.float64()),
+            ('unit', pa.string()),
+        ]
+    )
+    sink = _Sink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in chunks:
+            times, values, units = zip(*rows)
+            writer.write_table(
+                pa.table(
+                    [
+                        pa.array(np.array(times, dtype='M8[s]')),
+                        pa.array(values, pa.float64()),
+                        pa.array(units, pa.string()),
+                    ],
+                    schema=schema,
+                )
+            )
+            yield sink.take()
+    yield sink.take()
+
+
+def export(
+    db_path: str,
+    table_name: str,
+    start: datetime,
+    end: datetime,
+    export_format: str = CSV_FORMAT,
+    aggregate: str = None,
+    archive: Archive = None,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """
+    The export as a stream of bytes. Unknown tables, formats or aggregations
+    raise a ValueError before anything is read.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format {export_format!r}')
+    if aggregate is not None and aggregate not in AGGREGATIONS:
+        raise ValueError(f'Unknown aggregation {aggregate!r}')
+    if export_format == PARQUET_FORMAT:
+        # Optional dependency, fail before the first byte is sent
+        import pyarrow  # noqa: F401
+    try:
+        con = storage.connect_readonly(db_path)
+    except sql.OperationalError:
+        tables = []
+    else:
+        with closing(con):
+            tables = storage.youless_tables(con)
+    if table_name not in tables:
+        raise ValueError(f'Unknown table {table_name!r}')
+
+    def stream():
+        con = storage.connect_readonly(db_path)
+        try:
+            chunks = export_rows(
+                con, table_name, start, end, aggregate, archive, chunk_size
+            )
+            if export_format == PARQUET_FORMAT:
+                yield from parquet_chunks(chunks)
+            else:
+                yield from csv_chunks(chunks)
+        finally:
+            con.close()
+
+    return stream()
@@ -0,0 +1,78 @@
+import random
+import sqlite3 as sql
+import time
+from helpers import storage
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def remaining(deadline: float = None) -> float:
+    # Seconds left until a time.monotonic() deadline, infinite without one
+    if deadline is None:
+        return float('inf')
+    return deadline - time.monotonic()
+
+
+def backoff_delay(backoff: float, attempt: int, rng=random) -> float:
+    # Full jitter, retries of several scrapers do not hit the device together
+    return rng.uniform(0, backoff * 2**attempt)
+
+
+def call_with_retries(
+    function,
+    timeout: float,
+    retries: int,
+    backoff: float,
+    deadline: float = None,
+    sleep=time.sleep,
+):
+    """
+    `function(timeout)`, called again up to `retries` times after an exception
+    with a growing random wait in between. The timeout and the waits are cut
+    to the time left until `deadline`, after which DeadlineExceeded is raised.
+    """
+    for attempt in range(retries + 1):
+        left = remaining(deadline)
+        if left <= 0:
+            raise DeadlineExceeded('No time left in this run')
+        try:
+            return function(min(timeout, left))
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(backoff, attempt)
+            if delay >= remaining(deadline):
+                raise DeadlineExceeded('No time left to retry') from e
+            sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Skips the scraper of a table for `cooldown` seconds after `threshold`
+    failed runs in a row. The state is kept in the meta table, so it carries
+    over from one cron run to the next. After the cooldown the next run is
+    let through, a failure opens the breaker again right away.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    def is_open(self, con: sql.Connection, table_name: str, now: float) -> bool:
+        if not self.threshold:
+            return False
+        until = storage.get_meta(con, table_name, 'breaker_open_until')
+        return until is not None and now < until
+
+    def record(self, con: sql.Connection, table_name: str, ok: bool, now: float):
+        # Part of the transaction which stores the run, the caller commits
+        failures = storage.get_meta(con, table_name, 'breaker_failures', 0)
+        if ok:
+            if failures:
+                storage.set_meta(con, table_name, 'breaker_failures', 0)
+            return
+        storage.set_meta(con, table_name, 'breaker_failures', failures + 1)
+        if self.threshold and failures + 1 >= self.threshold:
+            storage.set_meta(con, table_name, 'breaker_open_until', now + self.cooldown)
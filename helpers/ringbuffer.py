@@ -0,0 +1,109 @@
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+# Sequence number, number of samples ever written and capacity
+HEADER_SIZE = 3
+# Shared memory created by this process, which its resource tracker removes
+_CREATED = set()
+
+
+class RingBuffer:
+    """
+    Fixed number of (time, value) samples in two NumPy arrays, the oldest
+    samples are overwritten. Times are INTEGER seconds of the local time.
+
+    With a `name` the arrays live in shared memory, so other processes can
+    read the latest samples without touching the disk. There is one writer,
+    which has to make sure no other one uses the name (YoulessSampler holds
+    a lock file). Readers retry while a write is in progress (sequence lock).
+    """
+
+    def __init__(self, capacity: int, name: str = None):
+        self.name = name
+        self._shm = None
+        size = (HEADER_SIZE + 2 * capacity) * 8
+        if name is None:
+            buffer = bytearray(size)
+        else:
+            try:
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                # No writer uses it, so it was left behind by one which did
+                # not shut down cleanly
+                stale = shared_memory.SharedMemory(name)
+                stale.close()
+                stale.unlink()
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            _CREATED.add(name)
+            buffer = self._shm.buf
+        self._map(buffer, capacity)
+        self._header[:] = (0, 0, capacity)
+
+    def _map(self, buffer, capacity: int):
+        self._header = np.ndarray(HEADER_SIZE, np.int64, buffer)
+        self._times = np.ndarray(capacity, np.int64, buffer, HEADER_SIZE * 8)
+        self._values = np.ndarray(
+            capacity, np.float64, buffer, (HEADER_SIZE + capacity) * 8
+        )
+
+    @classmethod
+    def attach(cls, name: str) -> 'RingBuffer':
+        """
+        Read access to the buffer another process created. Raises
+        FileNotFoundError when there is none.
+        """
+        ring = cls.__new__(cls)
+        ring.name = name
+        ring._shm = shared_memory.SharedMemory(name)
+        if name not in _CREATED:
+            # Only the creator may remove the memory when it exits
+            resource_tracker.unregister(ring._shm._name, 'shared_memory')
+        capacity = int(np.ndarray(HEADER_SIZE, np.int64, ring._shm.buf)[2])
+        ring._map(ring._shm.buf, capacity)
+        return ring
+
+    @property
+    def capacity(self) -> int:
+        return len(self._times)
+
+    @property
+    def written(self) -> int:
+        # Number of samples ever appended, also the position of the next one
+        return int(self._header[1])
+
+    def append(self, times: np.ndarray, values: np.ndarray):
+        times = np.asarray(times, dtype=np.int64)[-self.capacity :]
+        values = np.asarray(values, dtype=np.float64)[-self.capacity :]
+        positions = (self.written + np.arange(len(times))) % self.capacity
+        self._header[0] += 1
+        self._times[positions] = times
+        self._values[positions] = values
+        self._header[1] += len(times)
+        self._header[0] += 1
+
+    def read(self, since: int = 0) -> tuple:
+        """
+        (times, values, written) of the samples from position `since` on,
+        oldest first. Samples which were overwritten already are skipped.
+        """
+        while True:
+            sequence = int(self._header[0])
+            if sequence % 2:
+                continue
+            written = self.written
+            start = max(since, written - self.capacity, 0)
+            positions = np.arange(start, written) % self.capacity
+            times, values = self._times[positions], self._values[positions]
+            if int(self._header[0]) == sequence:
+                return times, values, written
+
+    def close(self, unlink: bool = False):
+        if self._shm is None:
+            return
+        # The arrays have to be released before the memory can be closed
+        self._header = self._times = self._values = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+            _CREATED.discard(self.name)
+        self._shm = None
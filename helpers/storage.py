@@ -0,0 +1,639 @@
+import calendar
+import itertools
+import pathlib
+import threading
+import numpy as np
+import sqlite3 as sql
+from contextlib import contextmanager
+from datetime import datetime
+
+# Bookkeeping per youless table (e.g. the newest stored timestamp)
+META_TABLE = 'youless_meta'
+# Running sum and count of the values per bucket, for the historical averages
+ROLLUP_TABLE = 'youless_rollup'
+# Figures of the summary cards, see `helpers.summary`
+SUMMARY_TABLE = 'youless_summary'
+INTERNAL_TABLES = (META_TABLE, ROLLUP_TABLE, SUMMARY_TABLE)
+# Power readings of the sampler, one row per sample
+LIVE_TABLE = 'youless_live'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# strftime format of the rollup bucket per granularity
+ROLLUP_BUCKETS = {'minute': '%H:%M', 'hour': '%H', 'day': '%w'}
+# Meta table entries of the whole database use an empty table name
+DATABASE_KEY = ''
+# Storage formats of the youless tables. The text format stores TEXT timestamps,
+# REAL values and the unit on every row. The compact format stores the local
+# time as INTEGER seconds since epoch (rowid), the values as INTEGER
+# thousandths and the unit once in the meta table.
+TEXT_FORMAT = 'text'
+COMPACT_FORMAT = 'compact'
+COMPACT_SCALE = 1000
+
+
+# WAL lets the dashboard read while the logger writes. With synchronous NORMAL
+# a power cut can lose the last transactions, but not corrupt the database.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+# While importing: no sync to disk before the end of the load, a larger page
+# cache and the staged rows in a temporary file instead of memory
+BULK_PRAGMAS = {'synchronous': 'OFF', 'cache_size': -64000, 'temp_store': 'FILE'}
+# Temporary table of the rows being imported
+IMPORT_TABLE = 'youless_import'
+# Held while a shared connection is used, by any thread of the process
+WRITE_LOCK = threading.RLock()
+_SHARED_CONNECTIONS = {}
+_THREAD_CONNECTIONS = threading.local()
+
+
+def connect(db_path: str, **kwargs) -> sql.Connection:
+    con = sql.connect(db_path, **kwargs)
+    for name, value in PRAGMAS.items():
+        con.execute(f'PRAGMA {name} = {value}')
+    return con
+
+
+def connect_readonly(db_path: str) -> sql.Connection:
+    """
+    Read-only connection for the dashboard. Raises sql.OperationalError when
+    the database does not exist yet, instead of creating an empty file. In
+    WAL mode the directory has to be writable for the shared memory file.
+    """
+    uri = pathlib.Path(db_path).absolute().as_uri() + '?mode=ro'
+    con = sql.connect(uri, uri=True)
+    con.execute(f'PRAGMA busy_timeout = {PRAGMAS["busy_timeout"]}')
+    return con
+
+
+@contextmanager
+def bulk_pragmas(con: sql.Connection):
+    """
+    Bulk-load settings for the duration of an import, outside of a
+    transaction. Afterwards the write-ahead log is written to the database
+    and synced, so the import is safe on disk once this returns.
+    """
+    for name, value in BULK_PRAGMAS.items():
+        con.execute(f'PRAGMA {name} = {value}')
+    try:
+        yield con
+    finally:
+        con.execute('PRAGMA cache_size = -2000')
+        for name in BULK_PRAGMAS:
+            if name in PRAGMAS:
+                con.execute(f'PRAGMA {name} = {PRAGMAS[name]}')
+        con.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def shared_connection(db_path: str) -> sql.Connection:
+    """
+    One connection per database for the whole process, so a run sets up a
+    single connection. Only use it while holding `WRITE_LOCK`.
+    """
+    with WRITE_LOCK:
+        if db_path not in _SHARED_CONNECTIONS:
+            _SHARED_CONNECTIONS[db_path] = connect(db_path, check_same_thread=False)
+        return _SHARED_CONNECTIONS[db_path]
+
+
+def thread_connection(db_path: str) -> sql.Connection:
+    """
+    Connection of the calling thread for reads outside of a transaction. In
+    WAL mode it does not wait for a writer, so it needs no lock.
+    """
+    connections = getattr(_THREAD_CONNECTIONS, 'connections', None)
+    if connections is None:
+        connections = _THREAD_CONNECTIONS.connections = {}
+    if db_path not in connections:
+        connections[db_path] = connect(db_path)
+    return connections[db_path]
+
+
+def format_times(times: np.ndarray) -> list:
+    # datetime64 values in the text format of the time column
+    return np.char.replace(np.datetime_as_string(times, unit='s'), 'T', ' ').tolist()
+
+
+def encode_times(storage_format: str, times: np.ndarray) -> list:
+    # datetime64 values as stored in the time column
+    if storage_format == COMPACT_FORMAT:
+        return times.astype('M8[s]').astype(np.int64).tolist()
+    return format_times(times)
+
+
+def encode_time(storage_format: str, value: datetime):
+    if storage_format == COMPACT_FORMAT:
+        return calendar.timegm(value.timetuple())
+    return value.strftime(TIME_FORMAT)
+
+
+def raw_column_sql(storage_format: str) -> str:
+    # Select list of the time as INTEGER seconds and the value as REAL
+    if storage_format == COMPACT_FORMAT:
+        return f'time, energy_consumption * 1.0 / {COMPACT_SCALE}'
+    return "CAST(strftime('%s', time) AS INTEGER), energy_consumption"
+
+
+def column_sql(storage_format: str, table_name: str) -> str:
+    """
+    Select list which presents a table with the columns of the text format.
+    Filters on the raw time column can still use the primary key.
+    """
+    if storage_format == COMPACT_FORMAT:
+        return f"""
+            datetime(time, 'unixepoch') AS time,
+            energy_consumption * 1.0 / {COMPACT_SCALE} AS energy_consumption,
+            (
+                SELECT value FROM {META_TABLE}
+                WHERE table_name = '{table_name}' AND key = 'unit'
+            ) AS unit
+        """
+    return 'time, energy_consumption, unit'
+
+
+def ensure_meta_table(con: sql.Connection):
+    con.execute(f'''
+        CREATE TABLE IF NOT EXISTS {META_TABLE} (
+            table_name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value,
+            PRIMARY KEY (table_name, key)
+        )
+        ''')
+
+
+def get_meta(con: sql.Connection, table_name: str, key: str, default=None):
+    try:
+        row = con.execute(
+            f'SELECT value FROM {META_TABLE} WHERE table_name = ? AND key = ?',
+            (table_name, key),
+        ).fetchone()
+    except sql.OperationalError:
+        # Meta table has not been created yet
+        return default
+    return row[0] if row else default
+
+
+def set_meta(con: sql.Connection, table_name: str, key: str, value):
+    ensure_meta_table(con)
+    con.execute(
+        f'''
+        INSERT INTO {META_TABLE} (table_name, key, value) VALUES (?, ?, ?)
+        ON CONFLICT (table_name, key) DO UPDATE SET value = excluded.value
+        ''',
+        (table_name, key, value),
+    )
+
+
+def raise_meta(con: sql.Connection, table_name: str, key: str, value):
+    # Only ever moves the stored value forward
+    ensure_meta_table(con)
+    con.execute(
+        f'''
+        INSERT INTO {META_TABLE} (table_name, key, value) VALUES (?, ?, ?)
+        ON CONFLICT (table_name, key) DO UPDATE SET value = max(value, excluded.value)
+        ''',
+        (table_name, key, value),
+    )
+
+
+def bump_version(con: sql.Connection, table_name: str):
+    # Ingest counter, lets readers detect that a table changed
+    ensure_meta_table(con)
+    con.execute(
+        f'''
+        INSERT INTO {META_TABLE} (table_name, key, value) VALUES (?, 'version', 1)
+        ON CONFLICT (table_name, key) DO UPDATE SET value = value + 1
+        ''',
+        (table_name,),
+    )
+
+
+def get_versions(con: sql.Connection, table_names: list):
+    """
+    Ingest counters of the given tables, None if they are not tracked (yet).
+    """
+    placeholders = ', '.join('?' * len(table_names))
+    try:
+        rows = con.execute(
+            f'''
+            SELECT table_name, value
+            FROM {META_TABLE}
+            WHERE key = 'version' AND table_name IN ({placeholders})
+            ''',
+            list(table_names),
+        ).fetchall()
+    except sql.OperationalError:
+        return None
+    versions = dict(rows)
+    if len(versions) < len(table_names):
+        return None
+    return tuple(versions[name] for name in table_names)
+
+
+def ingest_version(con: sql.Connection):
+    """
+    Sum of the ingest counters of all tables except the live samples, it
+    changes with every stored batch. None without a meta table.
+    """
+    try:
+        row = con.execute(
+            f'''
+            SELECT COALESCE(SUM(value), 0)
+            FROM {META_TABLE}
+            WHERE key = 'version' AND table_name NOT LIKE ?
+            ''',
+            (LIVE_TABLE + '%',),
+        ).fetchone()
+    except sql.OperationalError:
+        return None
+    return row[0]
+
+
+def table_exists(con: sql.Connection, table_name: str) -> bool:
+    row = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table_name,),
+    ).fetchone()
+    return row is not None
+
+
+def youless_tables(con: sql.Connection) -> list:
+    placeholders = ', '.join('?' * len(INTERNAL_TABLES))
+    rows = con.execute(
+        f'''
+        SELECT name
+        FROM sqlite_master
+        WHERE type = 'table' AND name LIKE 'youless_%'
+            AND name NOT IN ({placeholders})
+        ORDER BY name
+        ''',
+        INTERNAL_TABLES,
+    ).fetchall()
+    return [name for name, in rows]
+
+
+def storage_format(con: sql.Connection) -> str:
+    return get_meta(con, DATABASE_KEY, 'format', TEXT_FORMAT)
+
+
+def ensure_table(
+    con: sql.Connection, table_name: str, default_format: str = TEXT_FORMAT
+) -> str:
+    """
+    Create the table (and its unique key on time) if needed and return the
+    storage format. New databases use `default_format`, databases with text
+    tables need to be migrated to switch to the compact format.
+    """
+    fmt = get_meta(con, DATABASE_KEY, 'format')
+    if fmt is None:
+        fmt = TEXT_FORMAT if youless_tables(con) else default_format
+        set_meta(con, DATABASE_KEY, 'format', fmt)
+    if fmt == COMPACT_FORMAT:
+        con.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                time INTEGER PRIMARY KEY,
+                energy_consumption INTEGER NOT NULL
+            )
+            ''')
+        return fmt
+
+    # Same column types as the tables pandas used to create
+    con.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            time TIMESTAMP,
+            energy_consumption REAL,
+            unit TEXT
+        )
+        ''')
+    index_name = f'{table_name}_time'
+    index_exists = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+        (index_name,),
+    ).fetchone()
+    if index_exists:
+        return fmt
+    # Older tables may contain duplicated timestamps; keep the latest row
+    con.execute(f'''
+        DELETE FROM {table_name}
+        WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table_name} GROUP BY time)
+        ''')
+    con.execute(f'CREATE UNIQUE INDEX {index_name} ON {table_name} (time)')
+    return fmt
+
+
+def _compact_table(con: sql.Connection, table_name: str):
+    new_table = f'{table_name}__compact'
+    con.execute(f'''
+        CREATE TABLE {new_table} (
+            time INTEGER PRIMARY KEY,
+            energy_consumption INTEGER NOT NULL
+        )
+        ''')
+    # Timestamps are local time, stored as if they were UTC
+    con.execute(f'''
+        INSERT INTO {new_table} (time, energy_consumption)
+        SELECT
+            CAST(strftime('%s', time) AS INTEGER),
+            CAST(round(energy_consumption * {COMPACT_SCALE}) AS INTEGER)
+        FROM {table_name}
+        WHERE energy_consumption IS NOT NULL
+        ORDER BY time
+        ''')
+    unit = con.execute(
+        f'SELECT unit FROM {table_name} ORDER BY time DESC LIMIT 1'
+    ).fetchone()
+    con.execute(f'DROP TABLE {table_name}')
+    con.execute(f'ALTER TABLE {new_table} RENAME TO {table_name}')
+    if unit:
+        set_meta(con, table_name, 'unit', unit[0])
+    bump_version(con, table_name)
+
+
+def migrate(con: sql.Connection, target_format: str = None) -> list:
+    """
+    Upgrade all youless tables to the current schema, in one transaction so
+    a failure leaves the database as it was. With `target_format` set to the
+    compact format, text tables are converted in place.
+    """
+    # The sqlite3 module opens no transaction for CREATE or DROP, every one
+    # of them would be committed on its own
+    if not con.in_transaction:
+        con.execute('BEGIN IMMEDIATE')
+    try:
+        tables = []
+        for table_name in youless_tables(con):
+            if table_name.endswith('__compact'):
+                # Left behind by an older, interrupted migration
+                con.execute(f'DROP TABLE {table_name}')
+            else:
+                tables.append(table_name)
+        if storage_format(con) == TEXT_FORMAT:
+            for table_name in tables:
+                ensure_table(con, table_name)
+            if target_format == COMPACT_FORMAT:
+                for table_name in tables:
+                    _compact_table(con, table_name)
+                set_meta(con, DATABASE_KEY, 'format', COMPACT_FORMAT)
+    except BaseException:
+        con.rollback()
+        raise
+    con.commit()
+    return tables
+
+
+def _time_aggregate(con: sql.Connection, table_name: str, aggregate: str):
+    column = f'{aggregate}(time)'
+    if storage_format(con) == COMPACT_FORMAT:
+        column = f"datetime({column}, 'unixepoch')"
+    return con.execute(f'SELECT {column} FROM {table_name}').fetchone()[0]
+
+
+def max_time(con: sql.Connection, table_name: str):
+    # Newest timestamp of the table in the text format
+    return _time_aggregate(con, table_name, 'MAX')
+
+
+def min_time(con: sql.Connection, table_name: str):
+    # Oldest timestamp of the table in the text format
+    return _time_aggregate(con, table_name, 'MIN')
+
+
+def upsert(
+    con: sql.Connection,
+    table_name: str,
+    times: np.ndarray,
+    values: np.ndarray,
+    unit: str,
+) -> tuple:
+    """
+    Merge the values into the table. Returns the number of inserted and
+    updated rows.
+    """
+    fmt = storage_format(con)
+    keys = encode_times(fmt, times)
+    if fmt == COMPACT_FORMAT:
+        set_meta(con, table_name, 'unit', unit)
+        scaled = np.rint(values * COMPACT_SCALE).astype(np.int64).tolist()
+        rows = list(zip(keys, scaled))
+        query = f'''
+        INSERT INTO {table_name} (time, energy_consumption) VALUES (?, ?)
+        ON CONFLICT (time) DO UPDATE SET
+            energy_consumption = excluded.energy_consumption
+        WHERE energy_consumption != excluded.energy_consumption
+        '''
+    else:
+        rows = list(zip(keys, values.tolist(), itertools.repeat(unit)))
+        query = f'''
+        INSERT INTO {table_name} (time, energy_consumption, unit) VALUES (?, ?, ?)
+        ON CONFLICT (time) DO UPDATE SET
+            energy_consumption = excluded.energy_consumption,
+            unit = excluded.unit
+        WHERE energy_consumption IS NOT excluded.energy_consumption
+            OR unit IS NOT excluded.unit
+        '''
+    count_query = f'SELECT COUNT(*) FROM {table_name} WHERE time BETWEEN ? AND ?'
+    bounds = (min(keys), max(keys))
+    before = con.execute(count_query, bounds).fetchone()[0]
+    cur = con.executemany(query, rows)
+    inserted = con.execute(count_query, bounds).fetchone()[0] - before
+    return inserted, cur.rowcount - inserted
+
+
+def bulk_load(
+    con: sql.Connection,
+    table_name: str,
+    chunks,
+    default_format: str = TEXT_FORMAT,
+) -> tuple:
+    """
+    Merge (times, values, units) chunks into the table, the caller commits.
+    The rows are appended to a temporary table without any index first. The
+    table and its unique key on time are then updated once, in time order,
+    instead of once per row. Of several values of a time the last one wins.
+    Returns the number of rows read, inserted and updated.
+    """
+    ensure_table(con, table_name, default_format)
+    fmt = storage_format(con)
+    con.execute(f'DROP TABLE IF EXISTS temp.{IMPORT_TABLE}')
+    con.execute(f'CREATE TEMP TABLE {IMPORT_TABLE} (time, energy_consumption, unit)')
+    rows, unit = 0, None
+    for times, values, units in chunks:
+        if not len(times):
+            continue
+        if fmt == COMPACT_FORMAT:
+            values = np.rint(values * COMPACT_SCALE).astype(np.int64)
+        unit = units if isinstance(units, str) else units[-1]
+        con.executemany(
+            f'INSERT INTO temp.{IMPORT_TABLE} VALUES (?, ?, ?)',
+            zip(
+                encode_times(fmt, times),
+                values.tolist(),
+                itertools.repeat(units) if isinstance(units, str) else units,
+            ),
+        )
+        rows += len(times)
+
+    if fmt == COMPACT_FORMAT:
+        set_meta(con, table_name, 'unit', unit)
+        columns = 'time, energy_consumption'
+        update = '''
+            energy_consumption = excluded.energy_consumption
+            WHERE energy_consumption != excluded.energy_consumption
+        '''
+    else:
+        columns = 'time, energy_consumption, unit'
+        update = '''
+            energy_consumption = excluded.energy_consumption,
+            unit = excluded.unit
+            WHERE energy_consumption IS NOT excluded.energy_consumption
+                OR unit IS NOT excluded.unit
+        '''
+    count_query = f'SELECT COUNT(*) FROM {table_name}'
+    before = con.execute(count_query).fetchone()[0]
+    changes = con.total_changes
+    # The values of MAX(rowid)'s row are the last ones read per time
+    con.execute(f'''
+        INSERT INTO {table_name} ({columns})
+        SELECT {columns}
+        FROM (
+            SELECT time, energy_consumption, unit, MAX(rowid)
+            FROM temp.{IMPORT_TABLE}
+            GROUP BY time
+        )
+        WHERE true
+        ORDER BY time
+        ON CONFLICT (time) DO UPDATE SET {update}
+        ''')
+    inserted = con.execute(count_query).fetchone()[0] - before
+    updated = con.total_changes - changes - inserted
+    con.execute(f'DROP TABLE temp.{IMPORT_TABLE}')
+    return rows, inserted, updated
+
+
+def ensure_rollup_table(con: sql.Connection):
+    con.execute(f'''
+        CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            table_name TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (table_name, bucket)
+        )
+        ''')
+
+
+def rebuild_rollup(con: sql.Connection, table_name: str, granularity: str):
+    # Full scan of the table, only needed once or to repair the rollup
+    ensure_rollup_table(con)
+    con.execute(f'DELETE FROM {ROLLUP_TABLE} WHERE table_name = ?', (table_name,))
+    if table_exists(con, table_name):
+        time, value = 'time', 'energy_consumption'
+        if storage_format(con) == COMPACT_FORMAT:
+            time = "time, 'unixepoch'"
+            value = f'energy_consumption * 1.0 / {COMPACT_SCALE}'
+        con.execute(
+            f'''
+            INSERT INTO {ROLLUP_TABLE} (table_name, bucket, total, count)
+            SELECT ?, strftime(?, {time}), SUM({value}), COUNT(*)
+            FROM {table_name}
+            WHERE energy_consumption IS NOT NULL
+            GROUP BY 2
+            ''',
+            (table_name, ROLLUP_BUCKETS[granularity]),
+        )
+    set_meta(con, table_name, 'rollup', 1)
+
+
+def rollup_buckets(times: np.ndarray, granularity: str) -> np.ndarray:
+    # Integer bucket per timestamp, matching strftime(ROLLUP_BUCKETS[granularity])
+    seconds = times.astype('M8[s]').astype(np.int64)
+    if granularity == 'minute':
+        return seconds // 60 % (24 * 60)
+    if granularity == 'hour':
+        return seconds // 3600 % 24
+    # 1970-01-01 was a Thursday (%w = 4)
+    return (seconds // 86400 + 4) % 7
+
+
+def _bucket_label(bucket: int, granularity: str) -> str:
+    if granularity == 'minute':
+        return '{:02d}:{:02d}'.format(*divmod(bucket, 60))
+    if granularity == 'hour':
+        return '{:02d}'.format(bucket)
+    return str(bucket)
+
+
+def update_rollup(
+    con: sql.Connection,
+    table_name: str,
+    granularity: str,
+    times: np.ndarray,
+    values: np.ndarray,
+):
+    """
+    Add a batch to the rollup before it is merged into the table. Values
+    replacing stored ones only add their difference to the bucket total.
+    """
+    if not get_meta(con, table_name, 'rollup'):
+        rebuild_rollup(con, table_name, granularity)
+    # Within the batch the last value per timestamp wins, as in the merge
+    _, last = np.unique(times[::-1], return_index=True)
+    keep = len(times) - 1 - last
+    times, values = times[keep], values[keep]
+    fmt = storage_format(con)
+    keys = encode_times(fmt, times)
+    old = dict(
+        con.execute(
+            f'''
+            SELECT time, energy_consumption
+            FROM {table_name}
+            WHERE time BETWEEN ? AND ?
+            ''',
+            (keys[0], keys[-1]),
+        ).fetchall()
+    )
+    old_values = np.array([old.get(key, np.nan) for key in keys], dtype=float)
+    if fmt == COMPACT_FORMAT:
+        old_values /= COMPACT_SCALE
+        values = np.rint(values * COMPACT_SCALE) / COMPACT_SCALE
+    is_new = np.isnan(old_values)
+    deltas = values - np.where(is_new, 0, old_values)
+
+    add_to_rollup(con, table_name, granularity, times, deltas, is_new)
+
+
+def add_to_rollup(
+    con: sql.Connection,
+    table_name: str,
+    granularity: str,
+    times: np.ndarray,
+    totals: np.ndarray,
+    counts: np.ndarray,
+):
+    # Sum the totals and counts per bucket and add them to the rollup
+    buckets, inverse = np.unique(
+        rollup_buckets(times, granularity), return_inverse=True
+    )
+    totals = np.bincount(inverse, weights=totals, minlength=len(buckets))
+    counts = np.bincount(inverse, weights=counts, minlength=len(buckets))
+    changed = (totals != 0) | (counts != 0)
+    con.executemany(
+        f'''
+        INSERT INTO {ROLLUP_TABLE} (table_name, bucket, total, count)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (table_name, bucket) DO UPDATE SET
+            total = total + excluded.total,
+            count = count + excluded.count
+        ''',
+        [
+            (table_name, _bucket_label(bucket, granularity), total, int(count))
+            for bucket, total, count in zip(
+                buckets[changed].tolist(),
+                totals[changed].tolist(),
+                counts[changed].tolist(),
+            )
+        ],
+    )
@@ -0,0 +1,269 @@
+import math
+import numpy as np
+import sqlite3 as sql
+from datetime import datetime, timedelta
+from helpers import storage
+from helpers.archive import Archive
+
+# Figures of the summary cards, one row per hour table of a (device) page
+SUMMARY_TABLE = storage.SUMMARY_TABLE
+FIGURES = ('last_24h', 'last_24h_avg', 'last_30d', 'month_avg', 'last_365d')
+FIGURE_COLUMNS = ', '.join(FIGURES)
+# Hour table of each page with summary cards and the day table it uses
+SOURCES = {'youless_hour': 'youless_day', 'youless_hour_gas': 'youless_day_gas'}
+EMPTY_ROW = 'NULL AS time, NULL AS energy_consumption, NULL AS unit'
+# Months in the monthly average, the current month included
+MONTHS = 12
+
+SUMMARY_QUERY = '''
+    WITH hour_rows AS (
+        SELECT time, energy_consumption
+        FROM (
+            SELECT {hour_table_columns}
+            FROM {hour_table}
+            WHERE time >= :since_hour
+        )
+        ORDER BY time DESC
+        LIMIT 24
+    ), day_rows AS (
+        SELECT {day_table_columns}
+        FROM {day_table}
+        WHERE time >= :since_day
+        UNION ALL
+        -- Current day from the hour data
+        SELECT
+            strftime('%Y-%m-%d 00:00:00', time),
+            SUM(energy_consumption) / 1000,
+            'kWh'
+        FROM (
+            SELECT {hour_table_columns}
+            FROM {hour_table}
+            WHERE time >= :today
+        )
+        GROUP BY 1
+    ), newest_days AS (
+        SELECT energy_consumption, ROW_NUMBER() OVER (ORDER BY time DESC) AS n
+        FROM day_rows
+    ), months AS (
+        SELECT SUM(energy_consumption) AS energy_consumption
+        FROM (
+            SELECT {day_table_columns}
+            FROM {day_table}
+            WHERE time >= :since_month
+        )
+        GROUP BY strftime('%Y-%m', time)
+        ORDER BY strftime('%Y-%m', time) DESC
+        LIMIT :months
+    )
+
+    SELECT
+        COALESCE((SELECT SUM(energy_consumption) FROM hour_rows), 0) / 1000,
+        COALESCE((
+            SELECT SUM(total / count)
+            FROM hour_rows
+            JOIN {rollup_table}
+                ON table_name = :hour_table AND bucket = strftime('%H', time)
+        ), 0) / 1000,
+        COALESCE((SELECT SUM(energy_consumption) FROM newest_days WHERE n <= 30), 0),
+        (SELECT AVG(energy_consumption) FROM months),
+        COALESCE((SELECT SUM(energy_consumption) FROM newest_days WHERE n <= 365), 0)
+'''
+
+
+def source_of(table_name: str):
+    """
+    (hour table, day table) of the summary a table is part of, with the same
+    device suffix. None for tables without a summary.
+    """
+    base, separator, device = table_name.partition('__')
+    for hour_table, day_table in SOURCES.items():
+        if base in (hour_table, day_table):
+            return hour_table + separator + device, day_table + separator + device
+    return None
+
+
+def windows(now: datetime) -> dict:
+    # Start of each window, as used by the dashboard queries
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    today = hour.replace(hour=0)
+    year, month = divmod(now.year * 12 + now.month - MONTHS, 12)
+    return {
+        'since_hour': hour - timedelta(hours=23),
+        'today': today,
+        'since_day': today - timedelta(days=364),
+        'since_month': datetime(year, month + 1, 1),
+    }
+
+
+def ensure_summary_table(con: sql.Connection):
+    columns = ', '.join(f'{figure} REAL' for figure in FIGURES)
+    con.execute(f'''
+        CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+            source TEXT PRIMARY KEY,
+            updated TEXT NOT NULL,
+            {columns}
+        )
+        ''')
+
+
+def summary_query(con: sql.Connection, hour_table: str, day_table: str) -> str:
+    # Tables which were not stored yet count as empty
+    fmt = storage.storage_format(con)
+    sources = {}
+    for key, table_name in (('hour_table', hour_table), ('day_table', day_table)):
+        if storage.table_exists(con, table_name):
+            sources[key] = table_name
+            sources[f'{key}_columns'] = storage.column_sql(fmt, table_name)
+        else:
+            sources[key] = f'(SELECT {EMPTY_ROW} LIMIT 0)'
+            sources[f'{key}_columns'] = '*'
+    return SUMMARY_QUERY.format(**sources, rollup_table=storage.ROLLUP_TABLE)
+
+
+def summary_params(con: sql.Connection, hour_table: str, now: datetime) -> dict:
+    fmt = storage.storage_format(con)
+    return {
+        **{key: storage.encode_time(fmt, value) for key, value in windows(now).items()},
+        'hour_table': hour_table,
+        'months': MONTHS,
+    }
+
+
+def compute_summary(
+    con: sql.Connection, hour_table: str, day_table: str, now: datetime
+) -> dict:
+    # The figures from the rows within the windows, found through the indexes
+    storage.ensure_rollup_table(con)
+    row = con.execute(
+        summary_query(con, hour_table, day_table),
+        summary_params(con, hour_table, now),
+    ).fetchone()
+    return dict(zip(FIGURES, row))
+
+
+def update_summary(con: sql.Connection, table_name: str, now: datetime = None):
+    """
+    Recompute the summary a table is part of after storing into it, the
+    caller commits. The windows are small, so this reads at most a year of
+    days and a day of hours.
+    """
+    tables = source_of(table_name)
+    if tables is None:
+        return
+    now = now or datetime.now()
+    figures = compute_summary(con, *tables, now)
+    ensure_summary_table(con)
+    con.execute(
+        f'''
+        INSERT OR REPLACE INTO {SUMMARY_TABLE} (source, updated, {FIGURE_COLUMNS})
+        VALUES (?, ?, {', '.join('?' * len(FIGURES))})
+        ''',
+        (tables[0], now.strftime(storage.TIME_FORMAT), *figures.values()),
+    )
+    storage.bump_version(con, SUMMARY_TABLE)
+
+
+def _all_rows(con: sql.Connection, table_name: str) -> tuple:
+    # Every row of a table as (datetime64 times, values)
+    if not storage.table_exists(con, table_name):
+        return np.array([], dtype='M8[s]'), np.array([])
+    rows = con.execute(
+        f'SELECT {storage.raw_column_sql(storage.storage_format(con))} '
+        f'FROM {table_name}'
+    ).fetchall()
+    rows = np.array(rows, dtype=float).reshape(-1, 2)
+    return rows[:, 0].astype(np.int64).astype('M8[s]'), rows[:, 1]
+
+
+def _hourly_averages(con, hour_table: str, archive: Archive = None) -> tuple:
+    # Total and count per hour of the day over the table and its archive
+    times, values = _all_rows(con, hour_table)
+    if archive is not None:
+        for month in archive.months(hour_table):
+            archived_times, archived_values, _ = archive.read_month(hour_table, month)
+            times = np.concatenate([times, archived_times.astype('M8[s]')])
+            values = np.concatenate([values, archived_values])
+        # Hours in the table and the archive count once, with the table's value
+        times, first = np.unique(times, return_index=True)
+        values = values[first]
+    buckets = storage.rollup_buckets(times, 'hour')
+    return (
+        np.bincount(buckets, weights=values, minlength=24),
+        np.bincount(buckets, minlength=24),
+    )
+
+
+def recompute_summary(
+    con: sql.Connection,
+    hour_table: str,
+    day_table: str,
+    now: datetime,
+    archive: Archive = None,
+) -> dict:
+    """
+    The figures from full table scans in NumPy, independent of the SQL and
+    of the rollup. The hourly averages include the archived hours.
+    """
+    w = {key: np.datetime64(value, 's') for key, value in windows(now).items()}
+    hour_times, hour_values = _all_rows(con, hour_table)
+    day_times, day_values = _all_rows(con, day_table)
+
+    recent = hour_times >= w['since_hour']
+    newest = np.argsort(hour_times[recent], kind='stable')[::-1][:24]
+    times, values = hour_times[recent][newest], hour_values[recent][newest]
+    totals, counts = _hourly_averages(con, hour_table, archive)
+    buckets = storage.rollup_buckets(times, 'hour')
+    buckets = buckets[counts[buckets] > 0]
+    last_24h = values.sum() / 1000
+    last_24h_avg = (totals[buckets] / counts[buckets]).sum() / 1000
+
+    recent = day_times >= w['since_day']
+    times, values = day_times[recent], day_values[recent]
+    today = hour_times >= w['today']
+    if today.any():
+        times = np.append(times, w['today'])
+        values = np.append(values, hour_values[today].sum() / 1000)
+    days = values[np.argsort(times, kind='stable')[::-1]]
+
+    recent = day_times >= w['since_month']
+    _, inverse = np.unique(day_times[recent].astype('M8[M]'), return_inverse=True)
+    months = np.bincount(inverse, weights=day_values[recent])[-MONTHS:]
+
+    return {
+        'last_24h': last_24h,
+        'last_24h_avg': last_24h_avg,
+        'last_30d': days[:30].sum(),
+        'month_avg': months.mean() if len(months) else None,
+        'last_365d': days[:365].sum(),
+    }
+
+
+def verify_summary(
+    con: sql.Connection, archive: Archive = None, rel_tol: float = 1e-9
+) -> list:
+    """
+    Compare every stored summary with a full recomputation at the time it was
+    stored. Returns (source, figure, stored, recomputed) per mismatch.
+    """
+    if not storage.table_exists(con, SUMMARY_TABLE):
+        return []
+    rows = con.execute(
+        f'SELECT source, updated, {FIGURE_COLUMNS} FROM {SUMMARY_TABLE}'
+    ).fetchall()
+    mismatches = []
+    for source, updated, *stored in rows:
+        recomputed = recompute_summary(
+            con,
+            *source_of(source),
+            datetime.strptime(updated, storage.TIME_FORMAT),
+            archive,
+        )
+        for figure, value in zip(FIGURES, stored):
+            expected = recomputed[figure]
+            if value is None or expected is None:
+                equal = value is None and expected is None
+            else:
+                equal = math.isclose(value, expected, rel_tol=rel_tol, abs_tol=1e-9)
+            if not equal:
+                mismatches.append((source, figure, value, expected))
+    return mismatches
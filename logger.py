@@ -1,10 +1,44 @@
+import argparse
+import fcntl
 import requests
 import logging
+import signal
+import sys
+import threading
+import time
 import sqlite3 as sql
-import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from config import DB_PATH, GAS_ENABLED
-
+from requests.adapters import HTTPAdapter
+from config import (
+    ARCHIVE_PATH,
+    BREAKER_FAILURES,
+    BREAKER_SECONDS,
+    DAEMON_INTERVALS,
+    DB_PATH,
+    DEVICE_WORKERS,
+    FETCH_BACKOFF,
+    FETCH_OVERLAP,
+    FETCH_RETRIES,
+    FETCH_TIMEOUT,
+    FETCH_WORKERS,
+    HOST,
+    LOCK_PATH,
+    METRICS_PATH,
+    RETENTION_DAYS,
+    RUN_TIMEOUT,
+    SAMPLER_BUFFER_SECONDS,
+    SAMPLER_ENABLED,
+    SAMPLER_FLUSH_SECONDS,
+    SAMPLER_INTERVAL,
+    STORAGE_FORMAT,
+)
+from helpers import archive, backfill, export, retry, storage, summary
+from helpers.devices import DEVICE_LIST, Device
+from helpers.metrics import REGISTRY
+from helpers.ringbuffer import RingBuffer
 
 logging.basicConfig(
     format='%(name)s: %(asctime)s %(levelname)s %(message)s',
@@ -13,6 +47,135 @@ logging.basicConfig(
 )
 
 
+def create_session(pool_size: int) -> requests.Session:
+    # All scrapers of a device talk to the same host, so one keep-alive pool
+    # per device is enough
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = create_session(FETCH_WORKERS)
+SESSIONS = {HOST: SESSION}
+SESSIONS_LOCK = threading.Lock()
+
+
+def device_session(host: str) -> requests.Session:
+    with SESSIONS_LOCK:
+        if host not in SESSIONS:
+            SESSIONS[host] = create_session(FETCH_WORKERS)
+        return SESSIONS[host]
+
+
+FETCH_SECONDS = REGISTRY.histogram(
+    'youless_fetch_page_seconds', 'Time to fetch one report page', ('table',)
+)
+FETCH_REQUESTS = REGISTRY.counter(
+    'youless_fetch_requests_total', 'Report pages requested', ('table', 'status')
+)
+SCRAPE_SECONDS = REGISTRY.histogram(
+    'youless_scrape_seconds', 'Duration of a complete fetch of a table', ('table',)
+)
+JOB_ERRORS = REGISTRY.counter(
+    'youless_job_errors_total', 'Failed runs', ('job', 'device')
+)
+LAST_SUCCESS = REGISTRY.gauge(
+    'youless_last_success_timestamp_seconds',
+    'Unix time of the last successful run',
+    ('table',),
+)
+CONVERT_SECONDS = REGISTRY.histogram(
+    'youless_convert_seconds', 'Time to convert the fetched pages', ('table',)
+)
+STORE_SECONDS = REGISTRY.histogram(
+    'youless_store_seconds', 'Time to store a batch', ('table', 'step')
+)
+ROWS_WRITTEN = REGISTRY.counter(
+    'youless_rows_written_total', 'Rows written to the database', ('table', 'operation')
+)
+SAMPLES = REGISTRY.counter(
+    'youless_samples_total', 'Live power readings', ('device', 'status')
+)
+BREAKER_SKIPS = REGISTRY.counter(
+    'youless_breaker_skips_total', 'Runs skipped after repeated failures', ('table',)
+)
+BREAKER = retry.CircuitBreaker(BREAKER_FAILURES, BREAKER_SECONDS)
+
+
+def write_metrics():
+    # For the textfile collector of node_exporter or any other file scraper
+    if METRICS_PATH:
+        REGISTRY.write(METRICS_PATH)
+
+
+@contextmanager
+def connection():
+    # A connection of this thread for reads, a running transaction does not
+    # block it
+    yield storage.thread_connection(DB_PATH)
+
+
+@contextmanager
+def write_connection():
+    # The shared connection of the process, for this thread only
+    with storage.WRITE_LOCK:
+        yield storage.shared_connection(DB_PATH)
+
+
+@contextmanager
+def transaction(table: str = '*'):
+    """
+    The shared connection in one transaction, committed at the end or rolled
+    back on an exception. `table` labels the commit timing.
+    """
+    with write_connection() as con:
+        # Take the write lock of the database right away, instead of failing
+        # on a reader's lock when the first row is written
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            yield con
+        except BaseException:
+            con.rollback()
+            raise
+        with STORE_SECONDS.time(table=table, step='commit'):
+            con.commit()
+
+
+class AlreadyRunning(Exception):
+    pass
+
+
+def run_lock(path: str = None):
+    """
+    Exclusive lock for fetching, held as long as the returned file is open.
+    Raises AlreadyRunning when another process holds it. The lock is released
+    with the process, also when it is killed.
+    """
+    f = open(path or LOCK_PATH, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise AlreadyRunning(f'{f.name} is locked by another run') from None
+    return f
+
+
+class PartialFetchError(Exception):
+    """
+    A report page could not be fetched. `pages` holds the pages which were,
+    in page order.
+    """
+
+    def __init__(self, pages: list, error: Exception):
+        super().__init__(f'Fetched {len(pages)} report pages, then: {error!r}')
+        self.pages = pages
+
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
 class YoulessBaseLogger:
     GRANULARITY_MAP = {
         'minute': {'param': 'h', 'reports': 20},
@@ -24,16 +187,31 @@ class YoulessBaseLogger:
     report_param = None
     report_pages = None
     table_name = None
-    chart_data = pd.DataFrame()
-    endpoint = 'http://192.168.1.14/'
+    device = None
+    host = HOST
+    session = SESSION
+    fetch_workers = FETCH_WORKERS
+    timeout = FETCH_TIMEOUT
+    retries = FETCH_RETRIES
+    backoff = FETCH_BACKOFF
+    # Seconds between two runs in daemon mode
+    interval = None
     default_params = {'f': 'j'}  # JSON response format,
 
-    def __init__(self):
+    def __init__(self, device: Device = None):
         self.report_param = self.GRANULARITY_MAP[self.granularity]['param']
         self.report_pages = self.GRANULARITY_MAP[self.granularity]['reports']
-        self.logger = logging.getLogger(
-            'Youless Scraper {}'.format(self.__class__.__name__)
-        )
+        self.interval = DAEMON_INTERVALS.get(self.table_name, self.interval)
+        name = self.__class__.__name__
+        if device is not None:
+            self.device = device
+            self.host = device.host
+            self.session = device_session(device.host)
+            self.timeout = device.timeout
+            self.table_name = device.table(self.table_name)
+            if device.name:
+                name = '{} {}'.format(name, device.name)
+        self.logger = logging.getLogger('Youless Scraper {}'.format(name))
 
     @property
     def youless_path(self) -> str:
@@ -55,150 +233,841 @@ class YoulessBaseLogger:
 
     @property
     def endpoint(self) -> str:
-        return f'http://192.168.1.14/{self.youless_path}'
+        return f'{self.host}{self.youless_path}'
+
+    def request_page(self, page: int, timeout: float) -> dict:
+        with FETCH_SECONDS.time(table=self.table_name):
+            try:
+                response = self.session.get(
+                    self.endpoint,
+                    params={**self.default_params, self.report_param: page},
+                    timeout=timeout,
+                )
+                response.raise_for_status()
+                data = response.json()
+            except Exception:
+                FETCH_REQUESTS.inc(table=self.table_name, status='error')
+                raise
+        FETCH_REQUESTS.inc(table=self.table_name, status='ok')
+        return data
 
-    def fetch_data(self):
-        self.logger.info('Fetching new data for {} reports'.format(self.report_pages))
+    def fetch_page(self, page: int, deadline: float = None) -> dict:
+        # Retried with backoff, no longer than until the deadline of the run
+        return retry.call_with_retries(
+            lambda timeout: self.request_page(page, timeout),
+            self.timeout,
+            self.retries,
+            self.backoff,
+            deadline,
+        )
+
+    def fetch_pages(self, pages: list, deadline: float = None) -> list:
+        """
+        Results in the order of the requested pages. When a page fails for
+        good the pages which were not requested yet are given up and a
+        PartialFetchError with the fetched ones is raised.
+        """
+        workers = min(self.fetch_workers, len(pages))
+        res, error = [], None
+        if workers <= 1:
+            for page in pages:
+                try:
+                    res.append(self.fetch_page(page, deadline))
+                except Exception as e:
+                    error = e
+                    break
+        else:
+            failed = threading.Event()
+
+            def fetch(page: int):
+                if failed.is_set():
+                    return None
+                try:
+                    return self.fetch_page(page, deadline)
+                except Exception:
+                    failed.set()
+                    raise
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(fetch, page) for page in pages]:
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if data is not None:
+                        res.append(data)
+        if error is not None:
+            raise PartialFetchError(res, error) from error
+        return res
+
+    def fetch_pages_since(self, since: datetime, deadline: float = None) -> list:
+        # Page 1 holds the newest values. Fetch in growing waves (1, 2, 4, ...
+        # pages) and stop at the first page that reaches back to `since`.
         res = []
-        for page in range(self.report_pages):
-            data = requests.get(
-                self.endpoint,
-                params={**self.default_params, self.report_param: page + 1},
+        pages = list(range(1, self.report_pages + 1))
+        wave = 1
+        while pages:
+            batch, pages = pages[:wave], pages[wave:]
+            try:
+                fetched = self.fetch_pages(batch, deadline)
+            except PartialFetchError as e:
+                raise PartialFetchError(res + e.pages, e.__cause__) from e.__cause__
+            for data in fetched:
+                res.append(data)
+                if datetime.strptime(data['tm'], TIME_FORMAT) <= since:
+                    return res
+            wave = min(wave * 2, max(self.fetch_workers, 1))
+        return res
+
+    def fetch_since(self):
+        high_water_mark = self.high_water_mark()
+        if high_water_mark is None:
+            return None
+        return datetime.strptime(high_water_mark, storage.TIME_FORMAT) - timedelta(
+            seconds=FETCH_OVERLAP
+        )
+
+    def fetch_data(self, full_scan: bool = False, deadline: float = None):
+        try:
+            batch = self.collect(full_scan, deadline)
+        except PartialFetchError as e:
+            self.store_data(*self.convert_pages(e.pages), complete=False)
+            raise
+        self.store_data(*batch)
+        LAST_SUCCESS.set(time.time(), table=self.table_name)
+
+    def collect(self, full_scan: bool = False, deadline: float = None) -> tuple:
+        # New data of the device as (times, values, unit), not stored yet
+        with SCRAPE_SECONDS.time(table=self.table_name):
+            return self._collect(full_scan, deadline)
+
+    def _collect(self, full_scan: bool, deadline: float = None) -> tuple:
+        since = None if full_scan else self.fetch_since()
+        if since is None:
+            self.logger.info(
+                'Fetching new data for {} reports'.format(self.report_pages)
             )
-            res += YoulessBaseLogger.convert_data(data.json())
-        self.logger.info('Received {} entries'.format(len(res)))
-        self.store_data(pd.DataFrame(res))
+            pages = self.fetch_pages(list(range(1, self.report_pages + 1)), deadline)
+        else:
+            self.logger.info('Fetching new data since {}'.format(since))
+            pages = self.fetch_pages_since(since, deadline)
+        self.logger.info('Fetched {} reports'.format(len(pages)))
+        return self.convert_pages(pages)
+
+    def convert_pages(self, pages: list) -> tuple:
+        with CONVERT_SECONDS.time(table=self.table_name):
+            columns = [YoulessBaseLogger.convert_columns(data) for data in pages]
+            times = np.concatenate([c[0] for c in columns] or [np.array([], 'M8[s]')])
+            values = np.concatenate([c[1] for c in columns] or [np.array([])])
+            unit = columns[0][2] if columns else None
+        self.logger.info('Received {} entries'.format(len(times)))
+        return times, values, unit
+
+    def run(self, full_scan: bool = False):
+        self.fetch_data(full_scan=full_scan)
 
     @staticmethod
-    def convert_data(data: dict) -> list:
-        res = []
-        time_format = '%Y-%m-%dT%H:%M:%S'
-        timestamp = datetime.strptime(data['tm'], time_format)
-        for val in data['val']:
-            if val and val != '*':
-                res.append(
-                    {
-                        'time': timestamp,
-                        'energy_consumption': float(val.replace(',', '.')),
-                        'unit': data['un'],
-                    }
-                )
-            timestamp += timedelta(seconds=data['dt'])
+    def convert_columns(data: dict) -> tuple:
+        """
+        Convert one report page to a (times, values, unit) tuple of NumPy
+        arrays. Missing values ('*' or empty) are left out.
+        """
+        values = np.char.strip(np.asarray(data['val'], dtype=str))
+        steps = np.arange(len(values)) * np.timedelta64(data['dt'], 's')
+        times = np.datetime64(data['tm'], 's') + steps
+        mask = (values != '*') & (values != '')
+        values = np.char.replace(values[mask], ',', '.').astype(float)
+        return times[mask], values, data['un']
 
-        return res
+    @staticmethod
+    def convert_data(data: dict) -> list:
+        times, values, unit = YoulessBaseLogger.convert_columns(data)
+        return [
+            {'time': timestamp, 'energy_consumption': value, 'unit': unit}
+            for timestamp, value in zip(times.astype(datetime), values.tolist())
+        ]
 
     def table_exists(self) -> bool:
-        query = '''
-        SELECT name 
-        FROM sqlite_master 
-        WHERE 
-            type='table'
-            AND name='{table_name}'; 
-        '''
-
-        with sql.connect(DB_PATH) as con:
-            cur = con.cursor()
-            listOfTables = cur.execute(
-                query.format(table_name=self.table_name)
-            ).fetchall()
-        return len(listOfTables) > 0
-
-    def store_data(self, df):
-        if df.empty:
+        with connection() as con:
+            return storage.table_exists(con, self.table_name)
+
+    def high_water_mark(self):
+        # Newest timestamp stored for this table, as stored by SQLite
+        with connection() as con:
+            mark = storage.get_meta(con, self.table_name, 'high_water_mark')
+            if mark is None and self.table_exists():
+                # Databases created before the mark was recorded
+                mark = storage.max_time(con, self.table_name)
+        return mark
+
+    def store_data(
+        self, times: np.ndarray, values: np.ndarray, unit: str, complete: bool = True
+    ):
+        # In a transaction of its own, `run_jobs` stores all scrapers in one
+        if not len(times):
             self.logger.info('No data to be stored')
             return
-        with sql.connect(DB_PATH) as con:
-            if not self.table_exists():
+        with transaction(self.table_name) as con:
+            self.store_batch(con, times, values, unit, complete)
+
+    def store_batch(
+        self,
+        con: sql.Connection,
+        times: np.ndarray,
+        values: np.ndarray,
+        unit: str,
+        complete: bool = True,
+    ):
+        """
+        Merge into the table, the caller commits. The high-water mark stays
+        where it is for an incomplete fetch, so the next run fetches the
+        missing pages again. Rows within the archived range are skipped.
+        """
+        times, values = archive.unarchived(con, self.table_name, times, values)
+        if not len(times):
+            self.logger.info('No data to be stored')
+            return
+        with STORE_SECONDS.time(table=self.table_name, step='merge'):
+            if not storage.table_exists(con, self.table_name):
                 self.logger.warning(
                     f'Table {self.table_name} does not exist. Creating...'
                 )
-                # Just upload all data and create the table
-                df.to_sql(self.table_name, con, index=False)
-                value_count = len(df)
-            else:
-                # Store to temporary db
-                df.to_sql('tmp', con, if_exists='replace', index=False)
-
-                # Update existing data
-                query = '''
-                UPDATE {table_name} AS old
-                SET energy_consumption = (
-                    SELECT energy_consumption
-                    FROM tmp
-                    WHERE time = old.time
-                    LIMIT 1
-                ) 
-                WHERE EXISTS (
-                    SELECT energy_consumption
-                    FROM tmp
-                    WHERE time = old.time
-                )
-                '''
-
-                cur = con.cursor()
-                cur.execute(query.format(table_name=self.table_name))
-                con.commit()
-                self.logger.info('Updated {} old values'.format(cur.rowcount))
-
-                # Store new data
-                query = '''
-                INSERT INTO {table_name} (time, energy_consumption, unit)
-                SELECT time, energy_consumption, unit
-                FROM tmp AS new
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM {table_name} old 
-                    WHERE old.time = new.time
-                );
-                '''
-
-                cur = con.cursor()
-                cur.execute(query.format(table_name=self.table_name))
-                con.commit()
-                value_count = cur.rowcount
+            storage.ensure_table(con, self.table_name, STORAGE_FORMAT)
+            storage.update_rollup(con, self.table_name, self.granularity, times, values)
+            inserted, updated = storage.upsert(
+                con, self.table_name, times, values, unit
+            )
+            self.logger.info('Updated {} old values'.format(updated))
+            self.logger.info('Uploaded {} new values'.format(inserted))
+            if inserted or updated:
+                storage.bump_version(con, self.table_name)
 
-            self.logger.info('Uploaded {} new values'.format(value_count))
+            if complete:
+                storage.raise_meta(
+                    con,
+                    self.table_name,
+                    'high_water_mark',
+                    storage.format_times(times.max(keepdims=True))[0],
+                )
+        with STORE_SECONDS.time(table=self.table_name, step='summary'):
+            summary.update_summary(con, self.table_name)
+        ROWS_WRITTEN.inc(inserted, table=self.table_name, operation='inserted')
+        ROWS_WRITTEN.inc(updated, table=self.table_name, operation='updated')
 
 
 class YoulessEnergyMinute(YoulessBaseLogger):
     youless_path = 'V'
     table_name = 'youless_minute'
     granularity = 'minute'
+    interval = 60
 
 
 class YoulessEnergyHour(YoulessBaseLogger):
     youless_path = 'V'
     table_name = 'youless_hour'
     granularity = 'hour'
+    interval = 60 * 60
 
 
 class YoulessEnergyDay(YoulessBaseLogger):
     youless_path = 'V'
     table_name = 'youless_day'
     granularity = 'day'
+    interval = 6 * 60 * 60
 
 
 class YoulessGasHour(YoulessBaseLogger):
     youless_path = 'W'
     table_name = 'youless_hour_gas'
     granularity = 'hour'
+    interval = 6 * 60 * 60
 
 
 class YoulessGasDay(YoulessBaseLogger):
     youless_path = 'W'
     table_name = 'youless_day_gas'
     granularity = 'day'
+    interval = 6 * 60 * 60
+
+
+SCRAPERS = [
+    YoulessEnergyMinute,
+    YoulessEnergyHour,
+    YoulessEnergyDay,
+    YoulessGasHour,
+    YoulessGasDay,
+]
+
+
+class YoulessArchiver:
+    """
+    Moves data older than the configured retention out of the database into
+    the archive, see `helpers.archive`.
+    """
+
+    interval = DAEMON_INTERVALS.get('archive', 24 * 60 * 60)
+    # Seconds between two runs of the daemon while older months are waiting,
+    # it archives one month per table and run
+    catch_up_interval = 60
+
+    def __init__(
+        self,
+        retention_days: dict = None,
+        archive_path: str = ARCHIVE_PATH,
+        devices: list = None,
+    ):
+        self.retention_days = (
+            RETENTION_DAYS if retention_days is None else retention_days
+        )
+        self.archive = archive.Archive(archive_path)
+        self.devices = DEVICE_LIST if devices is None else devices
+        # Whether the last run left older months behind
+        self.pending = False
+        self.logger = logging.getLogger('Youless Archiver')
+
+    def archive_data(self, now: datetime = None, max_months: int = None) -> dict:
+        """
+        The retention of a table applies to the table of every device. The
+        rows of a day are deleted in a transaction of their own, the write
+        lock is not held in between.
+        """
+        archived = {}
+        self.pending = False
+        with connection() as con:
+            for device in self.devices:
+                for base_name, days in self.retention_days.items():
+                    table_name = device.table(base_name)
+                    archived[table_name] = archive.archive_table(
+                        con,
+                        self.archive,
+                        table_name,
+                        days,
+                        now=now,
+                        max_months=max_months,
+                        transaction=lambda: transaction(table_name),
+                    )
+                    self.logger.info(
+                        'Archived {} rows of {}'.format(
+                            archived[table_name], table_name
+                        )
+                    )
+                    self.pending = self.pending or archive.archive_due(
+                        con, table_name, days, now
+                    )
+        return archived
+
+    def run(self, full_scan: bool = False):
+        self.archive_data(max_months=1)
+        self.interval = self.catch_up_interval if self.pending else type(self).interval
+
+
+class YoulessSampler:
+    """
+    Polls the live power reading of a device into a ring buffer in shared
+    memory, which the dashboard reads without touching the database. The
+    samples are written to the live table in one transaction every
+    `flush_interval` seconds. Raises AlreadyRunning when another sampler
+    writes to the same buffer.
+    """
+
+    youless_path = 'a'
+    default_params = {'f': 'j'}
+
+    def __init__(
+        self,
+        device: Device = None,
+        interval: float = SAMPLER_INTERVAL,
+        flush_interval: float = SAMPLER_FLUSH_SECONDS,
+        buffer_seconds: float = SAMPLER_BUFFER_SECONDS,
+        buffer_name: str = None,
+    ):
+        self.device = DEVICE_LIST[0] if device is None else device
+        self.table_name = self.device.table(storage.LIVE_TABLE)
+        buffer_name = buffer_name or self.table_name
+        # Held while writing, the buffer of a running sampler is never reclaimed
+        self.lock = run_lock('{}.{}'.format(LOCK_PATH, buffer_name))
+        try:
+            self.buffer = RingBuffer(
+                max(int(buffer_seconds / interval), 1), buffer_name
+            )
+        except BaseException:
+            self.lock.close()
+            raise
+        self.session = device_session(self.device.host)
+        self.interval = interval
+        self.flush_interval = flush_interval
+        # Buffer position up to which the samples are in the database
+        self.flushed = 0
+        name = 'Youless Sampler'
+        if self.device.name:
+            name = '{} {}'.format(name, self.device.name)
+        self.logger = logging.getLogger(name)
+
+    @property
+    def endpoint(self) -> str:
+        return f'{self.device.host}{self.youless_path}'
+
+    def sample(self, now: datetime = None) -> float:
+        now = datetime.now() if now is None else now
+        try:
+            response = self.session.get(
+                self.endpoint, params=self.default_params, timeout=self.device.timeout
+            )
+            power = float(response.json()['pwr'])
+        except Exception:
+            SAMPLES.inc(device=self.device.label, status='error')
+            raise
+        SAMPLES.inc(device=self.device.label, status='ok')
+        self.buffer.append([np.datetime64(now, 's').astype(np.int64)], [power])
+        return power
+
+    def flush(self) -> int:
+        # Samples stay in the buffer until they are committed, so a failed
+        # flush is retried with the next one
+        times, values, written = self.buffer.read(self.flushed)
+        if not len(times):
+            return 0
+        with transaction(self.table_name) as con:
+            with STORE_SECONDS.time(table=self.table_name, step='merge'):
+                storage.ensure_table(con, self.table_name, STORAGE_FORMAT)
+                inserted, updated = storage.upsert(
+                    con, self.table_name, times.astype('M8[s]'), values, 'Watt'
+                )
+                storage.bump_version(con, self.table_name)
+        self.flushed = written
+        ROWS_WRITTEN.inc(inserted, table=self.table_name, operation='inserted')
+        ROWS_WRITTEN.inc(updated, table=self.table_name, operation='updated')
+        return len(times)
+
+    def close(self):
+        try:
+            self.buffer.close(unlink=True)
+        finally:
+            self.lock.close()
+
+
+def run_sampler(sampler: YoulessSampler, stop: threading.Event):
+    """
+    Sample every `interval` seconds until `stop` is set, flush every
+    `flush_interval` seconds and once more before returning.
+    """
+    next_sample = time.monotonic()
+    next_flush = next_sample + sampler.flush_interval
+    try:
+        while not stop.is_set():
+            try:
+                sampler.sample()
+            except Exception:
+                JOB_ERRORS.inc(job=type(sampler).__name__, device=sampler.device.label)
+                sampler.logger.exception('Sampling failed')
+            now = time.monotonic()
+            if now >= next_flush:
+                next_flush = now + sampler.flush_interval
+                try:
+                    sampler.flush()
+                except Exception:
+                    sampler.logger.exception('Storing samples failed')
+            # Skip the samples a slow device made us miss instead of catching up
+            next_sample = max(next_sample + sampler.interval, now)
+            stop.wait(max(next_sample - time.monotonic(), 0))
+    finally:
+        try:
+            sampler.flush()
+        finally:
+            sampler.close()
+
+
+def create_samplers(devices: list = None) -> list:
+    samplers = []
+    try:
+        for device in DEVICE_LIST if devices is None else devices:
+            samplers.append(YoulessSampler(device))
+    except AlreadyRunning:
+        for sampler in samplers:
+            sampler.close()
+        raise
+    return samplers
+
+
+def start_samplers(samplers: list, stop: threading.Event) -> list:
+    threads = [
+        threading.Thread(target=run_sampler, args=(sampler, stop), daemon=True)
+        for sampler in samplers
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def rebuild_rollups(devices: list = None):
+    archived = archive.Archive(ARCHIVE_PATH)
+    with transaction() as con:
+        for device in DEVICE_LIST if devices is None else devices:
+            for scraper in SCRAPERS:
+                table_name = device.table(scraper.table_name)
+                if storage.table_exists(con, table_name):
+                    storage.rebuild_rollup(con, table_name, scraper.granularity)
+                    archived.add_to_rollup(con, table_name, scraper.granularity)
+                    storage.bump_version(con, table_name)
+                    logging.info('Rebuilt rollup of {}'.format(table_name))
+                    summary.update_summary(con, table_name)
+
+
+def import_data(
+    source: str, table_name: str = None, chunk_size: int = backfill.CHUNK_SIZE
+) -> dict:
+    """
+    Load a CSV export into `table_name`, or the youless tables of another
+    database (only `table_name` if given), in a single transaction. Returns
+    the rows read, inserted and updated per table.
+    """
+    granularities = {scraper.table_name: scraper.granularity for scraper in SCRAPERS}
+    granularities[storage.LIVE_TABLE] = None
+    if backfill.is_sqlite(source):
+        source_con = storage.connect_readonly(source)
+        tables = [table_name] if table_name else storage.youless_tables(source_con)
+        sources = {
+            name: backfill.sqlite_chunks(source_con, name, chunk_size)
+            for name in tables
+            # Leftovers of other versions are skipped when importing everything
+            if table_name or name.partition('__')[0] in granularities
+        }
+    else:
+        if table_name is None:
+            raise ValueError('The table to import a CSV file into is missing')
+        source_con = sys.stdin if source == '-' else open(source, newline='')
+        sources = {table_name: backfill.csv_chunks(source_con, chunk_size)}
+    archived = archive.Archive(ARCHIVE_PATH)
+    results = {}
+    try:
+        for name in sources:
+            if name.partition('__')[0] not in granularities:
+                raise ValueError(f'Unknown table {name!r}')
+        with write_connection() as con, storage.bulk_pragmas(con), transaction() as con:
+            for name, chunks in sources.items():
+                with STORE_SECONDS.time(table=name, step='import'):
+                    results[name] = storage.bulk_load(con, name, chunks, STORAGE_FORMAT)
+                rows, inserted, updated = results[name]
+                logging.info(
+                    'Imported {} rows into {}, {} new and {} updated'.format(
+                        rows, name, inserted, updated
+                    )
+                )
+                if not inserted and not updated:
+                    continue
+                granularity = granularities[name.partition('__')[0]]
+                if granularity:
+                    storage.rebuild_rollup(con, name, granularity)
+                    archived.add_to_rollup(con, name, granularity)
+                storage.bump_version(con, name)
+                storage.raise_meta(
+                    con, name, 'high_water_mark', storage.max_time(con, name)
+                )
+                summary.update_summary(con, name)
+    finally:
+        if source_con is not sys.stdin:
+            source_con.close()
+    return results
+
+
+def verify_summaries() -> int:
+    # Number of stored summary figures which differ from a full recomputation
+    with connection() as con:
+        mismatches = summary.verify_summary(con, archive.Archive(ARCHIVE_PATH))
+    for source, figure, stored, recomputed in mismatches:
+        logging.error(
+            'Summary {} of {} is {}, recomputed {}'.format(
+                figure, source, stored, recomputed
+            )
+        )
+    if not mismatches:
+        logging.info('All summaries match a full recomputation')
+    return len(mismatches)
+
+
+def create_scrapers(devices: list = None) -> list:
+    scrapers = []
+    for device in DEVICE_LIST if devices is None else devices:
+        scrapers += [
+            YoulessEnergyMinute(device),
+            YoulessEnergyHour(device),
+            YoulessEnergyDay(device),
+        ]
+        if device.gas_enabled:
+            scrapers += [YoulessGasHour(device), YoulessGasDay(device)]
+    return scrapers
+
+
+def job_failed(job, message: str):
+    device = getattr(job, 'device', None)
+    JOB_ERRORS.inc(job=type(job).__name__, device=device.label if device else '')
+    job.logger.exception(message)
+
+
+def store_batches(batches: list, failed_scrapers: list = ()) -> int:
+    """
+    Store the (scraper, (times, values, unit[, complete])) batches in one
+    transaction, so a run commits once. A failing batch is rolled back on its
+    own. Whether each scraper succeeded goes to the circuit breaker in the
+    same transaction, the `failed_scrapers` of the fetch count as failed.
+    Returns the number of failed batches.
+    """
+    stored, failures = [], 0
+    now = time.time()
+    with transaction() as con:
+        for scraper, batch in batches:
+            con.execute('SAVEPOINT batch')
+            try:
+                scraper.store_batch(con, *batch)
+                stored.append(scraper)
+            except Exception:
+                con.execute('ROLLBACK TO batch')
+                job_failed(scraper, 'Storing data failed')
+                failures += 1
+            con.execute('RELEASE batch')
+        failed = set(failed_scrapers)
+        for scraper in {scraper for scraper, _ in batches} | failed:
+            ok = scraper in stored and scraper not in failed
+            BREAKER.record(con, scraper.table_name, ok, now)
+    for scraper in stored:
+        if scraper not in failed:
+            LAST_SUCCESS.set(now, table=scraper.table_name)
+    return failures
+
+
+def breaker_open(scraper: YoulessBaseLogger) -> bool:
+    with connection() as con:
+        if not BREAKER.is_open(con, scraper.table_name, time.time()):
+            return False
+    BREAKER_SKIPS.inc(table=scraper.table_name)
+    scraper.logger.warning('Skipped after repeated failures')
+    return True
+
+
+def run_jobs(jobs: list, full_scan: bool = False, timeout: float = None) -> int:
+    """
+    Run the jobs of each device one after the other and the devices
+    concurrently, so a slow device does not delay the others. Fetching stops
+    after `timeout` seconds (`run_timeout`), the pages fetched by then are
+    stored. The data of all scrapers is stored together afterwards. Scrapers
+    which failed too often in a row are skipped for a while. Returns the
+    number of failed jobs.
+    """
+    timeout = RUN_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout if timeout else None
+    groups = {}
+    for job in jobs:
+        groups.setdefault(getattr(job, 'device', None), []).append(job)
+
+    def run_group(group: list) -> tuple:
+        batches, failed = [], []
+        for job in group:
+            try:
+                if isinstance(job, YoulessBaseLogger):
+                    if not breaker_open(job):
+                        batches.append((job, job.collect(full_scan, deadline)))
+                else:
+                    job.run(full_scan=full_scan)
+            except PartialFetchError as e:
+                job_failed(job, 'Fetching data failed')
+                failed.append(job)
+                if e.pages:
+                    # Stored without moving the high-water mark past the gap
+                    batches.append((job, (*job.convert_pages(e.pages), False)))
+            except Exception:
+                job_failed(job, 'Fetching data failed')
+                failed.append(job)
+        return batches, failed
+
+    if len(groups) <= 1:
+        results = [run_group(jobs)]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=min(DEVICE_WORKERS, len(groups))
+        ) as executor:
+            results = list(executor.map(run_group, groups.values()))
+    batches = [batch for group_batches, _ in results for batch in group_batches]
+    failed = [job for _, group_failed in results for job in group_failed]
+    scrapers = [job for job in failed if isinstance(job, YoulessBaseLogger)]
+    if batches or scrapers:
+        return len(failed) + store_batches(batches, scrapers)
+    return len(failed)
+
+
+def run_daemon(jobs: list, stop: threading.Event, full_scan: bool = False):
+    # Every job runs right away and then once per its own interval
+    next_run = {job: time.monotonic() for job in jobs}
+    while not stop.is_set():
+        now = time.monotonic()
+        due = [job for job in jobs if next_run[job] <= now]
+        for job in due:
+            next_run[job] = now + job.interval
+        if due:
+            run_jobs(due, full_scan=full_scan)
+            write_metrics()
+            # A job can ask to run again sooner, like the archiver catching up
+            for job in due:
+                next_run[job] = min(next_run[job], time.monotonic() + job.interval)
+        full_scan = False
+        stop.wait(max(min(next_run.values()) - time.monotonic(), 0))
 
 
 if __name__ == '__main__':
-    energy_minute_scraper = YoulessEnergyMinute()
-    energy_minute_scraper.fetch_data()
-    energy_hour_scraper = YoulessEnergyHour()
-    energy_hour_scraper.fetch_data()
-    energy_day_scraper = YoulessEnergyDay()
-    energy_day_scraper.fetch_data()
-
-    if GAS_ENABLED:
-        gas_hour_scraper = YoulessGasHour()
-        gas_hour_scraper.fetch_data()
-        gas_day_scraper = YoulessGasDay()
-        gas_day_scraper.fetch_data()
+    parser = argparse.ArgumentParser(description='Collect data from a Youless logger')
+    parser.add_argument(
+        '--full-rescan',
+        action='store_true',
+        help='fetch all report pages instead of only the ones since the last run',
+    )
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='keep running and fetch each report at its own interval',
+    )
+    commands = parser.add_subparsers(dest='command')
+    migrate_parser = commands.add_parser(
+        'migrate', help='upgrade the schema of all youless tables and exit'
+    )
+    migrate_parser.add_argument(
+        '--compact',
+        action='store_true',
+        help='convert the tables to the compact integer format and shrink the file',
+    )
+    commands.add_parser(
+        'rebuild-rollups',
+        help='recompute the rollups of the historical averages from scratch and exit',
+    )
+    commands.add_parser(
+        'verify-summary',
+        help='compare the stored summary figures with a full recomputation and exit',
+    )
+    commands.add_parser(
+        'archive',
+        help='move data older than the configured retention to the archive and exit',
+    )
+    export_parser = commands.add_parser(
+        'export',
+        help='write a table as CSV or Parquet, archived data included, and exit',
+    )
+    export_parser.add_argument('table', help='e.g. youless_minute')
+    export_parser.add_argument('--start', help='first date or time, e.g. 2022-01-01')
+    export_parser.add_argument('--end', help='date or time to stop before')
+    export_parser.add_argument(
+        '--format', choices=list(export.EXPORT_FORMATS), default=export.CSV_FORMAT
+    )
+    export_parser.add_argument(
+        '--aggregate',
+        choices=list(export.AGGREGATIONS),
+        help='average power and sum amounts per hour or day',
+    )
+    export_parser.add_argument(
+        '--output', default='-', help='file to write to, defaults to stdout'
+    )
+    import_parser = commands.add_parser(
+        'import',
+        help='load a CSV export or the tables of another youless database and exit',
+    )
+    import_parser.add_argument(
+        'source', help='CSV file (- for stdin) or SQLite database'
+    )
+    import_parser.add_argument(
+        '--table',
+        help='table to load a CSV file into, or the only table taken from a database',
+    )
+    commands.add_parser(
+        'sample',
+        help='only poll the live power readings of the devices until stopped',
+    )
+    args = parser.parse_args()
+
+    if args.command in ('archive', 'import'):
+        try:
+            # Held until the process exits, logger runs skip their turn meanwhile
+            lock = run_lock()
+        except AlreadyRunning as e:
+            parser.error('{}, stop the daemon or wait for the run to end'.format(e))
+    if args.command == 'rebuild-rollups':
+        rebuild_rollups()
+        raise SystemExit()
+    if args.command == 'verify-summary':
+        raise SystemExit(1 if verify_summaries() else 0)
+    if args.command == 'archive':
+        YoulessArchiver().archive_data()
+        raise SystemExit()
+    if args.command == 'export':
+        try:
+            stream = export.export(
+                DB_PATH,
+                args.table,
+                *export.parse_range(args.start, args.end),
+                args.format,
+                args.aggregate,
+                archive.Archive(ARCHIVE_PATH),
+            )
+        except (ValueError, ImportError) as e:
+            parser.error(str(e))
+        output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        with output:
+            for chunk in stream:
+                output.write(chunk)
+        raise SystemExit()
+    if args.command == 'import':
+        try:
+            import_data(args.source, args.table)
+        except (ValueError, OSError, sql.DatabaseError) as e:
+            parser.error(str(e))
+        raise SystemExit()
+    if args.command == 'migrate':
+        target_format = storage.COMPACT_FORMAT if args.compact else None
+        con = storage.connect(DB_PATH)
+        for table_name in storage.migrate(con, target_format):
+            logging.info('Migrated table {}'.format(table_name))
+        if args.compact:
+            # Give the space of the converted tables back to the file system
+            con.execute('VACUUM')
+        con.close()
+        raise SystemExit()
+
+    stop = threading.Event()
+    if args.command == 'sample' or args.daemon:
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+    if args.command == 'sample':
+        try:
+            samplers = create_samplers()
+        except AlreadyRunning as e:
+            parser.error('{}, a sampler of this device runs already'.format(e))
+        logging.info('Starting samplers')
+        for thread in start_samplers(samplers, stop):
+            thread.join()
+        raise SystemExit()
+
+    scrapers = create_scrapers()
+    try:
+        # Held until the process exits
+        lock = run_lock()
+    except AlreadyRunning as e:
+        # A cron run which overlaps a slow one or the daemon
+        logging.warning('Exiting, {}'.format(e))
+        raise SystemExit()
+    if args.daemon:
+        if RETENTION_DAYS:
+            scrapers.append(YoulessArchiver())
+        samplers = []
+        if SAMPLER_ENABLED:
+            try:
+                samplers = start_samplers(create_samplers(), stop)
+            except AlreadyRunning as e:
+                # `logger.py sample` runs on its own
+                logging.warning('Not sampling, {}'.format(e))
+        logging.info('Starting daemon for {} scrapers'.format(len(scrapers)))
+        run_daemon(scrapers, stop, full_scan=args.full_rescan)
+        for thread in samplers:
+            thread.join()
+        logging.info('Daemon stopped')
+    else:
+        failed = run_jobs(scrapers, full_scan=args.full_rescan)
+        write_metrics()
+        if failed:
+            raise SystemExit(1)
@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+from unittest import TestCase
+from unittest.mock import patch
+
+# The tests never read the config.json of the installation
+os.environ['YOULESS_CONFIG'] = os.path.join(os.path.dirname(__file__), 'config.json')
+
+
+class TempDatabaseTestCase(TestCase):
+    """
+    Points the logger and the dashboard to a new database in a temporary
+    directory for every test. Suites patching more extend `patches`.
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.db_path = os.path.join(self.tmp_dir, 'youless.db')
+        for patcher in self.patches():
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def patches(self) -> list:
+        return [
+            patch('logger.DB_PATH', self.db_path),
+            patch('helpers.data_processing.DB_PATH', self.db_path),
+        ]
@@ -0,0 +1,309 @@
+import datetime
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+from unittest.mock import patch
+
+import numpy as np
+
+from benchmarks.simulator import YoulessSimulator
+from helpers import storage, summary
+from helpers.archive import Archive, archive_table
+from helpers.data_processing import (
+    EnergyRangeData,
+    HistoryData,
+    QueryCache,
+    YoulessData,
+)
+from logger import (
+    YoulessArchiver,
+    YoulessEnergyDay,
+    YoulessEnergyHour,
+    YoulessEnergyMinute,
+    rebuild_rollups,
+    run_jobs,
+    store_batches,
+)
+from helpers.devices import Device
+from test import TempDatabaseTestCase
+
+
+class ArchiveTestCase(TempDatabaseTestCase):
+    storage_format = storage.TEXT_FORMAT
+    now = datetime.datetime(2022, 4, 10, 12, 0, 0)
+
+    def patches(self) -> list:
+        self.archive_path = os.path.join(self.tmp_dir, 'archive')
+        return super().patches() + [
+            patch('logger.ARCHIVE_PATH', self.archive_path),
+            patch('logger.STORAGE_FORMAT', self.storage_format),
+            patch.object(YoulessData, 'cache', QueryCache(2**20)),
+        ]
+
+    def setUp(self):
+        super().setUp()
+        # 90 days of hourly values up to now
+        self.times = np.datetime64(self.now, 's') - np.arange(90 * 24)[::-1] * 3600
+        self.values = (np.arange(len(self.times)) % 1000).astype(float)
+        YoulessEnergyHour().store_data(self.times, self.values, 'Watt')
+
+    def _archive(self, days=30):
+        archiver = YoulessArchiver({'youless_hour': days}, self.archive_path)
+        return archiver.archive_data(now=self.now)['youless_hour']
+
+    def _rollup(self):
+        with sqlite3.connect(self.db_path) as con:
+            return con.execute(
+                "SELECT bucket, total, count FROM youless_rollup WHERE table_name = 'youless_hour' ORDER BY bucket"
+            ).fetchall()
+
+    def _assert_rollup_equal(self, rollup, expected):
+        self.assertEqual(
+            [(b, c) for b, _, c in rollup], [(b, c) for b, _, c in expected]
+        )
+        np.testing.assert_allclose(
+            [t for _, t, _ in rollup], [t for _, t, _ in expected]
+        )
+
+    def test_old_rows_are_moved_to_the_archive(self):
+        """
+        ... then rows before the retention cutoff should only exist in the archive
+        """
+        cutoff = datetime.datetime(2022, 3, 11)
+        archived = self._archive()
+
+        with sqlite3.connect(self.db_path) as con:
+            oldest = storage.min_time(con, 'youless_hour')
+            live = con.execute('SELECT COUNT(*) FROM youless_hour').fetchone()[0]
+        self.assertEqual(oldest, cutoff.strftime(storage.TIME_FORMAT))
+        self.assertEqual(archived + live, len(self.times))
+        self.assertEqual(archived, int((self.times < np.datetime64(cutoff)).sum()))
+
+        with open(os.path.join(self.archive_path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual(
+            sorted(manifest['youless_hour']), ['2022-01', '2022-02', '2022-03']
+        )
+        self.assertEqual(
+            sum(e['rows'] for e in manifest['youless_hour'].values()), archived
+        )
+
+    def test_history_combines_archive_and_database(self):
+        """
+        ... then the history of a range should be the same before and after archiving
+        """
+        start, end = datetime.datetime(2022, 1, 1), datetime.datetime(2022, 5, 1)
+        before = HistoryData('youless_hour', start, end, self.archive_path).data
+        self._archive()
+        after = HistoryData('youless_hour', start, end, self.archive_path).data
+
+        self.assertEqual(len(before), len(self.times))
+        self.assertEqual(list(after['time']), list(before['time']))
+        np.testing.assert_allclose(
+            after['energy_consumption'], before['energy_consumption']
+        )
+        self.assertEqual(set(after['unit']), {'Watt'})
+
+    def test_month_range_includes_archived_days(self):
+        """
+        ... then the monthly sums of a range should be the same before and after archiving days
+        """
+        days = np.datetime64(self.now.date(), 's') - np.arange(90)[::-1] * 86400
+        YoulessEnergyDay().store_data(days, np.arange(90.0), 'kWh')
+        start, end = datetime.datetime(2022, 1, 1), datetime.datetime(2022, 5, 1)
+        before = EnergyRangeData(
+            start, end, min_points=2, archive_path=self.archive_path
+        )
+
+        archiver = YoulessArchiver({'youless_day': 30}, self.archive_path)
+        self.assertGreater(archiver.archive_data(now=self.now)['youless_day'], 0)
+        after = EnergyRangeData(
+            start, end, min_points=2, archive_path=self.archive_path
+        )
+
+        self.assertEqual(after.resolution, 'month')
+        self.assertEqual(list(after.data['time']), list(before.data['time']))
+        np.testing.assert_allclose(
+            after.data['energy_consumption'], before.data['energy_consumption']
+        )
+        self.assertEqual(after.data['energy_consumption'].sum(), np.arange(90.0).sum())
+
+    def test_archiving_twice_is_idempotent(self):
+        """
+        ... then archiving again later should merge into the existing month files
+        """
+        first = self._archive(days=60)
+        second = self._archive(days=30)
+        archive = Archive(self.archive_path)
+
+        times, _, _ = archive.read_range(
+            'youless_hour', datetime.datetime(2022, 1, 1), datetime.datetime(2022, 5, 1)
+        )
+        self.assertEqual(len(times), first + second)
+        self.assertEqual(len(np.unique(times)), len(times))
+        with sqlite3.connect(self.db_path) as con:
+            self.assertEqual(
+                archive_table(con, archive, 'youless_hour', 30, self.now), 0
+            )
+
+    def test_rollups_keep_archived_values(self):
+        """
+        ... then the historical averages should not change by archiving or rebuilding
+        """
+        expected = self._rollup()
+        self._archive()
+        self.assertEqual(self._rollup(), expected)
+
+        rebuild_rollups()
+        rollup = self._rollup()
+        self._assert_rollup_equal(rollup, expected)
+
+    def _distinct_hours(self):
+        with sqlite3.connect(self.db_path) as con:
+            times, _ = summary._all_rows(con, 'youless_hour')
+        archived, _, _ = Archive(self.archive_path).read_range(
+            'youless_hour', datetime.datetime(2000, 1, 1), self.now
+        )
+        return len(np.union1d(times, archived))
+
+    def test_full_rescan_after_archive(self):
+        """
+        ... then fetching the archived hours again should not count them twice in the rollup
+        """
+        self._archive()
+        with YoulessSimulator(now=self.now) as device:
+            failed = run_jobs([YoulessEnergyHour(Device('', device.url))], True)
+
+        with sqlite3.connect(self.db_path) as con:
+            oldest = storage.min_time(con, 'youless_hour')
+        rollup = self._rollup()
+        self.assertEqual(failed, 0)
+        self.assertEqual(oldest, '2022-03-11 00:00:00')
+        self.assertEqual(sum(count for _, _, count in rollup), self._distinct_hours())
+        rebuild_rollups()
+        self._assert_rollup_equal(self._rollup(), rollup)
+
+    def test_interrupted_archive_counts_rows_once(self):
+        """
+        ... then rows in the table and the archive should count once in the rollup and the summary
+        """
+        expected = self._rollup()
+
+        def interrupted():
+            raise sqlite3.OperationalError('database is locked')
+
+        with sqlite3.connect(self.db_path) as con:
+            with self.assertRaises(sqlite3.OperationalError):
+                archive_table(
+                    con,
+                    Archive(self.archive_path),
+                    'youless_hour',
+                    30,
+                    self.now,
+                    transaction=interrupted,
+                )
+            rebuild_rollups()
+            _, counts = summary._hourly_averages(
+                con, 'youless_hour', Archive(self.archive_path)
+            )
+
+        self.assertGreater(len(Archive(self.archive_path).months('youless_hour')), 0)
+        self.assertEqual(counts.sum(), len(self.times))
+        rollup = self._rollup()
+        self._assert_rollup_equal(rollup, expected)
+
+    def test_one_month_per_run(self):
+        """
+        ... then a daemon run should archive one month per table and come back soon for the rest
+        """
+        archiver = YoulessArchiver({'youless_hour': 30}, self.archive_path)
+        months = []
+        while not months or archiver.pending:
+            archiver.archive_data(now=self.now, max_months=1)
+            months.append(len(Archive(self.archive_path).months('youless_hour')))
+
+        self.assertEqual(months, [1, 2, 3])
+        with patch.object(archiver, 'archive_data') as archive_data:
+            archiver.pending = True
+            archiver.run()
+            self.assertEqual(archiver.interval, archiver.catch_up_interval)
+            archiver.pending = False
+            archiver.run()
+            self.assertEqual(archiver.interval, YoulessArchiver.interval)
+        archive_data.assert_called_with(max_months=1)
+
+    def test_storing_during_archive(self):
+        """
+        ... then the logger should store its data while an archive is in progress
+        """
+        writing, release = threading.Event(), threading.Event()
+        write_month = Archive.write_month
+
+        def slow_write_month(*args, **kwargs):
+            write_month(*args, **kwargs)
+            writing.set()
+            release.wait(5)
+
+        archiver = YoulessArchiver({'youless_hour': 30}, self.archive_path)
+        with patch.object(Archive, 'write_month', slow_write_month):
+            archiving = threading.Thread(
+                target=archiver.archive_data, kwargs={'now': self.now}
+            )
+            archiving.start()
+            writing.wait(5)
+            times = np.datetime64(self.now, 's') - np.arange(10)[::-1] * 60
+            storing = threading.Thread(
+                target=store_batches,
+                args=([(YoulessEnergyMinute(), (times, np.ones(10), 'Watt'))],),
+            )
+            storing.start()
+            storing.join(timeout=2)
+            stored = not storing.is_alive()
+            release.set()
+            archiving.join()
+            storing.join()
+
+        self.assertTrue(stored)
+        with sqlite3.connect(self.db_path) as con:
+            count = con.execute('SELECT COUNT(*) FROM youless_minute').fetchone()[0]
+        self.assertEqual(count, 10)
+
+
+class CompactArchiveTestCase(ArchiveTestCase):
+    storage_format = storage.COMPACT_FORMAT
+
+
+class RetentionConfigTestCase(TempDatabaseTestCase):
+    def _load_config(self, retention_days):
+        config_path = os.path.join(self.tmp_dir, 'config.json')
+        with open(config_path, 'w') as f:
+            json.dump(
+                {
+                    'db_path': self.db_path,
+                    'debug_mode': False,
+                    'retention_days': retention_days,
+                },
+                f,
+            )
+        return subprocess.run(
+            [sys.executable, '-c', 'import config'],
+            env={**os.environ, 'YOULESS_CONFIG': config_path},
+            capture_output=True,
+            text=True,
+        )
+
+    def test_retention_shorter_than_dashboard_is_rejected(self):
+        """
+        ... then a retention shorter than the windows of the dashboard should fail on loading the config
+        """
+        res = self._load_config({'youless_minute': 30, 'youless_day': 30})
+
+        self.assertNotEqual(res.returncode, 0)
+        self.assertIn('retention_days of youless_day is 30', res.stderr)
+        self.assertEqual(
+            self._load_config({'youless_minute': 1, 'youless_day': 366}).returncode, 0
+        )
@@ -0,0 +1,168 @@
+import datetime
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+from unittest.mock import patch
+
+import numpy as np
+
+from helpers import storage
+from helpers.backfill import csv_chunks
+from helpers.export import export
+from logger import YoulessEnergyHour, YoulessEnergyMinute, import_data, run_lock
+from test import TempDatabaseTestCase
+
+
+class ImportTestCase(TempDatabaseTestCase):
+    storage_format = storage.TEXT_FORMAT
+
+    def patches(self) -> list:
+        return super().patches() + [
+            patch('logger.ARCHIVE_PATH', os.path.join(self.tmp_dir, 'archive')),
+            patch('logger.STORAGE_FORMAT', self.storage_format),
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.source_path = os.path.join(self.tmp_dir, 'source.db')
+        self.times = np.datetime64('2022-04-10T00:00:00') + np.arange(3000) * 60
+        self.values = np.arange(3000.0)
+
+    def _rows(self, db_path, table_name):
+        with sqlite3.connect(db_path) as con:
+            columns = storage.column_sql(storage.storage_format(con), table_name)
+            rows = con.execute(
+                f'SELECT {columns} FROM {table_name} ORDER BY time'
+            ).fetchall()
+        con.close()
+        return rows
+
+    def _source(self):
+        # A youless database like another installation would have
+        with patch('logger.DB_PATH', self.source_path):
+            YoulessEnergyMinute().store_data(self.times, self.values, 'Watt')
+            YoulessEnergyHour().store_data(self.times[::60], self.values[::60], 'Watt')
+
+    def test_csv_export_round_trip(self):
+        """
+        ... then importing an export should restore the same rows
+        """
+        self._source()
+        csv_path = os.path.join(self.tmp_dir, 'minute.csv')
+        with open(csv_path, 'wb') as f:
+            for chunk in export(
+                self.source_path,
+                'youless_minute',
+                datetime.datetime(1970, 1, 1),
+                datetime.datetime(9999, 1, 1),
+            ):
+                f.write(chunk)
+
+        results = import_data(csv_path, 'youless_minute', chunk_size=1000)
+
+        self.assertEqual(results, {'youless_minute': (3000, 3000, 0)})
+        self.assertEqual(
+            self._rows(self.db_path, 'youless_minute'),
+            self._rows(self.source_path, 'youless_minute'),
+        )
+
+    def test_database_into_existing_tables(self):
+        """
+        ... then the tables of another database should be merged on time, the imported values winning
+        """
+        self._source()
+        # The last hour is known already, with another value
+        YoulessEnergyMinute().store_data(self.times[-60:], np.zeros(60), 'Watt')
+
+        results = import_data(self.source_path)
+
+        self.assertEqual(
+            results,
+            {'youless_hour': (50, 50, 0), 'youless_minute': (3000, 2940, 60)},
+        )
+        self.assertEqual(
+            self._rows(self.db_path, 'youless_minute'),
+            self._rows(self.source_path, 'youless_minute'),
+        )
+        with sqlite3.connect(self.db_path) as con:
+            rollup = con.execute('''
+                SELECT SUM(total), SUM(count) FROM youless_rollup
+                WHERE table_name = 'youless_minute'
+                ''').fetchone()
+            summary = con.execute(
+                "SELECT 1 FROM youless_summary WHERE source = 'youless_hour'"
+            ).fetchone()
+        con.close()
+        self.assertEqual(rollup, (self.values.sum(), 3000))
+        self.assertIsNotNone(summary)
+
+    def test_last_value_of_a_time_wins(self):
+        """
+        ... then of duplicated times in the source only the last value should be kept
+        """
+        source = io.StringIO(
+            'time,energy_consumption,unit\n'
+            '2022-04-10 00:00:00,1.0,Watt\n'
+            '2022-04-10 00:01:00,2.0,Watt\n'
+            '2022-04-10 00:00:00,3.0,Watt\n'
+        )
+        with storage.connect(self.db_path) as con:
+            result = storage.bulk_load(
+                con, 'youless_minute', csv_chunks(source, chunk_size=2)
+            )
+        con.close()
+
+        self.assertEqual(result, (3, 2, 0))
+        self.assertEqual(
+            self._rows(self.db_path, 'youless_minute'),
+            [
+                ('2022-04-10 00:00:00', 3.0, 'Watt'),
+                ('2022-04-10 00:01:00', 2.0, 'Watt'),
+            ],
+        )
+
+    def test_other_files_are_rejected(self):
+        """
+        ... then a CSV file without the columns of an export should not be imported
+        """
+        with self.assertRaises(ValueError):
+            list(csv_chunks(io.StringIO('date,value\n2022-04-10,1\n')))
+        with self.assertRaises(ValueError):
+            import_data('-')
+
+    def test_refused_while_logger_runs(self):
+        """
+        ... then the import command should fail right away while a logger run holds the lock
+        """
+        config_path = os.path.join(self.tmp_dir, 'config.json')
+        lock_path = os.path.join(self.tmp_dir, 'youless.lock')
+        with open(config_path, 'w') as f:
+            json.dump(
+                {'db_path': self.db_path, 'debug_mode': False, 'lock_path': lock_path},
+                f,
+            )
+        self._source()
+
+        lock = run_lock(lock_path)
+        try:
+            res = subprocess.run(
+                [sys.executable, 'logger.py', 'import', self.source_path],
+                capture_output=True,
+                text=True,
+                env={**os.environ, 'YOULESS_CONFIG': config_path},
+                timeout=60,
+            )
+        finally:
+            lock.close()
+
+        self.assertEqual(res.returncode, 2)
+        self.assertIn('locked by another run', res.stderr)
+        self.assertFalse(os.path.exists(self.db_path))
+
+
+class CompactImportTestCase(ImportTestCase):
+    storage_format = storage.COMPACT_FORMAT
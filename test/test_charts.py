@@ -0,0 +1,230 @@
+import datetime
+
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pandas as pd
+
+from helpers.charts import (
+    CURRENT_MAX_POINTS,
+    EXPLORER_CUSTOM,
+    MonitoringLayout,
+    downsample,
+    explorer_range,
+    extend_current,
+    max_points_for_width,
+    plot_current,
+    plot_range,
+)
+from helpers.summary import FIGURES
+
+
+def minute_data(count, start='2022-04-10 00:00:00'):
+    times = pd.date_range(start, periods=count, freq='min')
+    return pd.DataFrame(
+        {
+            'time': times.strftime('%Y-%m-%d %H:%M:%S'),
+            'energy_consumption': np.arange(count, dtype=float),
+            'unit': 'Watt',
+        }
+    )
+
+
+class CurrentChartTestCase(TestCase):
+    def test_current_is_ascending_and_trimmed(self):
+        """
+        ... then the chart should hold the newest 12 hours in ascending order
+        """
+        df = minute_data(1000).sample(frac=1, random_state=1)
+
+        fig = plot_current(df)
+
+        x = list(fig.data[0].x)
+        self.assertEqual(len(x), CURRENT_MAX_POINTS)
+        self.assertEqual(x, sorted(x))
+        self.assertEqual(x[-1], df['time'].max())
+
+    def test_extend_current(self):
+        """
+        ... then the new minutes should be appended to the first trace in order
+        """
+        df = minute_data(3).iloc[::-1]
+
+        data, traces, max_points = extend_current(df)
+
+        self.assertEqual(traces, [0])
+        self.assertEqual(max_points, CURRENT_MAX_POINTS)
+        self.assertEqual(data['x'], [sorted(df['time'])])
+        self.assertEqual(data['y'], [[0.0, 1.0, 2.0]])
+        self.assertEqual(data['marker.color'], data['y'])
+
+    def test_extend_current_keeps_figure_points(self):
+        """
+        ... then live updates of a narrow chart should keep as many points as its figure
+        """
+        df = minute_data(CURRENT_MAX_POINTS)
+        with patch('helpers.charts.CHART_WIDTH_PX', 100):
+            fig = plot_current(df)
+            _, _, max_points = extend_current(df.tail(1))
+
+        self.assertLess(max_points, CURRENT_MAX_POINTS)
+        self.assertEqual(max_points, len(fig.data[0].x))
+
+
+class DownsampleTestCase(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.df = minute_data(20000)
+        self.df['energy_consumption'] = rng.normal(400, 50, len(self.df))
+        self.df.loc[12345, 'energy_consumption'] = 5000.0
+        self.df.loc[6789, 'energy_consumption'] = -100.0
+
+    def test_small_frames_are_unchanged(self):
+        """
+        ... then frames within the limit should be returned as they are
+        """
+        df = minute_data(100)
+
+        self.assertIs(downsample(df, max_points=100), df)
+
+    def test_minmax_keeps_peaks(self):
+        """
+        ... then every minimum and maximum should survive min/max bucketing
+        """
+        result = downsample(self.df, max_points=500, method='minmax')
+
+        self.assertLessEqual(len(result), 500)
+        self.assertEqual(result['energy_consumption'].max(), 5000.0)
+        self.assertEqual(result['energy_consumption'].min(), -100.0)
+        self.assertTrue(result['time'].is_monotonic_increasing)
+
+    def test_lttb_keeps_peaks_and_ends(self):
+        """
+        ... then LTTB should keep the first and last point and outstanding peaks
+        """
+        result = downsample(self.df, max_points=500, method='lttb')
+
+        self.assertEqual(len(result), 500)
+        self.assertEqual(result.index[0], 0)
+        self.assertEqual(result.index[-1], len(self.df) - 1)
+        self.assertIn(12345, result.index)
+        self.assertIn(6789, result.index)
+        self.assertTrue(result['time'].is_monotonic_increasing)
+
+    def test_payload_is_capped_by_chart_width(self):
+        """
+        ... then the figure sent to the browser should shrink with the chart width
+        """
+        df = minute_data(CURRENT_MAX_POINTS)
+        full = plot_current(df).to_json()
+        with patch('helpers.charts.CHART_WIDTH_PX', 100):
+            fig = plot_current(df)
+
+        self.assertEqual(len(fig.data[0].x), max_points_for_width(100))
+        self.assertLess(len(fig.to_json()), len(full) / 2)
+
+
+class ExplorerTestCase(TestCase):
+    def test_explorer_range(self):
+        """
+        ... then presets should end now and picked dates should include the end date
+        """
+        now = datetime.datetime(2022, 4, 10, 12, 30)
+
+        self.assertEqual(
+            explorer_range(24, None, None, now),
+            (datetime.datetime(2022, 4, 9, 12, 30), now),
+        )
+        self.assertEqual(
+            explorer_range(EXPLORER_CUSTOM, '2022-04-01', '2022-04-03T00:00:00', now),
+            (datetime.datetime(2022, 4, 1), datetime.datetime(2022, 4, 4)),
+        )
+
+    def test_range_payload_is_bounded(self):
+        """
+        ... then any range should be plotted with at most the point budget
+        """
+        with patch('helpers.charts.CHART_WIDTH_PX', 200):
+            fig = plot_range(minute_data(5000), 'minute', 'Electricity')
+
+        self.assertLessEqual(len(fig.data[0].x), max_points_for_width(200))
+        self.assertEqual(fig.layout.yaxis.title.text, 'Watt')
+
+
+class MonitoringLayoutTestCase(TestCase):
+    def _layout(self, data_minute=True):
+        self.queries = {
+            name: MagicMock(
+                return_value=MagicMock(
+                    data=minute_data(60).assign(avg_energy_consumption=1.0)
+                )
+            )
+            for name in ('minute', 'hour', 'day', 'month')
+        }
+        return MonitoringLayout(
+            data_minute=self.queries['minute'] if data_minute else None,
+            data_hour=self.queries['hour'],
+            data_day=self.queries['day'],
+            data_month=self.queries['month'],
+            title='Energy Monitoring',
+            summary_stats_suffix=' kWh',
+            last_24h_unit='Wh',
+            last_30d_unit='kWh',
+            last_year_unit='kWh',
+        )
+
+    def _called(self):
+        return sorted(name for name, query in self.queries.items() if query.called)
+
+    def test_render_runs_no_query(self):
+        """
+        ... then the page itself should be rendered without any query
+        """
+        layout = self._layout()
+
+        page = layout.render({'pathname': '/', 'device': ''})
+
+        self.assertEqual(self._called(), [])
+        self.assertIn("active_tab='current'", str(page))
+
+    def test_tabs_only_query_their_data(self):
+        """
+        ... then every tab should only query the data it shows
+        """
+        expected = {
+            'current': ['minute'],
+            'last-24-hours': ['hour'],
+            'last-30-days': ['day'],
+        }
+        for tab_id, queries in expected.items():
+            with self.subTest(tab=tab_id):
+                layout = self._layout()
+                layout.render_tab(tab_id)
+                self.assertEqual(self._called(), queries)
+
+    def test_summary_from_stored_figures(self):
+        """
+        ... then the summary cards should use the stored figures unless they are incomplete
+        """
+        figures = dict.fromkeys(FIGURES, 1.0)
+        for complete, queries in ((True, []), (False, ['day', 'hour', 'month'])):
+            with self.subTest(complete=complete):
+                layout = self._layout()
+                month = self.queries['month'].return_value
+                month.data = month.data.assign(year='2022', month='04')
+                layout.data_summary = MagicMock(
+                    return_value=MagicMock(complete=complete, figures=figures)
+                )
+                layout.render_summary()
+                self.assertEqual(self._called(), queries)
+
+    def test_without_minute_data(self):
+        """
+        ... then pages without minute data should start with the 24 hours tab
+        """
+        layout = self._layout(data_minute=False)
+
+        self.assertEqual(
+            [tab_id for tab_id, _ in layout.tabs], ['last-24-hours', 'last-30-days']
+        )
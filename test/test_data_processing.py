@@ -0,0 +1,395 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import numpy as np
+import pandas as pd
+
+from helpers import storage
+from helpers.data_processing import (
+    EnergyDataDay,
+    EnergyDataHour,
+    EnergyDataMinute,
+    EnergyDataMinuteSince,
+    EnergyDataMonth,
+    CombinedData,
+    LiveData,
+    QueryCache,
+    SharedCache,
+    YoulessData,
+    for_device,
+)
+from helpers.devices import ALL_DEVICES, Device
+from helpers.ringbuffer import RingBuffer
+from logger import YoulessEnergyHour, YoulessEnergyMinute
+from test import TempDatabaseTestCase
+from test.test_query_plans import seed_database
+
+
+class QueryCacheTestCase(TempDatabaseTestCase):
+    def patches(self) -> list:
+        self.cache = QueryCache(2**20)
+        return super().patches() + [patch.object(EnergyDataHour, 'cache', self.cache)]
+
+    @staticmethod
+    def _store(values):
+        # Hours leading up to the current one, within the dashboard window
+        current_hour = datetime.datetime.now().replace(
+            minute=0, second=0, microsecond=0
+        )
+        start = np.datetime64(current_hour, 's') - 10 * 3600
+        times = start + np.arange(len(values)) * 3600
+        YoulessEnergyHour().store_data(times, np.array(values, dtype=float), 'Watt')
+
+    def test_cache_hit_until_table_changes(self):
+        """
+        ... then the query should only run again after new data has been stored
+        """
+        self._store([1, 2, 3])
+        first = EnergyDataHour().data
+        second = EnergyDataHour().data
+
+        self.assertIs(first, second)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+        self._store([1, 2, 3, 4])
+        third = EnergyDataHour().data
+
+        self.assertEqual(len(third), 4)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_unchanged_values_keep_cache(self):
+        """
+        ... then storing identical values should not invalidate the cache
+        """
+        self._store([1, 2, 3])
+        EnergyDataHour()
+        self._store([1, 2, 3])
+        EnergyDataHour()
+
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_untracked_tables_are_not_cached(self):
+        """
+        ... then tables without an ingest counter should always be queried
+        """
+        with sqlite3.connect(self.db_path) as con:
+            con.execute(
+                'CREATE TABLE youless_hour (time TIMESTAMP, energy_consumption REAL, unit TEXT)'
+            )
+        EnergyDataHour()
+        EnergyDataHour()
+
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+class LiveUpdateTestCase(TempDatabaseTestCase):
+    def test_only_newer_minutes_are_loaded(self):
+        """
+        ... then only the minutes after the given time should be returned
+        """
+        times = np.datetime64('2022-04-10T12:00:00') + np.arange(10) * 60
+        YoulessEnergyMinute().store_data(times, np.arange(10.0), 'Watt')
+
+        data = EnergyDataMinuteSince(datetime.datetime(2022, 4, 10, 12, 6)).data
+
+        self.assertEqual(
+            list(data['time']),
+            ['2022-04-10 12:07:00', '2022-04-10 12:08:00', '2022-04-10 12:09:00'],
+        )
+        self.assertEqual(list(data['energy_consumption']), [7.0, 8.0, 9.0])
+
+
+class LiveDataTestCase(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buffer_name = f'youless_test_{os.getpid()}'
+
+    def test_samples_from_shared_memory(self):
+        """
+        ... then the samples should come from the ring buffer without a database
+        """
+        now = np.datetime64(datetime.datetime.now(), 's')
+        ring = RingBuffer(10, self.buffer_name)
+        self.addCleanup(ring.close, unlink=True)
+        ring.append((now - [120, 10, 5]).astype(np.int64), [100.0, 200.0, 300.0])
+
+        data = LiveData(seconds=60, buffer_name=self.buffer_name).data
+
+        self.assertEqual(list(data['energy_consumption']), [200.0, 300.0])
+        self.assertEqual(data['time'].iloc[-1], str(now - 5).replace('T', ' '))
+        self.assertFalse(os.path.exists(self.db_path))
+
+    def test_samples_from_table_without_sampler(self):
+        """
+        ... then the stored samples should be read when no sampler is running
+        """
+        now = datetime.datetime.now().replace(microsecond=0)
+        with sqlite3.connect(self.db_path) as con:
+            storage.ensure_table(con, storage.LIVE_TABLE, storage.TEXT_FORMAT)
+            times = np.datetime64(now, 's') - np.array([120, 10], 'm8[s]')
+            storage.upsert(con, storage.LIVE_TABLE, times, np.array([1.0, 2.0]), 'Watt')
+
+        data = LiveData(seconds=60, buffer_name=self.buffer_name).data
+
+        self.assertEqual(list(data['energy_consumption']), [2.0])
+
+
+class DeviceDataTestCase(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.devices = [Device('house'), Device('garage')]
+        current_hour = datetime.datetime.now().replace(
+            minute=0, second=0, microsecond=0
+        )
+        times = np.datetime64(current_hour, 's') - np.arange(6)[::-1] * 3600
+        # The garage misses the oldest hour
+        YoulessEnergyHour(self.devices[0]).store_data(times, np.full(6, 100.0), 'Watt')
+        YoulessEnergyHour(self.devices[1]).store_data(
+            times[1:], np.full(5, 10.0), 'Watt'
+        )
+
+    def test_single_device(self):
+        """
+        ... then the query should read the tables of the chosen device
+        """
+        data = for_device(EnergyDataHour, 'garage', self.devices)().data
+
+        self.assertEqual(len(data), 5)
+        self.assertEqual(set(data['energy_consumption']), {10.0})
+
+    def test_sum_of_devices(self):
+        """
+        ... then the consumption of all devices should be summed per time
+        """
+        data = for_device(EnergyDataHour, ALL_DEVICES, self.devices)().data
+
+        self.assertIsInstance(
+            for_device(EnergyDataHour, ALL_DEVICES, self.devices)(), CombinedData
+        )
+        self.assertEqual(list(data['energy_consumption']), [110.0] * 5 + [100.0])
+        self.assertTrue(data['time'].is_monotonic_decreasing)
+        self.assertEqual(data['avg_energy_consumption'].iloc[0], 110.0)
+
+
+class QueryCacheEvictionTestCase(TestCase):
+    def test_least_recently_used_entries_are_evicted(self):
+        """
+        ... then the cache should stay below its memory limit
+        """
+        df = pd.DataFrame({'a': np.arange(100, dtype=float)})
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        cache = QueryCache(max_bytes=size * 2)
+        cache.put('a', 1, df)
+        cache.put('b', 1, df)
+        cache.get('a', 1)
+        cache.put('c', 1, df)
+
+        self.assertIsNotNone(cache.get('a', 1))
+        self.assertIsNone(cache.get('b', 1))
+        self.assertIsNotNone(cache.get('c', 1))
+        self.assertLessEqual(cache.stats()['bytes'], size * 2)
+        self.assertIsNone(cache.get('c', 2))
+
+    def test_none_results_are_cached(self):
+        """
+        ... then a query without a result should not run again until the table changes
+        """
+        cache = QueryCache(max_bytes=2**20)
+        compute = Mock(return_value=None)
+
+        self.assertEqual(cache.get_or_compute('a', 1, compute), (None, False))
+        self.assertEqual(cache.get_or_compute('a', 1, compute), (None, True))
+        self.assertEqual(compute.call_count, 1)
+
+
+class SharedCacheTestCase(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = tmp_dir.name
+        self.df = pd.DataFrame({'a': np.arange(100, dtype=float)})
+
+    def test_entries_are_shared(self):
+        """
+        ... then an entry stored by one worker should be used by the others until the table changes
+        """
+        first, second = SharedCache(self.path, 2**20), SharedCache(self.path, 2**20)
+        first.put('a', (1,), self.df)
+
+        pd.testing.assert_frame_equal(second.get('a', (1,)), self.df)
+        self.assertIsNone(second.get('a', (2,)))
+        self.assertEqual(second.stats()['entries'], 1)
+
+    def test_one_worker_computes(self):
+        """
+        ... then concurrent misses of the same entry should only compute it once
+        """
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return self.df
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    SharedCache(self.path, 2**20).get_or_compute('a', (1,), compute)
+                )
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(hit for _, hit in results), [False, True, True, True])
+
+    def test_least_recently_used_files_are_evicted(self):
+        """
+        ... then the cache directory should stay below its size limit
+        """
+        cache = SharedCache(self.path, 2**20)
+        cache.put('a', 1, self.df)
+        size = cache.stats()['bytes']
+        cache.max_bytes = size * 2
+        cache.put('b', 1, self.df)
+        os.utime(cache._file('a') + '.pkl', (0, 0))
+        cache.put('c', 1, self.df)
+
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertIsNone(SharedCache(self.path, 2**20).get('a', 1))
+
+    def test_none_results_are_shared(self):
+        """
+        ... then a query without a result should only be computed by one worker
+        """
+        compute = Mock(return_value=None)
+        SharedCache(self.path, 2**20).get_or_compute('a', (1,), compute)
+
+        result = SharedCache(self.path, 2**20).get_or_compute('a', (1,), compute)
+
+        self.assertEqual(result, (None, True))
+        self.assertEqual(compute.call_count, 1)
+
+
+class ReadOnlyTestCase(TempDatabaseTestCase):
+    def test_missing_database_is_not_created(self):
+        """
+        ... then the dashboard should not create a database file
+        """
+        self.assertIsNone(EnergyDataHour().data)
+        self.assertFalse(os.path.exists(self.db_path))
+
+    def test_connection_cannot_write(self):
+        """
+        ... then the dashboard connection should refuse writes
+        """
+        with storage.connect(self.db_path) as con:
+            storage.ensure_table(con, 'youless_hour')
+        con.close()
+
+        con = storage.connect_readonly(self.db_path)
+        self.addCleanup(con.close)
+        with self.assertRaises(sqlite3.OperationalError):
+            con.execute('DELETE FROM youless_hour')
+
+
+class CompactMigrationTestCase(TempDatabaseTestCase):
+    def patches(self) -> list:
+        return super().patches() + [
+            patch.object(YoulessData, 'cache', QueryCache(2**20))
+        ]
+
+    def _size(self):
+        # Pages still in the write-ahead log are not in the file yet
+        with sqlite3.connect(self.db_path) as con:
+            con.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return os.path.getsize(self.db_path)
+
+    @staticmethod
+    def _load():
+        return [
+            data_class().data
+            for data_class in (
+                EnergyDataMinute,
+                EnergyDataHour,
+                EnergyDataDay,
+                EnergyDataMonth,
+            )
+        ]
+
+    def test_migrated_database_returns_same_data(self):
+        """
+        ... then the dashboard queries should return the same DataFrames after migrating
+        """
+        seed_database(self.db_path)
+        before = self._load()
+        size_before = self._size()
+
+        with sqlite3.connect(self.db_path) as con:
+            storage.migrate(con, storage.COMPACT_FORMAT)
+            con.execute('VACUUM')
+            self.assertEqual(storage.storage_format(con), storage.COMPACT_FORMAT)
+        after = self._load()
+
+        for df_before, df_after in zip(before, after):
+            pd.testing.assert_frame_equal(df_before, df_after)
+        self.assertLess(self._size(), size_before)
+
+    def test_failed_migration_changes_nothing(self):
+        """
+        ... then a migration failing halfway should leave the text tables as they were
+        """
+        seed_database(self.db_path)
+        before = self._load()
+        compact_table = storage._compact_table
+        calls = []
+
+        def fail_on_third_table(con, table_name):
+            calls.append(table_name)
+            if len(calls) == 3:
+                raise sqlite3.OperationalError('disk I/O error')
+            compact_table(con, table_name)
+
+        con = sqlite3.connect(self.db_path)
+        self.addCleanup(con.close)
+        with patch('helpers.storage._compact_table', fail_on_third_table):
+            with self.assertRaises(sqlite3.OperationalError):
+                storage.migrate(con, storage.COMPACT_FORMAT)
+
+        self.assertEqual(storage.storage_format(con), storage.TEXT_FORMAT)
+        self.assertFalse(
+            any('__compact' in name for name in storage.youless_tables(con))
+        )
+        for df_before, df_after in zip(before, self._load()):
+            pd.testing.assert_frame_equal(df_before, df_after)
+        storage.migrate(con, storage.COMPACT_FORMAT)
+        self.assertEqual(storage.storage_format(con), storage.COMPACT_FORMAT)
+
+    def test_stale_compact_tables_are_dropped(self):
+        """
+        ... then a table left behind by an interrupted migration should not block the next one
+        """
+        seed_database(self.db_path)
+        con = sqlite3.connect(self.db_path)
+        self.addCleanup(con.close)
+        con.execute('CREATE TABLE youless_day__compact (time INTEGER PRIMARY KEY)')
+        con.commit()
+
+        tables = storage.migrate(con, storage.COMPACT_FORMAT)
+
+        self.assertNotIn('youless_day__compact', tables)
+        self.assertEqual(storage.youless_tables(con), tables)
+        self.assertEqual(storage.storage_format(con), storage.COMPACT_FORMAT)
@@ -0,0 +1,167 @@
+import csv
+import datetime
+import io
+import os
+
+from unittest import skipUnless
+from unittest.mock import patch
+
+import numpy as np
+
+from helpers import storage
+from helpers.archive import Archive
+from helpers.export import CSV_FORMAT, PARQUET_FORMAT, export
+from logger import YoulessArchiver, YoulessEnergyDay, YoulessEnergyMinute
+from test import TempDatabaseTestCase
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class ExportTestCase(TempDatabaseTestCase):
+    storage_format = storage.TEXT_FORMAT
+    now = datetime.datetime(2022, 4, 10, 12, 0, 0)
+
+    def patches(self) -> list:
+        return super().patches() + [patch('logger.STORAGE_FORMAT', self.storage_format)]
+
+    def setUp(self):
+        super().setUp()
+        self.archive = Archive(os.path.join(self.tmp_dir, 'archive'))
+
+        # Three days of minutes up to now, the value is the minute of the hour
+        self.times = np.datetime64(self.now, 's') - np.arange(3 * 1440)[::-1] * 60
+        self.values = (self.times.astype(np.int64) // 60 % 60).astype(float)
+        YoulessEnergyMinute().store_data(self.times, self.values, 'Watt')
+
+    def _csv(self, table_name='youless_minute', start=None, end=None, **kwargs):
+        data = b''.join(
+            export(
+                self.db_path,
+                table_name,
+                start or datetime.datetime(1970, 1, 1),
+                end or datetime.datetime(9999, 1, 1),
+                CSV_FORMAT,
+                archive=self.archive,
+                **kwargs,
+            )
+        )
+        return list(csv.reader(io.StringIO(data.decode())))
+
+    def test_csv_of_a_range(self):
+        """
+        ... then the rows within the range should be exported in order
+        """
+        rows = self._csv(
+            start=datetime.datetime(2022, 4, 10, 11, 0),
+            end=datetime.datetime(2022, 4, 10, 11, 3),
+        )
+
+        self.assertEqual(
+            rows,
+            [
+                ['time', 'energy_consumption', 'unit'],
+                ['2022-04-10 11:00:00', '0.0', 'Watt'],
+                ['2022-04-10 11:01:00', '1.0', 'Watt'],
+                ['2022-04-10 11:02:00', '2.0', 'Watt'],
+            ],
+        )
+
+    def test_aggregation(self):
+        """
+        ... then power should be averaged and amounts summed per bucket
+        """
+        days = np.datetime64('2022-04-08T00:00:00') + np.arange(3) * 86400
+        YoulessEnergyDay().store_data(days, np.array([1.5, 2.5, 3.0]), 'kWh')
+
+        hours = self._csv(
+            start=datetime.datetime(2022, 4, 10, 10, 0),
+            end=datetime.datetime(2022, 4, 10, 12, 0),
+            aggregate='hour',
+        )
+        months = self._csv('youless_day', aggregate='day')
+
+        self.assertEqual(
+            hours[1:],
+            [
+                ['2022-04-10 10:00:00', '29.5', 'Watt'],
+                ['2022-04-10 11:00:00', '29.5', 'Watt'],
+            ],
+        )
+        self.assertEqual([row[1] for row in months[1:]], ['1.5', '2.5', '3.0'])
+
+    def test_archived_rows_are_included_once(self):
+        """
+        ... then archived and live rows should be exported together without duplicates
+        """
+        archiver = YoulessArchiver({'youless_minute': 1}, self.archive.path)
+        archived = archiver.archive_data(now=self.now)['youless_minute']
+
+        rows = self._csv()
+        days = self._csv(aggregate='day')
+
+        self.assertGreater(archived, 0)
+        self.assertEqual(len(rows) - 1, len(self.times))
+        self.assertEqual([row[0] for row in rows[1:]], storage.format_times(self.times))
+        self.assertEqual(len(days) - 1, 4)
+
+    def test_unknown_table(self):
+        """
+        ... then only youless tables should be exported
+        """
+        with self.assertRaises(ValueError):
+            self._csv('sqlite_master')
+
+    @skipUnless(pq, 'pyarrow is not installed')
+    def test_parquet_row_groups(self):
+        """
+        ... then the Parquet file should hold every row, one row group per chunk
+        """
+        data = b''.join(
+            export(
+                self.db_path,
+                'youless_minute',
+                datetime.datetime(1970, 1, 1),
+                datetime.datetime(9999, 1, 1),
+                PARQUET_FORMAT,
+                chunk_size=1000,
+            )
+        )
+
+        parquet = pq.ParquetFile(io.BytesIO(data))
+        table = parquet.read()
+        self.assertEqual(parquet.num_row_groups, 5)
+        self.assertEqual(table.num_rows, len(self.times))
+        self.assertEqual(table.column('energy_consumption').to_pylist()[:3], [1, 2, 3])
+
+
+class CompactExportTestCase(ExportTestCase):
+    storage_format = storage.COMPACT_FORMAT
+
+
+class ExportRouteTestCase(TempDatabaseTestCase):
+    def test_export_route(self):
+        """
+        ... then the dashboard should stream a table as a CSV download
+        """
+        from app import app
+
+        times = np.datetime64('2022-04-10T00:00:00') + np.arange(3) * 60
+        YoulessEnergyMinute().store_data(times, np.arange(3.0), 'Watt')
+
+        with patch('app.DB_PATH', self.db_path):
+            client = app.server.test_client()
+            response = client.get(
+                '/export/youless_minute?start=2022-04-10T00:01&aggregate=hour'
+            )
+            missing = client.get('/export/youless_nothing')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(
+            response.data.decode().splitlines(),
+            ['time,energy_consumption,unit', '2022-04-10 00:00:00,1.5,Watt'],
+        )
+        self.assertEqual(missing.status_code, 400)
@@ -1,9 +1,40 @@
 import datetime
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
 
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
-from logger import YoulessBaseLogger
+import numpy as np
+
+from helpers import storage
+from helpers.devices import Device
+from helpers.retry import DeadlineExceeded, call_with_retries
+from helpers.ringbuffer import RingBuffer
+from logger import (
+    BREAKER_SKIPS,
+    STORE_SECONDS,
+    AlreadyRunning,
+    YoulessBaseLogger,
+    YoulessEnergyDay,
+    YoulessEnergyHour,
+    YoulessEnergyMinute,
+    YoulessSampler,
+    create_scrapers,
+    create_session,
+    rebuild_rollups,
+    run_daemon,
+    run_jobs,
+    run_lock,
+    run_sampler,
+    transaction,
+)
+from benchmarks.simulator import YoulessSimulator
+from test import TempDatabaseTestCase
 
 
 class TestScraper(YoulessBaseLogger):
@@ -14,10 +45,10 @@ class TestScraper(YoulessBaseLogger):
 
 class FetchDataTestCase(TestCase):
     @patch('logger.YoulessBaseLogger.store_data')
-    @patch('logger.YoulessBaseLogger.convert_data')
-    @patch('logger.requests.get')
+    @patch('logger.YoulessBaseLogger.high_water_mark', return_value=None)
+    @patch('logger.SESSION.get')
     def test_fetching_for_day_granularity(
-        self, mocked_get, mocked_convert_data, mocked_store_data
+        self, mocked_get, mocked_mark, mocked_store_data
     ):
         """
         ... then the correct endpoint should have been called 12 times with correct parameters
@@ -42,8 +73,6 @@ class FetchDataTestCase(TestCase):
             ],
         }
         mocked_get.return_value = MagicMock(json=lambda: data)
-        converted_data = YoulessBaseLogger.convert_data(data)
-        mocked_convert_data.return_value = converted_data
 
         scraper = TestScraper()
         scraper.fetch_data()
@@ -52,6 +81,498 @@ class FetchDataTestCase(TestCase):
         mocked_store_data.assert_called_once()
 
 
+class ConcurrentFetchTestCase(TestCase):
+    def _fetch(self, device, workers):
+        scraper = TestScraper()
+        scraper.host = device.url
+        scraper.session = create_session(workers)
+        scraper.fetch_workers = workers
+        pages = list(range(1, scraper.report_pages + 1))
+        start = time.perf_counter()
+        res = scraper.fetch_pages(pages)
+        return res, time.perf_counter() - start
+
+    def test_concurrent_fetch_against_slow_device(self):
+        """
+        ... then all pages should be returned in page order, faster than fetching serially
+        """
+        with YoulessSimulator(latency=0.05) as device:
+            serial, serial_time = self._fetch(device, workers=1)
+            concurrent, concurrent_time = self._fetch(device, workers=6)
+
+        expected = [device.page('test_path', 'm', page) for page in range(1, 13)]
+        self.assertEqual(concurrent, expected)
+        self.assertEqual(serial, concurrent)
+        self.assertLess(concurrent_time, serial_time / 2)
+
+
+class SimulatorTestCase(TestCase):
+    def test_gaps_and_comma_decimals(self):
+        """
+        ... then missing values should be left out and comma decimals parsed
+        """
+        with YoulessSimulator(gap_ratio=0.2, values_per_page=30) as device:
+            scraper = TestScraper()
+            scraper.youless_path = 'W'
+            scraper.host = device.url
+            page = scraper.fetch_page(1)
+
+        times, values, unit = YoulessBaseLogger.convert_columns(page)
+        missing = page['val'].count('*')
+        self.assertGreater(missing, 0)
+        self.assertEqual(len(values), 30 - missing)
+        self.assertEqual(unit, 'm3')
+        self.assertTrue(any(',' in v for v in page['val']))
+        self.assertFalse(np.all(values == values.round()))
+
+    def test_reports_are_aligned(self):
+        """
+        ... then minutes, hours and days should start on their boundaries, with days in kWh
+        """
+        now = datetime.datetime(2022, 4, 10, 12, 11, 30)
+        device = YoulessSimulator(now=now)
+        units = {'h': 'Watt', 'd': 'Watt', 'm': 'kWh'}
+        for param, dt in device.PAGE_PARAMS.items():
+            with self.subTest(param=param):
+                pages = [
+                    YoulessBaseLogger.convert_columns(device.page('V', param, page))
+                    for page in (1, 2)
+                ]
+                for times, _, unit in pages:
+                    self.assertFalse(np.any(times.astype(np.int64) % dt))
+                    self.assertEqual(unit, units[param])
+                newest = pages[0][0][-1]
+                self.assertLessEqual(newest, np.datetime64(now))
+                self.assertGreater(newest + dt, np.datetime64(now))
+
+
+class TestMinuteScraper(YoulessBaseLogger):
+    youless_path = 'V'
+    granularity = 'minute'
+    table_name = 'test_minute_table'
+
+
+class IncrementalFetchTestCase(TestCase):
+    def _scraper(self, device):
+        scraper = TestMinuteScraper()
+        scraper.host = device.url
+        scraper.session = create_session(4)
+        scraper.fetch_workers = 4
+        return scraper
+
+    @patch('logger.FETCH_OVERLAP', 600)
+    @patch('logger.YoulessBaseLogger.store_data')
+    @patch('logger.YoulessBaseLogger.high_water_mark')
+    def test_stops_at_high_water_mark(self, mocked_mark, mocked_store_data):
+        """
+        ... then only the pages reaching back to the mark minus the overlap should be fetched
+        """
+        with YoulessSimulator(values_per_page=30) as device:
+            mark = device.now - datetime.timedelta(minutes=10)
+            mocked_mark.return_value = mark.strftime('%Y-%m-%d %H:%M:%S')
+            self._scraper(device).fetch_data()
+
+        self.assertEqual([q['h'] for _, q in device.requests], [['1']])
+        stored = mocked_store_data.call_args[0][0]
+        self.assertEqual(len(stored), 30)
+
+    @patch('logger.FETCH_OVERLAP', 600)
+    @patch('logger.YoulessBaseLogger.store_data')
+    @patch('logger.YoulessBaseLogger.high_water_mark')
+    def test_stops_on_older_page(self, mocked_mark, mocked_store_data):
+        """
+        ... then fetching should stop once a page reaches back before the mark
+        """
+        with YoulessSimulator(values_per_page=30) as device:
+            mark = device.now - datetime.timedelta(minutes=90)
+            mocked_mark.return_value = mark.strftime('%Y-%m-%d %H:%M:%S')
+            self._scraper(device).fetch_data()
+
+        pages = sorted(int(q['h'][0]) for _, q in device.requests)
+        self.assertEqual(pages, [1, 2, 3, 4, 5, 6, 7])
+
+    @patch('logger.YoulessBaseLogger.store_data')
+    @patch('logger.YoulessBaseLogger.high_water_mark')
+    def test_full_rescan(self, mocked_mark, mocked_store_data):
+        """
+        ... then all pages should be fetched regardless of the stored mark
+        """
+        with YoulessSimulator(values_per_page=30) as device:
+            mocked_mark.return_value = device.now.strftime('%Y-%m-%d %H:%M:%S')
+            self._scraper(device).fetch_data(full_scan=True)
+
+        self.assertEqual(len(device.requests), 20)
+        mocked_mark.assert_not_called()
+
+    @patch('logger.YoulessBaseLogger.store_data')
+    @patch('logger.YoulessBaseLogger.high_water_mark')
+    def test_empty_table(self, mocked_mark, mocked_store_data):
+        """
+        ... then all pages should be fetched when nothing has been stored yet
+        """
+        mocked_mark.return_value = None
+        with YoulessSimulator(values_per_page=30) as device:
+            self._scraper(device).fetch_data()
+
+        self.assertEqual(len(device.requests), 20)
+
+
+class DaemonTestCase(TestCase):
+    def test_scrapers_run_at_their_own_interval(self):
+        """
+        ... then every scraper should be run once per interval until stopped
+        """
+        fast = MagicMock(interval=0.05)
+        slow = MagicMock(interval=60)
+        stop = threading.Event()
+        daemon = threading.Thread(target=run_daemon, args=([fast, slow], stop))
+        daemon.start()
+        time.sleep(0.22)
+        stop.set()
+        daemon.join(timeout=1)
+
+        self.assertFalse(daemon.is_alive())
+        self.assertGreaterEqual(fast.run.call_count, 4)
+        slow.run.assert_called_once_with(full_scan=False)
+
+    def test_failing_scraper_keeps_daemon_alive(self):
+        """
+        ... then an exception in one scraper should not stop the others
+        """
+        failing = MagicMock(interval=0.05)
+        failing.run.side_effect = ConnectionError
+        working = MagicMock(interval=0.05)
+        stop = threading.Event()
+        daemon = threading.Thread(target=run_daemon, args=([failing, working], stop))
+        daemon.start()
+        time.sleep(0.12)
+        stop.set()
+        daemon.join(timeout=1)
+
+        self.assertGreaterEqual(working.run.call_count, 2)
+
+
+class MultiDeviceTestCase(TempDatabaseTestCase):
+    def _count(self, table_name):
+        with sqlite3.connect(self.db_path) as con:
+            return con.execute(f'SELECT COUNT(*) FROM {table_name}').fetchone()[0]
+
+    def test_devices_are_collected_concurrently(self):
+        """
+        ... then every device should be stored in its own tables, in parallel
+        """
+        with YoulessSimulator(latency=0.02) as first, YoulessSimulator(
+            latency=0.02
+        ) as second:
+            devices = [
+                Device('house', first.url, gas_enabled=True),
+                Device('garage', second.url),
+            ]
+            start = time.perf_counter()
+            failed = run_jobs(create_scrapers(devices))
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(failed, 0)
+        for table_name in ('youless_minute', 'youless_hour', 'youless_day'):
+            self.assertEqual(
+                self._count(f'{table_name}__house'),
+                self._count(f'{table_name}__garage'),
+            )
+        self.assertGreater(self._count('youless_hour_gas__house'), 0)
+        self.assertEqual(len(second.requests), 20 + 70 + 12)
+        # Sequential collection needs at least the latency of all requests
+        self.assertLess(elapsed, (len(first.requests) + len(second.requests)) * 0.02)
+
+    def test_failing_device_does_not_stop_the_others(self):
+        """
+        ... then an unreachable device should only fail its own jobs
+        """
+        with YoulessSimulator() as device:
+            devices = [
+                Device('online', device.url),
+                Device('offline', 'http://127.0.0.1:9/', timeout=0.5),
+            ]
+            failed = run_jobs(create_scrapers(devices))
+
+        self.assertEqual(failed, 3)
+        self.assertGreater(self._count('youless_minute__online'), 0)
+
+    def test_invalid_device_name(self):
+        """
+        ... then device names which cannot be part of a table name should be refused
+        """
+        with self.assertRaises(ValueError):
+            Device('garage; DROP TABLE youless_minute')
+
+
+class TransactionTestCase(TempDatabaseTestCase):
+    def _count(self, table_name):
+        with sqlite3.connect(self.db_path) as con:
+            return con.execute(f'SELECT COUNT(*) FROM {table_name}').fetchone()[0]
+
+    def test_all_scrapers_commit_once(self):
+        """
+        ... then the data of every scraper and device should be stored in one commit
+        """
+        before = STORE_SECONDS.count(table='*', step='commit')
+        with YoulessSimulator() as first, YoulessSimulator() as second:
+            devices = [Device('house', first.url), Device('garage', second.url)]
+            failed = run_jobs(create_scrapers(devices))
+
+        self.assertEqual(failed, 0)
+        self.assertEqual(STORE_SECONDS.count(table='*', step='commit') - before, 1)
+        self.assertGreater(self._count('youless_day__house'), 0)
+        self.assertGreater(self._count('youless_minute__garage'), 0)
+
+    def test_failing_batch_is_rolled_back_alone(self):
+        """
+        ... then a batch failing to store should not lose the others
+        """
+        with YoulessSimulator() as device:
+            scrapers = create_scrapers([Device('', device.url)])
+            with patch.object(
+                scrapers[1], 'store_batch', side_effect=sqlite3.OperationalError
+            ):
+                failed = run_jobs(scrapers)
+
+        self.assertEqual(failed, 1)
+        self.assertGreater(self._count('youless_minute'), 0)
+        self.assertGreater(self._count('youless_day'), 0)
+        with sqlite3.connect(self.db_path) as con:
+            self.assertFalse(storage.table_exists(con, 'youless_hour'))
+
+    def test_readers_are_not_blocked(self):
+        """
+        ... then the dashboard should read while the logger is writing
+        """
+        times = np.datetime64('2022-04-10T00:00:00') + np.arange(5) * 3600
+        YoulessEnergyHour().store_data(times, np.arange(5.0), 'Watt')
+
+        with transaction() as con:
+            con.execute('DELETE FROM youless_hour')
+            reader = sqlite3.connect(self.db_path, timeout=0)
+            count = reader.execute('SELECT COUNT(*) FROM youless_hour').fetchone()[0]
+            reader.close()
+            con.rollback()
+
+        self.assertEqual(count, 5)
+        with sqlite3.connect(self.db_path) as con:
+            self.assertEqual(con.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_reads_do_not_wait_for_a_transaction(self):
+        """
+        ... then reading the high-water mark should not wait for a running transaction
+        """
+        times = np.datetime64('2022-04-10T00:00:00') + np.arange(5) * 3600
+        YoulessEnergyHour().store_data(times, np.arange(5.0), 'Watt')
+        marks = []
+
+        with transaction():
+            reader = threading.Thread(
+                target=lambda: marks.append(YoulessEnergyHour().high_water_mark())
+            )
+            reader.start()
+            reader.join(timeout=1)
+
+        self.assertEqual(marks, ['2022-04-10 04:00:00'])
+
+
+class RetryTestCase(TempDatabaseTestCase):
+    def patches(self) -> list:
+        return super().patches() + [patch.object(YoulessBaseLogger, 'backoff', 0.01)]
+
+    def _meta(self, table_name, key):
+        with sqlite3.connect(self.db_path) as con:
+            return storage.get_meta(con, table_name, key)
+
+    def test_failed_request_is_retried(self):
+        """
+        ... then a page the device fails to answer once should be fetched on the next attempt
+        """
+        with YoulessSimulator(failing_pages={1: 2}) as device:
+            scraper = TestScraper()
+            scraper.host = device.url
+            page = scraper.fetch_page(1)
+
+            self.assertEqual(page, device.page('test_path', 'm', 1))
+            self.assertEqual(len(device.requests), 3)
+
+    def test_retries_stop_at_the_deadline(self):
+        """
+        ... then no attempt should start once the deadline of the run has passed
+        """
+        calls = []
+
+        def failing(timeout):
+            calls.append(timeout)
+            raise ConnectionError
+
+        # The longest waits, random ones could all fit before the deadline
+        with patch(
+            'helpers.retry.backoff_delay', lambda backoff, attempt: backoff * 2**attempt
+        ), self.assertRaises(DeadlineExceeded):
+            call_with_retries(failing, 10, 5, 0.05, time.monotonic() + 0.2)
+        with self.assertRaises(DeadlineExceeded):
+            call_with_retries(failing, 10, 5, 0.05, time.monotonic() - 1)
+
+        self.assertTrue(all(timeout <= 0.2 for timeout in calls))
+        self.assertLess(len(calls), 6)
+
+    def test_partial_pages_are_stored(self):
+        """
+        ... then the pages fetched before a failing one should be stored, without raising the high-water mark
+        """
+        with YoulessSimulator(failing_pages={3: float('inf')}) as device:
+            scraper = create_scrapers([Device('', device.url)])[0]
+            scraper.fetch_workers = 1
+            failed = run_jobs([scraper])
+
+        with sqlite3.connect(self.db_path) as con:
+            count = con.execute('SELECT COUNT(*) FROM youless_minute').fetchone()[0]
+        self.assertEqual(failed, 1)
+        self.assertEqual(count, 2 * 24)
+        self.assertIsNone(self._meta('youless_minute', 'high_water_mark'))
+
+    def test_run_stops_at_timeout(self):
+        """
+        ... then a stalling device should not keep a run going past its timeout
+        """
+        with YoulessSimulator(latency=0.3) as device:
+            scrapers = create_scrapers([Device('', device.url, timeout=5)])
+            start = time.perf_counter()
+            failed = run_jobs(scrapers, timeout=0.5)
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(failed, 3)
+        self.assertLess(elapsed, 1.5)
+
+    @patch('logger.BREAKER.threshold', 2)
+    def test_breaker_skips_failing_scraper(self):
+        """
+        ... then a scraper failing repeatedly should be skipped until the cooldown has passed
+        """
+        scraper = create_scrapers([Device('', 'http://127.0.0.1:9/', timeout=0.2)])[0]
+        scraper.retries = 0
+        before = BREAKER_SKIPS.value(table='youless_minute')
+
+        self.assertEqual(run_jobs([scraper]), 1)
+        self.assertEqual(run_jobs([scraper]), 1)
+        self.assertGreater(self._meta('youless_minute', 'breaker_open_until'), 0)
+        empty = (np.array([], 'M8[s]'), np.array([]), None)
+        with patch.object(scraper, 'collect', return_value=empty) as collect:
+            self.assertEqual(run_jobs([scraper]), 0)
+            collect.assert_not_called()
+            with patch('logger.time.time', return_value=time.time() + 3600):
+                run_jobs([scraper])
+            collect.assert_called_once()
+
+        self.assertEqual(BREAKER_SKIPS.value(table='youless_minute') - before, 1)
+        self.assertEqual(self._meta('youless_minute', 'breaker_failures'), 0)
+
+    def test_overlapping_runs_are_refused(self):
+        """
+        ... then a second run should not get the lock while the first one holds it
+        """
+        path = os.path.join(self.tmp_dir, 'youless.lock')
+        lock = run_lock(path)
+        with self.assertRaises(AlreadyRunning):
+            run_lock(path)
+        lock.close()
+
+        run_lock(path).close()
+
+
+class SamplerTestCase(TempDatabaseTestCase):
+    def patches(self) -> list:
+        return super().patches() + [
+            patch('logger.LOCK_PATH', os.path.join(self.tmp_dir, 'youless.lock'))
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.simulator = YoulessSimulator().__enter__()
+        self.addCleanup(self.simulator.__exit__)
+
+    def _sampler(self, **kwargs):
+        sampler = YoulessSampler(
+            Device('', self.simulator.url),
+            buffer_name=f'youless_test_{os.getpid()}',
+            **kwargs,
+        )
+        self.addCleanup(sampler.close)
+        return sampler
+
+    def _rows(self):
+        with sqlite3.connect(self.db_path) as con:
+            return con.execute(
+                'SELECT time, energy_consumption FROM youless_live ORDER BY time'
+            ).fetchall()
+
+    def test_samples_are_flushed_in_batches(self):
+        """
+        ... then samples should stay in memory until a flush writes them at once
+        """
+        sampler = self._sampler(interval=5, buffer_seconds=60)
+        start = datetime.datetime(2022, 4, 10, 12, 0, 0)
+        powers = [
+            sampler.sample(start + datetime.timedelta(seconds=5 * i)) for i in range(3)
+        ]
+
+        self.assertFalse(os.path.exists(self.db_path))
+        self.assertEqual(sampler.flush(), 3)
+        self.assertEqual(sampler.flush(), 0)
+        sampler.sample(start + datetime.timedelta(seconds=15))
+        self.assertEqual(sampler.flush(), 1)
+
+        rows = self._rows()
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0], ('2022-04-10 12:00:00', powers[0]))
+        self.assertEqual(self.simulator.requests[0][0], '/a')
+
+    def test_run_sampler_flushes_on_stop(self):
+        """
+        ... then stopping the sampler should store the samples not flushed yet
+        """
+        sampler = self._sampler(interval=0.01, flush_interval=3600)
+        stop = threading.Event()
+        thread = threading.Thread(target=run_sampler, args=(sampler, stop))
+        thread.start()
+        time.sleep(0.1)
+        stop.set()
+        thread.join()
+
+        self.assertGreater(len(self._rows()), 0)
+
+    def test_running_buffer_is_not_reclaimed(self):
+        """
+        ... then a second sampler of the same buffer should be refused while the first runs
+        """
+        sampler = self._sampler()
+        power = sampler.sample()
+
+        with self.assertRaises(AlreadyRunning):
+            self._sampler()
+        reader = RingBuffer.attach(sampler.buffer.name)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.read()[1].tolist(), [power])
+        sampler.close()
+
+        self.assertEqual(self._sampler().buffer.written, 0)
+
+
+class StartupTestCase(TestCase):
+    def test_logger_does_not_import_pandas(self):
+        """
+        ... then importing the logger should not pull in pandas
+        """
+        code = 'import sys, logger; print("pandas" in sys.modules)'
+        res = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True
+        )
+
+        self.assertEqual(res.stdout.strip(), 'False')
+
+
 class ConvertDataTestCase(TestCase):
     @patch('logger.requests.get')
     def test_data_provided(self, mocked_get):
@@ -77,3 +598,171 @@ class ConvertDataTestCase(TestCase):
         self.assertEqual(first_row['time'], expected_timestamp)
         self.assertEqual(first_row['unit'], excpected_unit)
         self.assertCountEqual(energy_consumption, expected_energy_consumption)
+
+    def test_missing_values(self):
+        """
+        ... then missing values should be skipped without shifting the timestamps
+        """
+        data = {
+            'un': 'kWh',
+            'tm': '2022-04-10T00:00:00',
+            'dt': 86400,
+            'val': [' 1,5', '*', '', ' 2,25'],
+        }
+
+        times, values, unit = YoulessBaseLogger.convert_columns(data)
+
+        self.assertEqual(
+            times.tolist(),
+            [datetime.datetime(2022, 4, 10), datetime.datetime(2022, 4, 13)],
+        )
+        self.assertEqual(values.tolist(), [1.5, 2.25])
+        self.assertEqual(unit, 'kWh')
+
+
+class StoreDataTestCase(TempDatabaseTestCase):
+    def _rows(self):
+        with sqlite3.connect(self.db_path) as con:
+            return con.execute(
+                'SELECT time, energy_consumption, unit FROM test_table ORDER BY time'
+            ).fetchall()
+
+    @staticmethod
+    def _columns(values, start='2022-04-10T00:00:00'):
+        times = np.datetime64(start, 's') + np.arange(len(values)) * 3600
+        return times, np.array(values), 'Watt'
+
+    def test_merge_overlapping_batches(self):
+        """
+        ... then existing values should be updated and new ones appended without duplicates
+        """
+        scraper = TestScraper()
+        scraper.store_data(*self._columns([1.0, 2.0, 3.0]))
+        scraper.store_data(
+            *self._columns([30.0, 4.0, 5.0], start='2022-04-10T02:00:00')
+        )
+
+        rows = self._rows()
+        self.assertEqual([r[1] for r in rows], [1.0, 2.0, 30.0, 4.0, 5.0])
+        self.assertEqual(rows[0][0], '2022-04-10 00:00:00')
+        with sqlite3.connect(self.db_path) as con:
+            mark = storage.get_meta(con, 'test_table', 'high_water_mark')
+        self.assertEqual(mark, '2022-04-10 04:00:00')
+
+    def test_ensure_existing_table(self):
+        """
+        ... then the storage format should be returned for new and existing tables
+        """
+        for fmt in (storage.TEXT_FORMAT, storage.COMPACT_FORMAT):
+            with self.subTest(fmt), sqlite3.connect(
+                os.path.join(os.path.dirname(self.db_path), f'{fmt}.db')
+            ) as con:
+                self.assertEqual(storage.ensure_table(con, 'test_table', fmt), fmt)
+                self.assertEqual(storage.ensure_table(con, 'test_table', fmt), fmt)
+
+    def test_migrate_legacy_table(self):
+        """
+        ... then duplicates should be removed and a unique key on time should be added
+        """
+        with sqlite3.connect(self.db_path) as con:
+            con.execute(
+                'CREATE TABLE youless_hour (time TIMESTAMP, energy_consumption REAL, unit TEXT)'
+            )
+            con.executemany(
+                'INSERT INTO youless_hour VALUES (?, ?, ?)',
+                [
+                    ('2022-04-10 00:00:00', 1.0, 'Watt'),
+                    ('2022-04-10 00:00:00', 2.0, 'Watt'),
+                    ('2022-04-10 01:00:00', 3.0, 'Watt'),
+                ],
+            )
+            self.assertEqual(storage.migrate(con), ['youless_hour'])
+            rows = con.execute('SELECT * FROM youless_hour ORDER BY time').fetchall()
+            with self.assertRaises(sqlite3.IntegrityError):
+                con.execute(
+                    "INSERT INTO youless_hour VALUES ('2022-04-10 01:00:00', 4, 'Watt')"
+                )
+
+        self.assertEqual(
+            rows,
+            [
+                ('2022-04-10 00:00:00', 2.0, 'Watt'),
+                ('2022-04-10 01:00:00', 3.0, 'Watt'),
+            ],
+        )
+
+
+class RollupTestCase(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.random = np.random.default_rng(42)
+
+    def _store_batches(self, scraper, step, batches=8, size=500):
+        start = np.datetime64('2022-01-01T00:00:00', 's')
+        for i in range(batches):
+            # Every batch overlaps and corrects the previous one
+            offset = i * size // 2
+            times = start + (offset + np.arange(size)) * step
+            values = self.random.integers(0, 3000, size).astype(float)
+            scraper.store_data(times, values, 'Watt')
+
+    def _assert_consistent(self, table_name, bucket_format):
+        with sqlite3.connect(self.db_path) as con:
+            expected = con.execute(f"""
+                SELECT strftime('{bucket_format}', time), AVG(energy_consumption)
+                FROM {table_name}
+                GROUP BY 1
+                ORDER BY 1
+                """).fetchall()
+            rollup = con.execute(
+                """
+                SELECT bucket, total / count
+                FROM youless_rollup
+                WHERE table_name = ?
+                ORDER BY bucket
+                """,
+                (table_name,),
+            ).fetchall()
+
+        self.assertEqual([b for b, _ in rollup], [b for b, _ in expected])
+        np.testing.assert_allclose([a for _, a in rollup], [a for _, a in expected])
+
+    def test_incremental_rollups_match_full_scan(self):
+        """
+        ... then the incrementally maintained averages should equal a full recomputation
+        """
+        self._store_batches(YoulessEnergyMinute(), step=60)
+        self._store_batches(YoulessEnergyHour(), step=3600)
+        self._store_batches(YoulessEnergyDay(), step=86400, size=50)
+
+        self._assert_consistent('youless_minute', '%H:%M')
+        self._assert_consistent('youless_hour', '%H')
+        self._assert_consistent('youless_day', '%w')
+
+    def test_rollup_of_existing_table_is_bootstrapped(self):
+        """
+        ... then a table logged before rollups existed should be rolled up on the next store
+        """
+        with sqlite3.connect(self.db_path) as con:
+            con.execute(
+                'CREATE TABLE youless_hour (time TIMESTAMP, energy_consumption REAL, unit TEXT)'
+            )
+            con.executemany(
+                'INSERT INTO youless_hour VALUES (?, ?, ?)',
+                [('2021-12-31 {:02d}:00:00'.format(h), h, 'Watt') for h in range(24)],
+            )
+        self._store_batches(YoulessEnergyHour(), step=3600, batches=2)
+
+        self._assert_consistent('youless_hour', '%H')
+
+    def test_rebuild(self):
+        """
+        ... then rebuilding should repair a corrupted rollup
+        """
+        self._store_batches(YoulessEnergyHour(), step=3600, batches=2)
+        with sqlite3.connect(self.db_path) as con:
+            con.execute('UPDATE youless_rollup SET total = 0')
+
+        rebuild_rollups()
+
+        self._assert_consistent('youless_hour', '%H')
@@ -0,0 +1,93 @@
+import os
+
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from helpers.metrics import Registry
+from test import TempDatabaseTestCase
+
+
+class RegistryTestCase(TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        ... then every bucket should count the observations up to its bound
+        """
+        registry = Registry()
+        histogram = registry.histogram('test_seconds', 'Test', ('stage',), (0.1, 1))
+        for value in (0.05, 0.5, 0.7, 5):
+            histogram.observe(value, stage='fetch')
+
+        lines = registry.render().splitlines()
+        self.assertIn('test_seconds_bucket{stage="fetch",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{stage="fetch"} 4', lines)
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertEqual(histogram.count(stage='fetch'), 4)
+
+    def test_labels_must_match(self):
+        """
+        ... then using a metric with other labels than declared should fail
+        """
+        counter = Registry().counter('test_total', 'Test', ('table',))
+
+        with self.assertRaises(ValueError):
+            counter.inc(page=1)
+
+    def test_collectors_run_before_rendering(self):
+        """
+        ... then values kept elsewhere should be up to date in the output
+        """
+        registry = Registry()
+        gauge = registry.gauge('test_entries', 'Test')
+        registry.add_collector(lambda: gauge.set(42))
+
+        self.assertIn('test_entries 42', registry.render().splitlines())
+
+
+class LoggerMetricsTestCase(TempDatabaseTestCase):
+    def test_store_writes_metrics_file(self):
+        """
+        ... then the metrics file should contain the written rows and store timings
+        """
+        from logger import ROWS_WRITTEN, YoulessEnergyHour, write_metrics
+
+        metrics_path = os.path.join(self.tmp_dir, 'youless.prom')
+        before = ROWS_WRITTEN.value(table='youless_hour', operation='inserted')
+        times = np.datetime64('2022-04-10T00:00:00') + np.arange(5) * 3600
+        YoulessEnergyHour().store_data(times, np.arange(5.0), 'Watt')
+        with patch('logger.METRICS_PATH', metrics_path):
+            write_metrics()
+
+        with open(metrics_path) as f:
+            lines = f.read().splitlines()
+        after = ROWS_WRITTEN.value(table='youless_hour', operation='inserted')
+        self.assertEqual(after - before, 5)
+        self.assertIn(
+            f'youless_rows_written_total{{table="youless_hour",operation="inserted"}} {after}',
+            lines,
+        )
+        self.assertTrue(
+            any(
+                line.startswith(
+                    'youless_store_seconds_count{table="youless_hour",step="commit"}'
+                )
+                for line in lines
+            )
+        )
+
+
+class MetricsRouteTestCase(TestCase):
+    def test_metrics_route(self):
+        """
+        ... then the dashboard should serve the metrics in the text format
+        """
+        from app import app
+
+        response = app.server.test_client().get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn(b'# TYPE youless_query_cache_entries gauge', response.data)
@@ -0,0 +1,166 @@
+import datetime
+import os
+import re
+import sqlite3
+import tempfile
+
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from helpers.data_processing import (
+    EnergyDataDay,
+    EnergyDataHour,
+    EnergyDataMinute,
+    EnergyDataMonth,
+    EnergyRangeData,
+    GasDataDay,
+    GasDataHour,
+    GasDataMonth,
+)
+from helpers import storage, summary
+from logger import SCRAPERS
+
+DASHBOARD_QUERIES = [
+    EnergyDataMinute,
+    EnergyDataHour,
+    EnergyDataDay,
+    EnergyDataMonth,
+    GasDataHour,
+    GasDataDay,
+    GasDataMonth,
+]
+STEPS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def seed_database(db_path, storage_format=storage.TEXT_FORMAT):
+    with patch('logger.DB_PATH', db_path), patch(
+        'logger.STORAGE_FORMAT', storage_format
+    ):
+        now = np.datetime64(datetime.datetime.now(), 'm').astype('M8[s]')
+        for scraper in SCRAPERS:
+            step = STEPS[scraper.granularity]
+            times = now - np.arange(5000)[::-1] * step
+            values = np.round(np.random.default_rng(0).random(5000) * 1000, 3)
+            scraper().store_data(times, values, 'Watt')
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Every dashboard query has to find its rows through an index. A SCAN is
+    only allowed on the intermediate results of the query's own CTEs.
+    """
+
+    storage_format = storage.TEXT_FORMAT
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.db_path = os.path.join(cls.tmp_dir.name, 'youless.db')
+        seed_database(cls.db_path, cls.storage_format)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def _plan(self, data_class):
+        return self._explain(data_class.__new__(data_class))
+
+    def _explain(self, data):
+        with sqlite3.connect(self.db_path) as con:
+            query, params = data.prepare(con)
+            rows = con.execute('EXPLAIN QUERY PLAN ' + query, params)
+            return query, [row[3] for row in rows]
+
+    def test_no_full_table_scans(self):
+        """
+        ... then no query plan should contain a full scan of a table
+        """
+        for data_class in DASHBOARD_QUERIES:
+            with self.subTest(data_class.__name__):
+                query, plan = self._plan(data_class)
+                ctes = set(re.findall(r'(\w+) AS \(', query))
+                scans = [re.match(r'SCAN (\w+)', line) for line in plan]
+                full_scans = [m.group(1) for m in scans if m and m.group(1) not in ctes]
+
+                self.assertEqual(full_scans, [], '\n'.join(plan))
+                self.assertTrue(any(line.startswith('SEARCH') for line in plan))
+
+    def test_minute_averages_by_key(self):
+        """
+        ... then the average of every minute should be looked up by the rollup's key
+        """
+        _, plan = self._plan(EnergyDataMinute)
+        rollup = [line for line in plan if storage.ROLLUP_TABLE in line]
+
+        self.assertTrue(rollup, '\n'.join(plan))
+        for line in rollup:
+            self.assertIn('(table_name=? AND bucket=?)', line)
+
+    def test_summary_without_full_scans(self):
+        """
+        ... then the summary update at ingest should only search the windows
+        """
+        with sqlite3.connect(self.db_path) as con:
+            query = summary.summary_query(con, 'youless_hour', 'youless_day')
+            params = summary.summary_params(
+                con, 'youless_hour', datetime.datetime.now()
+            )
+            plan = [
+                row[3] for row in con.execute('EXPLAIN QUERY PLAN ' + query, params)
+            ]
+        # The outer SELECT of the figures has no FROM (SCAN CONSTANT ROW)
+        ctes = set(re.findall(r'(\w+) AS \(', query)) | {'CONSTANT'}
+        scans = [re.match(r'SCAN (\w+)', line) for line in plan]
+
+        self.assertEqual(
+            [m.group(1) for m in scans if m and m.group(1) not in ctes],
+            [],
+            '\n'.join(plan),
+        )
+
+    def test_queries_return_data(self):
+        """
+        ... then the bounded queries should still return the dashboard windows
+        """
+        expected_rows = {EnergyDataMinute: 721, EnergyDataHour: 24, EnergyDataDay: 365}
+        with patch('helpers.data_processing.DB_PATH', self.db_path):
+            for data_class, rows in expected_rows.items():
+                with self.subTest(data_class.__name__):
+                    # One row more or less when the minute changes in between
+                    self.assertAlmostEqual(len(data_class().data), rows, delta=1)
+            self.assertEqual(len(EnergyDataMonth().data), 12)
+
+    def test_range_queries(self):
+        """
+        ... then every range should be read from the coarsest sufficient table by index
+        """
+        end = datetime.datetime.now().replace(second=0, microsecond=0)
+        ranges = {
+            datetime.timedelta(hours=1): ('minute', 60),
+            datetime.timedelta(days=2): ('minute', 2880),
+            datetime.timedelta(days=30): ('hour', 720),
+            datetime.timedelta(days=3 * 365): ('day', 1095),
+            datetime.timedelta(days=10 * 365): ('month', None),
+        }
+        with patch('helpers.data_processing.DB_PATH', self.db_path):
+            for length, (resolution, rows) in ranges.items():
+                with self.subTest(length):
+                    data = EnergyRangeData(end - length, end)
+                    query, plan = self._explain(data)
+                    ctes = set(re.findall(r'(\w+) AS \(', query))
+                    scans = [re.match(r'SCAN (\w+)', line) for line in plan]
+
+                    self.assertEqual(data.resolution, resolution)
+                    self.assertEqual(
+                        [m.group(1) for m in scans if m and m.group(1) not in ctes],
+                        [],
+                        '\n'.join(plan),
+                    )
+                    if rows:
+                        self.assertEqual(len(data.data), rows)
+
+
+class CompactQueryPlanTestCase(QueryPlanTestCase):
+    storage_format = storage.COMPACT_FORMAT
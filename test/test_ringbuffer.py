@@ -0,0 +1,53 @@
+import os
+
+from unittest import TestCase
+
+import numpy as np
+
+from helpers.ringbuffer import RingBuffer
+
+
+class RingBufferTestCase(TestCase):
+    def test_oldest_samples_are_overwritten(self):
+        """
+        ... then only the newest samples should be kept, oldest first
+        """
+        ring = RingBuffer(4)
+        ring.append(np.arange(3), np.arange(3.0))
+        ring.append(np.arange(3, 6), np.arange(3.0, 6.0))
+
+        times, values, written = ring.read()
+        self.assertEqual(times.tolist(), [2, 3, 4, 5])
+        self.assertEqual(values.tolist(), [2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(written, 6)
+        # Reading from a position returns only the newer samples
+        self.assertEqual(ring.read(4)[0].tolist(), [4, 5])
+        # Positions which were overwritten already are skipped
+        self.assertEqual(ring.read(1)[0].tolist(), [2, 3, 4, 5])
+
+    def test_shared_memory(self):
+        """
+        ... then another reader should see the samples of the writer
+        """
+        name = f'youless_test_{os.getpid()}'
+        ring = RingBuffer(10, name)
+        self.addCleanup(ring.close, unlink=True)
+        ring.append([1650000000], [512.0])
+
+        reader = RingBuffer.attach(name)
+        times, values, _ = reader.read()
+        ring.append([1650000005], [480.0])
+        newer, _, _ = reader.read()
+        reader.close()
+
+        self.assertEqual(reader.name, name)
+        self.assertEqual(times.tolist(), [1650000000])
+        self.assertEqual(values.tolist(), [512.0])
+        self.assertEqual(newer.tolist(), [1650000000, 1650000005])
+
+    def test_attach_without_writer(self):
+        """
+        ... then attaching to a buffer nobody created should fail
+        """
+        with self.assertRaises(FileNotFoundError):
+            RingBuffer.attach(f'youless_missing_{os.getpid()}')
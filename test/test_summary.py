@@ -0,0 +1,105 @@
+import datetime
+import sqlite3
+
+from unittest.mock import patch
+
+import numpy as np
+
+from helpers import storage, summary
+from helpers.data_processing import (
+    EnergyDataDay,
+    EnergyDataHour,
+    EnergyDataMonth,
+    QueryCache,
+    SummaryData,
+    YoulessData,
+)
+from helpers.charts import summary_figures
+from helpers.devices import Device
+from logger import YoulessEnergyHour, verify_summaries
+from test import TempDatabaseTestCase
+from test.test_query_plans import seed_database
+
+
+class SummaryTestCase(TempDatabaseTestCase):
+    storage_format = storage.TEXT_FORMAT
+
+    def patches(self) -> list:
+        return super().patches() + [
+            patch.object(YoulessData, 'cache', QueryCache(2**20))
+        ]
+
+    def setUp(self):
+        super().setUp()
+        seed_database(self.db_path, self.storage_format)
+        self.now = datetime.datetime.now().replace(second=0, microsecond=0)
+        with sqlite3.connect(self.db_path) as con:
+            summary.update_summary(con, 'youless_hour', now=self.now)
+
+    def test_same_figures_as_dashboard(self):
+        """
+        ... then the stored summary should equal the figures of the dashboard queries
+        """
+        with patch.object(YoulessData, 'now', staticmethod(lambda: self.now)):
+            expected = summary_figures(
+                EnergyDataHour().data, EnergyDataDay().data, EnergyDataMonth().data
+            )
+        stored = SummaryData([Device()])
+
+        self.assertTrue(stored.complete)
+        for figure in summary.FIGURES:
+            with self.subTest(figure):
+                self.assertAlmostEqual(stored.figures[figure], expected[figure])
+
+    def test_verify_finds_changed_figures(self):
+        """
+        ... then verification should only report figures which differ from a full recomputation
+        """
+        self.assertEqual(verify_summaries(), 0)
+
+        with sqlite3.connect(self.db_path) as con:
+            self.assertEqual(summary.verify_summary(con), [])
+            con.execute('''
+                UPDATE youless_summary SET last_30d = last_30d + 1
+                WHERE source = 'youless_hour'
+                ''')
+            mismatches = summary.verify_summary(con)
+
+        self.assertEqual(
+            [(source, figure) for source, figure, *_ in mismatches],
+            [('youless_hour', 'last_30d')],
+        )
+
+    def test_updated_at_ingest(self):
+        """
+        ... then storing hours should update the summary in the same transaction
+        """
+        hour = self.now.replace(minute=0)
+        YoulessEnergyHour().store_data(
+            np.array([np.datetime64(hour, 's')]), np.array([5000.0]), 'Watt'
+        )
+
+        with sqlite3.connect(self.db_path) as con:
+            stored = con.execute(
+                'SELECT last_24h FROM youless_summary WHERE source = ?',
+                ('youless_hour',),
+            ).fetchone()[0]
+            mismatches = summary.verify_summary(con)
+            recomputed = summary.compute_summary(
+                con, 'youless_hour', 'youless_day', datetime.datetime.now()
+            )
+
+        self.assertEqual(mismatches, [])
+        self.assertAlmostEqual(stored, recomputed['last_24h'])
+
+    def test_missing_device_is_incomplete(self):
+        """
+        ... then the summary of several devices should be incomplete until all are stored
+        """
+        data = SummaryData([Device(), Device('garage')])
+
+        self.assertFalse(data.complete)
+
+
+class CompactSummaryTestCase(SummaryTestCase):
+    storage_format = storage.COMPACT_FORMAT
@@ -0,0 +1,12 @@
+"""
+Entry point of the dashboard for a WSGI server with several worker processes,
+e.g.
+
+    gunicorn --workers 4 --bind 0.0.0.0:8050 wsgi:server
+
+Configure `cache_path` so the workers share their query results and figures.
+"""
+
+from app import app
+
+server = app.server